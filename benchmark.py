@@ -0,0 +1,214 @@
+"""Benchmarks of syncing orders from db to google spreadsheets on synthetic WooCommerce data.
+
+Spreadsheet write strategies run against in-memory spreadsheet from fake_sheets. Db cases need local MySQL server.
+Tables are dropped and created again in BENCH_DB_NAME database, which has to be set explicitly and is never
+the shop database.
+
+Usage: python benchmark.py --scale 1000 --scale 10000 --json bench_output.json
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+import mysql.connector
+from fake_sheets import create_fake_worksheet
+from fetch_from_db import FIRST_ORDER_ID, MySQLDataFetcher, OrderRecord
+from local_export import SortedOrderExport, create_sink
+from order_storage import HposStorage
+from push_to_excel import RANGE_NAME, SPREADSHEET_ID, GoogleSheetsUpdater, sort_order_rows
+from synthetic_orders import generate_orders, generate_sheet_rows
+
+# Connection details of local benchmark database
+bench_username = os.getenv('BENCH_DB_USERNAME', 'root')
+bench_password = os.getenv('BENCH_DB_PASSWORD', '')
+bench_host = os.getenv('BENCH_DB_HOST', '127.0.0.1')
+bench_database = os.getenv('BENCH_DB_NAME')
+
+# Name of the shop database, benchmark refuses to drop its tables
+SHOP_DATABASE = 'blueluna_polishlody'
+
+SCALES = (1_000, 10_000, 100_000)
+
+# Per-order getters make many queries per order, so they are measured on a sample of orders
+PER_ORDER_SAMPLE = 200
+
+# Part of orders which is already in the spreadsheet when missing orders are detected
+EXISTING_ORDERS_RATIO = 0.95
+
+# Write strategies of new orders: (case, method of GoogleSheetsUpdater writing rows, method run after it)
+SHEET_WRITE_STRATEGIES = (
+    ('sheets_append_and_sort', 'append_orders', 'sort_spreadsheet'),
+    ('sheets_append_and_server_sort', 'append_orders', 'sort_spreadsheet_server_side'),
+    ('sheets_insert_sorted', 'insert_orders_sorted', None),
+)
+
+
+def count_questions(data_fetcher):
+    """Number of statements executed by the connection of data_fetcher."""
+    data_fetcher.cur.execute("SHOW SESSION STATUS LIKE 'Questions'")
+    return int(data_fetcher.cur.fetchall()[0][1])
+
+
+def measure(case, function, orders, data_fetcher=None, spreadsheet=None):
+    """Run function once and return its wall time, peak memory and number of queries or spreadsheet API calls."""
+    questions_before = count_questions(data_fetcher) if data_fetcher else None
+    api_stats_before = spreadsheet.get_stats() if spreadsheet else None
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    function()
+    wall_seconds = time.perf_counter() - started
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        'case': case,
+        'orders': orders,
+        'wall_seconds': round(wall_seconds, 4),
+        'peak_memory_mb': round(peak_memory / 2 ** 20, 2),
+        'queries': None,
+        'queries_per_order': None,
+        'api_calls': None,
+        'api_bytes_sent': None,
+    }
+    if data_fetcher:
+        # SHOW SESSION STATUS itself is counted as one statement
+        queries = count_questions(data_fetcher) - questions_before - 1
+        result['queries'] = queries
+        result['queries_per_order'] = round(queries / orders, 2) if orders else None
+    if spreadsheet:
+        api_stats = spreadsheet.get_stats()
+        result['api_calls'] = api_stats['api_calls'] - api_stats_before['api_calls']
+        result['api_bytes_sent'] = api_stats['bytes_sent'] - api_stats_before['bytes_sent']
+    return result
+
+
+def run_per_order_getters(data_fetcher, order_ids):
+    """The same getters which main() called for every missing order before fetch_orders."""
+    for order_id in order_ids:
+        data_fetcher.get_product_names_and_quantities(order_id)
+        data_fetcher.get_delivery_date(order_id)
+        data_fetcher.get_shipping_address(order_id)
+        data_fetcher.get_comments_to_order(order_id)
+        data_fetcher.get_first_and_last_name(order_id)
+        data_fetcher.get_product_price(order_id)
+        data_fetcher.get_shipping_price(order_id)
+        data_fetcher.get_payment_method(order_id)
+        data_fetcher.get_order_attributes(order_id)
+
+
+def run_sheet_strategies(scale):
+    """Write new orders to sorted spreadsheet of scale rows with every strategy of SHEET_WRITE_STRATEGIES."""
+    sheet_rows = generate_sheet_rows(scale)
+    num_existing = int(scale * EXISTING_ORDERS_RATIO)
+    existing_rows = sort_order_rows(sheet_rows[:num_existing])
+    new_rows = sheet_rows[num_existing:]
+
+    results = []
+    for case, write_method, after_write_method in SHEET_WRITE_STRATEGIES:
+        # Quota is not simulated, benchmark counts requests instead of waiting for them
+        worksheet = create_fake_worksheet([list(OrderRecord._fields)] + existing_rows, title=RANGE_NAME,
+                                          cols=len(OrderRecord._fields), requests_per_minute=None)
+        updater = GoogleSheetsUpdater(SPREADSHEET_ID, RANGE_NAME, worksheet=worksheet, requests_per_minute=None)
+        # Mirror is downloaded once per run, before any order is written
+        updater.refresh_mirror()
+
+        def write():
+            getattr(updater, write_method)(new_rows)
+            if after_write_method:
+                getattr(updater, after_write_method)()
+            updater.flush()
+
+        results.append(measure(case, write, len(new_rows), spreadsheet=worksheet.spreadsheet))
+        if sort_order_rows(worksheet.get_all_values()[1:]) != worksheet.get_all_values()[1:]:
+            raise AssertionError(f'{case} left the spreadsheet unsorted')
+    return results
+
+
+def run_local_export(rows, path):
+    """Export rows to local file in batches, the way main.export_orders does it."""
+    with SortedOrderExport(create_sink(path, header=OrderRecord._fields), run_rows=max(len(rows) // 4, 1)) as export:
+        for start in range(0, len(rows), 1000):
+            export.append_orders(rows[start:start + 1000])
+
+
+def run_scale(scale, generate=True):
+    """Generate scale orders and run every benchmark case on them."""
+    if generate:
+        connection = mysql.connector.connect(
+            user=bench_username, password=bench_password, host=bench_host, database=bench_database)
+        started = time.perf_counter()
+        order_ids = generate_orders(connection, scale, FIRST_ORDER_ID)
+        connection.close()
+        print(f'Generated {scale} orders in {time.perf_counter() - started:.1f} s')
+
+    data_fetcher = MySQLDataFetcher(bench_username, bench_password, bench_host, bench_database)
+    if not generate:
+        data_fetcher.cur.execute("SELECT ID FROM wp_posts WHERE post_type = 'shop_order' ORDER BY ID")
+        order_ids = [order_id for order_id, in data_fetcher.cur.fetchall()]
+
+    existing_order_ids = [str(order_id) for order_id in order_ids[:int(len(order_ids) * EXISTING_ORDERS_RATIO)]]
+    sample_order_ids = order_ids[-PER_ORDER_SAMPLE:]
+    sheet_rows = generate_sheet_rows(scale)
+
+    results = [
+        measure('get_missing_order_ids', lambda: data_fetcher.get_missing_order_ids(existing_order_ids),
+                len(order_ids), data_fetcher),
+        measure('per_order_getters', lambda: run_per_order_getters(data_fetcher, sample_order_ids),
+                len(sample_order_ids), data_fetcher),
+        measure('fetch_orders', lambda: data_fetcher.fetch_orders(sample_order_ids),
+                len(sample_order_ids), data_fetcher),
+        measure('fetch_orders_all', lambda: data_fetcher.fetch_orders(order_ids), len(order_ids), data_fetcher),
+        measure('sort_spreadsheet', lambda: sort_order_rows(sheet_rows), len(sheet_rows)),
+    ]
+    data_fetcher.close_connection()
+
+    # The same orders read from HPOS tables
+    hpos_fetcher = MySQLDataFetcher(bench_username, bench_password, bench_host, bench_database, storage=HposStorage())
+    results.extend([
+        measure('get_missing_order_ids_hpos', lambda: hpos_fetcher.get_missing_order_ids(existing_order_ids),
+                len(order_ids), hpos_fetcher),
+        measure('fetch_orders_all_hpos', lambda: hpos_fetcher.fetch_orders(order_ids), len(order_ids), hpos_fetcher),
+    ])
+    hpos_fetcher.close_connection()
+    results.extend(run_sheet_strategies(scale))
+    with tempfile.TemporaryDirectory() as export_dir:
+        results.append(measure('export_csv', lambda: run_local_export(sheet_rows, os.path.join(export_dir, 'orders.csv')),
+                               len(sheet_rows)))
+
+    for result in results:
+        result['scale'] = scale
+    return results
+
+
+def print_results(results):
+    print(f"{'scale':>8} {'case':<30} {'orders':>8} {'wall [s]':>10} {'queries':>8} {'q/order':>8} "
+          f"{'api calls':>10} {'api bytes':>12} {'peak [MB]':>10}")
+    for result in results:
+        print(f"{result['scale']:>8} {result['case']:<30} {result['orders']:>8} {result['wall_seconds']:>10} "
+              f"{str(result['queries']):>8} {str(result['queries_per_order']):>8} {str(result['api_calls']):>10} "
+              f"{str(result['api_bytes_sent']):>12} {result['peak_memory_mb']:>10}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=int, action='append', help='number of synthetic orders, can be repeated')
+    parser.add_argument('--no-generate', action='store_true', help='reuse orders generated by previous run')
+    parser.add_argument('--json', help='file to write results to')
+    args = parser.parse_args()
+
+    if not bench_database:
+        parser.error('set BENCH_DB_NAME to a database used only by the benchmark, its tables are dropped')
+    if bench_database in (SHOP_DATABASE, os.getenv('DB_NAME')):
+        parser.error(f'BENCH_DB_NAME {bench_database!r} is the shop database, use a database of the benchmark')
+
+    all_results = []
+    for bench_scale in args.scale or SCALES:
+        all_results.extend(run_scale(bench_scale, generate=not args.no_generate))
+    print_results(all_results)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as json_file:
+            json.dump(all_results, json_file, indent=2)
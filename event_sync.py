@@ -0,0 +1,89 @@
+"""Script for syncing only the orders named in Pub/Sub message, for example WooCommerce webhook relayed to Pub/Sub.
+
+Scheduled messages without order ids still run the regular scan of the database, which also catches orders whose
+message was lost.
+"""
+import base64
+import binascii
+import json
+from metrics import metrics
+
+# Keys of message data with order ids - order_ids list, or id of the order itself in WooCommerce webhook payload
+ORDER_ID_KEYS = ('order_ids', 'order_id', 'id')
+
+
+def _parse_order_ids(value):
+    """Convert single id, list of ids or comma separated string into list of ints."""
+    if isinstance(value, str):
+        value = value.split(',')
+    elif not isinstance(value, (list, tuple)):
+        value = [value]
+    order_ids = []
+    for order_id in value:
+        order_id = str(order_id).strip()
+        if order_id.isdigit():
+            order_ids.append(int(order_id))
+        elif order_id:
+            metrics.count('event_invalid_order_ids')
+    return order_ids
+
+
+def get_event_order_ids(event):
+    """Return sorted order ids carried by Pub/Sub message, empty list when it has none.
+
+    Ids are read from base64 encoded JSON data of the message ({"order_ids": [16751, 16752]} or WooCommerce order
+    payload with "id") or from comma separated order_ids attribute. Message which cannot be parsed has no ids,
+    so it falls back to the regular run.
+    """
+    if not isinstance(event, dict):
+        return []
+
+    order_ids = []
+    attributes = event.get('attributes') or {}
+    if attributes.get('order_ids'):
+        order_ids.extend(_parse_order_ids(attributes['order_ids']))
+
+    data = event.get('data')
+    if data:
+        try:
+            payload = json.loads(base64.b64decode(data))
+        except (binascii.Error, ValueError):
+            metrics.count('event_invalid_messages')
+            payload = None
+        if isinstance(payload, list):
+            order_ids.extend(_parse_order_ids(payload))
+        elif isinstance(payload, dict):
+            for key in ORDER_ID_KEYS:
+                if payload.get(key) is not None:
+                    order_ids.extend(_parse_order_ids(payload[key]))
+                    break
+
+    return sorted(set(order_ids))
+
+
+def sync_orders(order_ids, data_fetcher, updater, sync_state):
+    """Insert the given orders into the spreadsheet at their sorted position, returns rows which were added.
+
+    Orders already in the spreadsheet or its archive worksheets are skipped, so messages delivered twice or
+    webhooks fired again on order update never duplicate rows. Orders without new order email sent are left for
+    the regular run.
+    """
+    updater.start_run()
+    mirror = updater.get_mirror()
+    new_order_ids = [
+        order_id for order_id in order_ids if not mirror.has_order(order_id) and not sync_state.is_archived(order_id)
+    ]
+    metrics.count('event_orders', len(order_ids))
+    metrics.count('event_orders_already_synced', len(order_ids) - len(new_order_ids))
+
+    sent_order_ids = sorted(data_fetcher.filter_sent_order_ids(new_order_ids))
+    rows = [list(order_record) for order_record in data_fetcher.fetch_orders_parallel(sent_order_ids)]
+    added_rows = updater.insert_orders_sorted(rows)
+    # Rows are flushed before the checkpoint is moved past them
+    updater.flush()
+    metrics.count('orders_written', len(added_rows))
+
+    # Only the scan moves the watermark, so orders of lost events stay in its window
+    sync_state.record_synced((row[0] for row in added_rows), move_watermark=False)
+    sync_state.save()
+    return added_rows
@@ -0,0 +1,376 @@
+"""Script with in-memory google spreadsheet, used instead of gspread in tests and benchmarks.
+
+Only the part of gspread Worksheet and Spreadsheet used by GoogleSheetsUpdater is implemented. API calls and
+request bytes are counted and the per-minute quota raises 429 error like the real API.
+"""
+import json
+import re
+import time
+from collections import Counter, deque
+from sheets_scheduler import text_sort_key
+
+# Sheets API limit of requests per minute per user
+REQUESTS_PER_MINUTE = 60
+
+_A1_CELL = re.compile(r'^([A-Z]*)(\d*)$')
+
+
+class FakeAPIError(Exception):
+    """Error raised like gspread APIError, code is HTTP status of the response."""
+
+    class Response:
+        def __init__(self, status_code):
+            self.status_code = status_code
+
+    def __init__(self, code, message):
+        super().__init__(f'{code}: {message}')
+        self.code = code
+        self.response = self.Response(code)
+
+
+class FakeCell:
+    def __init__(self, row, col, value):
+        self.row = row
+        self.col = col
+        self.value = value
+
+
+class FakeSpreadsheet:
+    """Spreadsheet keeping worksheets in memory and counting API calls, bytes and per-minute quota."""
+
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, clock=time.monotonic):
+        self.id = 'fake-spreadsheet'
+        self.requests_per_minute = requests_per_minute
+        self.clock = clock
+        self.api_calls = Counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.throttled_calls = 0
+        self._request_times = deque()
+        self._worksheets = []
+
+    def add_worksheet(self, title, rows=1000, cols=26, values=None):
+        self._api_call('add_worksheet', {'title': title, 'rows': rows, 'cols': cols})
+        return self._add_worksheet(title, rows, cols, values)
+
+    def _add_worksheet(self, title, rows, cols, values=None, sheet_id=None):
+        if sheet_id is None:
+            sheet_id = max((worksheet.id for worksheet in self._worksheets), default=-1) + 1
+        worksheet = FakeWorksheet(self, sheet_id, title, rows, cols)
+        self._worksheets.append(worksheet)
+        if values:
+            worksheet._write(1, 1, values)
+        return worksheet
+
+    def worksheet(self, title):
+        self._api_call('worksheet', title)
+        for worksheet in self._worksheets:
+            if worksheet.title == title:
+                worksheet._refresh_properties()
+                return worksheet
+        raise FakeAPIError(404, f'Worksheet {title} not found')
+
+    def worksheets(self):
+        self._api_call('worksheets', None)
+        for worksheet in self._worksheets:
+            worksheet._refresh_properties()
+        return list(self._worksheets)
+
+    def get_stats(self):
+        """API usage since the spreadsheet was created."""
+        return {
+            'api_calls': sum(self.api_calls.values()),
+            'api_calls_by_method': dict(self.api_calls),
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'throttled_calls': self.throttled_calls,
+        }
+
+    def _api_call(self, method, request, response=None):
+        """Count API call and its payload, raise 429 error when per-minute quota is used up."""
+        now = self.clock()
+        while self._request_times and now - self._request_times[0] >= 60:
+            self._request_times.popleft()
+        if self.requests_per_minute is not None and len(self._request_times) >= self.requests_per_minute:
+            self.throttled_calls += 1
+            raise FakeAPIError(429, 'Quota exceeded for quota metric requests per minute')
+        self._request_times.append(now)
+
+        self.api_calls[method] += 1
+        self.bytes_sent += len(json.dumps(request, default=str))
+        if response is not None:
+            self.bytes_received += len(json.dumps(response, default=str))
+
+    def _worksheet_by_id(self, sheet_id):
+        for worksheet in self._worksheets:
+            if worksheet.id == sheet_id:
+                return worksheet
+        raise FakeAPIError(400, f'No grid with id: {sheet_id}')
+
+    def _worksheet_by_title(self, title):
+        for worksheet in self._worksheets:
+            if worksheet.title == title:
+                return worksheet
+        raise FakeAPIError(400, f'Unable to parse range: {title}')
+
+    def batch_update(self, body):
+        self._api_call('batch_update', body)
+        for request in body['requests']:
+            (request_type, params), = request.items()
+            handler = getattr(self, f'_request_{request_type}', None)
+            if handler is None:
+                raise FakeAPIError(400, f'Unsupported request {request_type}')
+            handler(params)
+        return {'spreadsheetId': self.id, 'replies': [{} for _ in body['requests']]}
+
+    def values_batch_update(self, body):
+        self._api_call('values_batch_update', body)
+        for data in body['data']:
+            title, cell_range = _split_range(data['range'])
+            worksheet = self._worksheet_by_title(title)
+            first_row, first_col, _, _ = _parse_a1(cell_range)
+            worksheet._write(first_row, first_col, data['values'], skip_none=True)
+        return {'spreadsheetId': self.id, 'totalUpdatedRows': sum(len(data['values']) for data in body['data'])}
+
+    def _request_addSheet(self, params):
+        properties = params['properties']
+        title = properties['title']
+        sheet_id = properties.get('sheetId')
+        if any(worksheet.title == title or worksheet.id == sheet_id for worksheet in self._worksheets):
+            raise FakeAPIError(400, f'A sheet with the name "{title}" or id {sheet_id} already exists')
+        grid_properties = properties.get('gridProperties', {})
+        self._add_worksheet(title, grid_properties.get('rowCount', 1000), grid_properties.get('columnCount', 26),
+                            sheet_id=sheet_id)
+
+    def _request_insertDimension(self, params):
+        dimension_range = params['range']
+        worksheet = self._worksheet_by_id(dimension_range['sheetId'])
+        start, end = dimension_range['startIndex'], dimension_range['endIndex']
+        if dimension_range['dimension'] != 'ROWS' or start > len(worksheet._values):
+            raise FakeAPIError(400, 'Invalid insertDimension range')
+        for _ in range(end - start):
+            worksheet._values.insert(start, [''] * worksheet._col_count)
+
+    def _request_deleteDimension(self, params):
+        dimension_range = params['range']
+        worksheet = self._worksheet_by_id(dimension_range['sheetId'])
+        start = dimension_range.get('startIndex', 0)
+        end = dimension_range.get('endIndex', len(worksheet._values))
+        if dimension_range['dimension'] != 'ROWS' or start >= end or end > len(worksheet._values):
+            raise FakeAPIError(400, 'Invalid deleteDimension range')
+        if end - start >= len(worksheet._values):
+            raise FakeAPIError(400, 'You can\'t delete all the rows in the sheet.')
+        del worksheet._values[start:end]
+
+    def _request_updateCells(self, params):
+        start = params['start']
+        worksheet = self._worksheet_by_id(start['sheetId'])
+        values = [
+            [_cell_data_value(cell_data) for cell_data in row.get('values', [])]
+            for row in params['rows']
+        ]
+        worksheet._write(start['rowIndex'] + 1, start.get('columnIndex', 0) + 1, values)
+
+    def _request_appendCells(self, params):
+        worksheet = self._worksheet_by_id(params['sheetId'])
+        values = [
+            [_cell_data_value(cell_data) for cell_data in row.get('values', [])]
+            for row in params['rows']
+        ]
+        worksheet._write(len(_trim_values(worksheet._values)) + 1, 1, values)
+
+    def _request_sortRange(self, params):
+        grid_range = params['range']
+        worksheet = self._worksheet_by_id(grid_range['sheetId'])
+        start = grid_range.get('startRowIndex', 0)
+        end = grid_range.get('endRowIndex', len(worksheet._values))
+        rows = worksheet._values[start:end]
+        # Sheets puts empty cells at the end and compares text ignoring case in spreadsheet locale,
+        # Python sort is stable like Sheets
+        for sort_spec in reversed(params['sortSpecs']):
+            column = sort_spec['dimensionIndex']
+            descending = sort_spec.get('sortOrder') == 'DESCENDING'
+            non_empty = [row for row in rows if row[column] != '']
+            empty = [row for row in rows if row[column] == '']
+            non_empty.sort(key=lambda row: _sheets_sort_value(row[column]), reverse=descending)
+            rows = non_empty + empty
+        worksheet._values[start:end] = rows
+
+    def _request_updateSheetProperties(self, params):
+        properties = params['properties']
+        worksheet = self._worksheet_by_id(properties['sheetId'])
+        grid_properties = properties.get('gridProperties', {})
+        worksheet._resize(grid_properties.get('rowCount'), grid_properties.get('columnCount'))
+
+
+class FakeWorksheet:
+    """Worksheet keeping values as strings in memory, the same way Sheets shows them."""
+
+    def __init__(self, spreadsheet, sheet_id, title, rows, cols):
+        self.spreadsheet = spreadsheet
+        self.id = sheet_id
+        self.title = title
+        self._col_count = cols
+        self._values = [[''] * cols for _ in range(rows)]
+        self._properties = {'gridProperties': {'rowCount': rows, 'columnCount': cols}}
+
+    @property
+    def row_count(self):
+        # Like gspread, grid size is known from worksheet properties and is not refreshed by batch_update
+        return self._properties['gridProperties']['rowCount']
+
+    @property
+    def col_count(self):
+        return self._properties['gridProperties']['columnCount']
+
+    def _refresh_properties(self):
+        # Worksheet opened again from spreadsheet metadata sees the current grid size
+        self._properties['gridProperties'].update(rowCount=len(self._values), columnCount=self._col_count)
+
+    def col_values(self, col):
+        values = [row[col - 1] for row in self._values]
+        while values and values[-1] == '':
+            values.pop()
+        self.spreadsheet._api_call('col_values', col, values)
+        return values
+
+    def get_all_values(self):
+        values = _trim_values(self._values)
+        self.spreadsheet._api_call('get_all_values', None, values)
+        return values
+
+    def batch_get(self, ranges):
+        result = []
+        for cell_range in ranges:
+            first_row, first_col, last_row, last_col = _parse_a1(cell_range)
+            last_row = len(self._values) if last_row is None else last_row
+            last_col = self._col_count if last_col is None else last_col
+            rows = [row[first_col - 1:last_col] for row in self._values[first_row - 1:last_row]]
+            result.append([[value for value in row] for row in _trim_values(rows, pad=False)])
+        self.spreadsheet._api_call('batch_get', ranges, result)
+        return result
+
+    def append_rows(self, values, value_input_option='RAW', table_range='A1'):
+        self.spreadsheet._api_call('append_rows', values)
+        # Sheets appends after the last row with any value in the table
+        last_row = len(_trim_values(self._values))
+        self._write(last_row + 1, 1, values)
+        return {'updates': {'updatedRows': len(values)}}
+
+    def range(self, first_row, first_col, last_row, last_col):
+        cells = [
+            FakeCell(row, col, self._values[row - 1][col - 1] if row <= len(self._values) else '')
+            for row in range(first_row, last_row + 1)
+            for col in range(first_col, last_col + 1)
+        ]
+        self.spreadsheet._api_call('range', [first_row, first_col, last_row, last_col],
+                                   [cell.value for cell in cells])
+        return cells
+
+    def update_cells(self, cell_list, value_input_option='RAW'):
+        self.spreadsheet._api_call('update_cells', [[cell.row, cell.col, cell.value] for cell in cell_list])
+        for cell in cell_list:
+            self._write(cell.row, cell.col, [[cell.value]])
+
+    def resize(self, rows=None, cols=None):
+        self.spreadsheet._api_call('resize', [rows, cols])
+        self._resize(rows, cols)
+
+    def _resize(self, rows=None, cols=None):
+        if cols is not None:
+            self._col_count = cols
+            self._values = [(row + [''] * cols)[:cols] for row in self._values]
+            self._properties['gridProperties']['columnCount'] = cols
+        if rows is not None:
+            if rows < len(self._values):
+                del self._values[rows:]
+            else:
+                self._values.extend([''] * self._col_count for _ in range(rows - len(self._values)))
+            self._properties['gridProperties']['rowCount'] = rows
+
+    def _write(self, first_row, first_col, values, skip_none=False):
+        """Write block of values, the grid grows when values do not fit, like in Sheets API."""
+        last_row = first_row + len(values) - 1
+        last_col = first_col + max((len(row) for row in values), default=0) - 1
+        if last_col > self._col_count:
+            self._resize(cols=last_col)
+        if last_row > len(self._values):
+            self._values.extend([''] * self._col_count for _ in range(last_row - len(self._values)))
+        for row_offset, row in enumerate(values):
+            target = self._values[first_row - 1 + row_offset]
+            for col_offset, value in enumerate(row):
+                if value is None and skip_none:
+                    continue
+                target[first_col - 1 + col_offset] = _sheet_value(value)
+
+
+def create_fake_worksheet(values=None, title='Arkusz9', rows=1000, cols=10, **spreadsheet_options):
+    """Create spreadsheet with single worksheet filled with values, no API call is counted."""
+    spreadsheet = FakeSpreadsheet(**spreadsheet_options)
+    return spreadsheet._add_worksheet(title, max(rows, len(values or [])), cols, values)
+
+
+def _sheet_value(value):
+    """Value shown by Sheets for value written with RAW input option."""
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _sheets_sort_value(value):
+    try:
+        return 0, float(value), ''
+    except ValueError:
+        return 1, 0.0, text_sort_key(value)
+
+
+def _cell_data_value(cell_data):
+    user_entered_value = cell_data.get('userEnteredValue')
+    if not user_entered_value:
+        return ''
+    (_, value), = user_entered_value.items()
+    return value
+
+
+def _trim_values(values, pad=True):
+    """Remove trailing empty rows and cells, optionally pad rows to the same width like gspread does."""
+    rows = []
+    for row in values:
+        row = list(row)
+        while row and row[-1] == '':
+            row.pop()
+        rows.append(row)
+    while rows and not rows[-1]:
+        rows.pop()
+    if pad and rows:
+        width = max(len(row) for row in rows)
+        rows = [row + [''] * (width - len(row)) for row in rows]
+    return rows
+
+
+def _split_range(a1_range):
+    """Split "'title'!A1:B2" into title and cell range."""
+    title, _, cell_range = a1_range.rpartition('!')
+    if title.startswith("'") and title.endswith("'"):
+        title = title[1:-1].replace("''", "'")
+    return title, cell_range
+
+
+def _parse_a1(cell_range):
+    """Parse A1 notation into (first_row, first_col, last_row, last_col), None means unbounded."""
+    first, _, last = cell_range.partition(':')
+    first_col, first_row = _parse_cell(first)
+    if not last:
+        return first_row or 1, first_col or 1, first_row, first_col
+    last_col, last_row = _parse_cell(last)
+    return first_row or 1, first_col or 1, last_row, last_col
+
+
+def _parse_cell(cell):
+    letters, digits = _A1_CELL.match(cell).groups()
+    col = 0
+    for letter in letters:
+        col = col * 26 + ord(letter) - ord('A') + 1
+    return col or None, int(digits) if digits else None
@@ -1,6 +1,13 @@
 """Script for fetching data from MySQL database."""
 import os
-import mysql.connector
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from mysql.connector import errors, pooling
+from metrics import metrics
+from order_storage import ORDER_STORAGE, detect_storage
+from rendering_rules import rendering_rules
 
 # Fetch credentials and connection details from environment variables
 username = os.getenv('DB_USERNAME')
@@ -8,32 +15,133 @@ password = os.getenv('DB_PASSWORD')
 host = os.getenv('DB_HOST')
 database = os.getenv('DB_NAME')
 
+# Number of connections kept open in the pool, every parallel worker needs its own connection
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '4'))
+
+# Number of threads fetching orders in parallel, 1 fetches orders in the calling thread
+FETCH_WORKERS = int(os.getenv('FETCH_WORKERS', '1'))
+
+# Pools are kept at module level, so warm Cloud Function invocations reuse already open connections
+_connection_pools = {}
+_connection_pools_lock = threading.Lock()
+
+# Order storage of every db, detected once per function instance
+_order_storages = {}
+
+# Orders with lower order_id are never synchronised with the spreadsheet
+FIRST_ORDER_ID = 16750
+
+# Number of orders replayed by single backfill step
+BACKFILL_CHUNK_SIZE = 500
+
+# Maximum number of order ids sent in a single `IN (...)` list
+ORDER_BATCH_SIZE = 500
+
+WROCLAW_DELIVERY = 'Dostawa na terenie Wrocławia'
+
+# Fields are in the same order as the spreadsheet columns, so list(record) is a sheet row
+OrderRecord = namedtuple('OrderRecord', [
+    'order_id',
+    'delivery_date',
+    'products',
+    'attributes',
+    'shipping_address',
+    'product_price',
+    'shipping_price',
+    'payment_method',
+    'name',
+    'comments',
+])
+
+
+def get_connection_pool(username, password, host, database, pool_size=DB_POOL_SIZE):
+    """Return connection pool for given db, the pool is created on first use."""
+    pool_key = (username, host, database)
+    with _connection_pools_lock:
+        pool = _connection_pools.get(pool_key)
+        if pool is None:
+            pool = pooling.MySQLConnectionPool(
+                pool_name=f'orders_{len(_connection_pools)}',
+                pool_size=pool_size,
+                pool_reset_session=True,
+                user=username,
+                password=password,
+                host=host,
+                database=database
+            )
+            _connection_pools[pool_key] = pool
+        return pool
+
+
+def _placeholders(values):
+    """Return comma separated %s placeholders for `IN (...)` list of values."""
+    return ', '.join(['%s'] * len(values))
+
+
+def _meta_number(meta_value):
+    """Convert meta_value string to number, None if meta_value does not exist."""
+    if meta_value is None:
+        return None
+    try:
+        return float(meta_value)
+    except ValueError:
+        return 0.0
+
 
 class MySQLDataFetcher:
-    def __init__(self, username, password, host, database):
-        """Init arguments passed to the class - connecting to db data."""
-
-        self.conn = mysql.connector.connect(
-            user=username,
-            password=password,
-            host=host,
-            database=database
-        )
-        self.cur = self.conn.cursor()
+    def __init__(self, username, password, host, database, pool_size=DB_POOL_SIZE, storage=None):
+        """Init arguments passed to the class - connecting to db data and optional order storage.
+
+        storage is LegacyPostStorage or HposStorage from order_storage, by default it is detected from
+        WooCommerce settings.
+        """
+
+        self._connection_args = {
+            'username': username,
+            'password': password,
+            'host': host,
+            'database': database,
+            'pool_size': pool_size,
+        }
+        self.conn = get_connection_pool(username, password, host, database, pool_size).get_connection()
+        self.cur = metrics.instrument_cursor(self.conn.cursor())
+        # Prepared cursor for every per-order query, so statements are prepared once and reused for every order
+        self._prepared_cursors = {}
+        self.ensure_connection()
+        # (order_id, meta) of the last order read by get_* methods
+        self._order_meta_cache = None
+        self.storage = storage or self._detect_storage()
+
+    def _detect_storage(self):
+        """Detect if orders are kept in legacy posts or HPOS tables, once per db."""
+        storage_key = (self._connection_args['username'], self._connection_args['host'],
+                       self._connection_args['database'])
+        storage = _order_storages.get(storage_key)
+        if storage is None:
+            storage = _order_storages[storage_key] = detect_storage(self.cur, ORDER_STORAGE)
+        return storage
+
+    def ensure_connection(self):
+        """Health check of the connection, reconnect if the shared host dropped idle link."""
+        if not self.conn.is_connected():
+            self.conn.reconnect(attempts=3, delay=1)
+            # Cursors and prepared statements do not survive reconnect
+            self.cur = metrics.instrument_cursor(self.conn.cursor())
+            self._prepared_cursors = {}
+
+    def _execute_prepared(self, query, params):
+        """Execute query as prepared statement and fetch all rows."""
+        cursor = self._prepared_cursors.get(query)
+        if cursor is None:
+            cursor = metrics.instrument_cursor(self.conn.cursor(prepared=True))
+            self._prepared_cursors[query] = cursor
+        cursor.execute(query, params)
+        return cursor.fetchall()
 
     def get_latest_order_id(self):
         """SQL query for fetching latest order_id from db."""
 
-        order_id_query = """
-            SELECT 
-                post_id 
-            FROM 
-                wp_postmeta 
-            ORDER BY 
-                post_id DESC 
-            LIMIT 1
-        """
-        self.cur.execute(order_id_query)
+        self.cur.execute(self.storage.LATEST_ORDER_ID_SQL)
         order_id_result = self.cur.fetchone()
         return order_id_result[0] if order_id_result else None
 
@@ -55,8 +163,12 @@ class MySQLDataFetcher:
                     AND wim.meta_key = '_qty'
             """
 
-        self.cur.execute(product_name_query, (order_id,))
-        result = self.cur.fetchall()
+        result = self._execute_prepared(product_name_query, (order_id,))
+        return self._format_products(result)
+
+    @staticmethod
+    def _format_products(result):
+        """Format (product_name, quantity) rows into order details string."""
 
         # Dictionary to store product names and their quantities
         product_quantities = {}
@@ -80,23 +192,21 @@ class MySQLDataFetcher:
             SELECT 
                 wim_delivery_date.meta_value AS delivery_date 
             FROM 
-                blueluna_polishlody.wp_woocommerce_order_itemmeta wim_delivery_date 
+                wp_woocommerce_order_itemmeta wim_delivery_date 
             WHERE 
                 wim_delivery_date.order_item_id = (
                     SELECT 
                         woi.order_item_id 
                     FROM 
-                        blueluna_polishlody.wp_woocommerce_order_items woi 
-                        JOIN wp_postmeta pm ON woi.order_id = pm.post_id 
+                        wp_woocommerce_order_items woi 
                     WHERE 
-                        woi.order_item_type = 'shipping' AND pm.post_id = %s 
+                        woi.order_item_type = 'shipping' AND woi.order_id = %s 
                     LIMIT 1
                 ) 
                 AND wim_delivery_date.meta_key = '_delivery_date'
         """
 
-        self.cur.execute(delivery_date_query, (order_id,))
-        result = self.cur.fetchall()
+        result = self._execute_prepared(delivery_date_query, (order_id,))
         if result:
             date = result[0][0]
             return date
@@ -106,102 +216,62 @@ class MySQLDataFetcher:
     def get_shipping_address(self, order_id):
         """SQL query for fetching shipping address if exists in db"""
 
-        shipping_address_query = """
+        shipping_items_query = """
             SELECT 
-                woi.order_item_id,
-                CASE 
-                    WHEN woi.order_item_name = 'Dostawa na terenie Wrocławia' THEN woi.order_item_name 
-                    ELSE NULL 
-                END AS order_item_name,
-                CASE 
-                    WHEN woi.order_item_name = 'Dostawa na terenie Wrocławia' THEN (
-                        SELECT meta_value 
-                        FROM blueluna_polishlody.wp_postmeta 
-                        WHERE post_id = woi.order_id AND meta_key = '_shipping_address_1'
-                    )
-                    ELSE woi.order_item_name 
-                END AS billing_address_1,
-                CASE 
-                    WHEN woi.order_item_name = 'Dostawa na terenie Wrocławia' THEN (
-                        SELECT meta_value 
-                        FROM blueluna_polishlody.wp_postmeta 
-                        WHERE post_id = woi.order_id AND meta_key = '_shipping_address_2'
-                    )
-                    ELSE NULL 
-                END AS billing_address_2,
-                CASE 
-                    WHEN woi.order_item_name = 'Dostawa na terenie Wrocławia' THEN (
-                        SELECT meta_value 
-                        FROM blueluna_polishlody.wp_postmeta 
-                        WHERE post_id = woi.order_id AND meta_key = '_shipping_city'
-                    )
-                    ELSE NULL 
-                END AS billing_city,
-                CASE 
-                    WHEN woi.order_item_name = 'Dostawa na terenie Wrocławia' THEN (
-                        SELECT meta_value 
-                        FROM blueluna_polishlody.wp_postmeta 
-                        WHERE post_id = woi.order_id AND meta_key = '_shipping_company'
-                    )
-                    ELSE NULL 
-                END AS shipping_company,
-                CASE 
-                    WHEN woi.order_item_name = 'Dostawa na terenie Wrocławia' THEN (
-                        SELECT meta_value 
-                        FROM blueluna_polishlody.wp_postmeta 
-                        WHERE post_id = woi.order_id AND meta_key = '_billing_phone'
-                    )
-                    ELSE NULL 
-                END AS billing_phone,
-                CASE 
-                    WHEN woi.order_item_name = 'Dostawa na terenie Wrocławia' THEN (
-                        SELECT meta_value 
-                        FROM blueluna_polishlody.wp_postmeta 
-                        WHERE post_id = woi.order_id AND meta_key = 'Czas dostawy'
-                    )
-                    ELSE NULL
-                END AS delivery_hour
+                woi.order_item_id, 
+                woi.order_item_name 
             FROM 
-                blueluna_polishlody.wp_woocommerce_order_items woi 
+                wp_woocommerce_order_items woi 
             WHERE 
                 woi.order_item_type = 'shipping' AND woi.order_id = %s
+            ORDER BY 
+                woi.order_item_id
         """
 
-        self.cur.execute(shipping_address_query, (order_id,))
-        result = self.cur.fetchall()
+        result = self._execute_prepared(shipping_items_query, (order_id,))
+        if result:
+            meta = self._get_order_meta(order_id)
+            return self._format_shipping_address(self._shipping_rows(result, meta), meta.get('NIP'))
+
+    @staticmethod
+    def _shipping_rows(shipping_items, meta):
+        """Combine (order_item_id, order_item_name) shipping items with address from order meta.
+
+        Address is used only for delivery in Wroclaw, for pickup points the item name is the address.
+        """
+        shipping_rows = []
+        for order_item_id, item_name in shipping_items:
+            if item_name == WROCLAW_DELIVERY:
+                shipping_rows.append((
+                    order_item_id,
+                    item_name,
+                    meta.get('_shipping_address_1'),
+                    meta.get('_shipping_address_2'),
+                    meta.get('_shipping_city'),
+                    meta.get('_shipping_company'),
+                    meta.get('_billing_phone'),
+                    meta.get('Czas dostawy'),
+                ))
+            else:
+                shipping_rows.append((order_item_id, None, item_name, None, None, None, None, None))
+        return shipping_rows
+
+    @staticmethod
+    def _format_shipping_address(result, nip_number):
+        """Format shipping rows (as returned by _shipping_rows) into address string."""
 
         if result:
-            if result[0][2] == "Odbiór osobisty - Bema (Bezpłatnie)":
-                nip_number = self.get_nip_number(order_id)
-                if nip_number is not None:
-                    return f"Odbiór Bema\nNIP:{nip_number}"
-                return "Odbiór Bema"
-            elif result[0][2] == "Odbiór osobisty - Olimpia Port (Bezpłatnie)":
-                nip_number = self.get_nip_number(order_id)
-                if nip_number is not None:
-                    return f"Odbiór Olimpia\nNIP:{nip_number}"
-                return "Odbiór Olimpia"
-            elif result[0][2] == "Odbiór osobisty - Wroclavia (Bezpłatnie)":
-                nip_number = self.get_nip_number(order_id)
+            # Pickup points and their labels come from the rule table
+            pickup_label = rendering_rules.get_pickup_label(result[0][2])
+            if pickup_label is not None:
                 if nip_number is not None:
-                    return f"Odbiór Wroclavia\nNIP:{nip_number}"
-                return "Odbiór Wroclavia"
-            elif result[0][2] == "Odbiór osobisty - Hubska (Bezpłatnie)":
-                nip_number = self.get_nip_number(order_id)
-                if nip_number is not None:
-                    return f"Odbiór Hubska\nNIP:{nip_number}"
-                return "Odbiór Hubska"
-            elif result[0][2] == "Odbiór osobisty - Oławska (Bezpłatnie)":
-                nip_number = self.get_nip_number(order_id)
-                if nip_number is not None:
-                    return f"Odbiór Oławska\nNIP:{nip_number}"
-                return "Odbiór Oławska"
+                    return f"{pickup_label}\nNIP:{nip_number}"
+                return pickup_label
             else:
                 # Now check if the true stands that the second element is not None
                 if result[0][1] is not None:
                     # Now check if the true stands that the sixth element is not None
                     if result[0][5] is not None:
-                        nip_number = self.get_nip_number(order_id)
                         if nip_number is not None:
                             shipping_data = ", ".join(
                                 f'Adres dostawy:\n{street_name}, {city_name}, \nGodziny dostawy: {delivery_hour} '
@@ -245,126 +315,346 @@ class MySQLDataFetcher:
                             result)
                         return shipping_data
                 else:
-                    print("Chyba none", result)
+                    metrics.count('orders_with_unknown_shipping_address')
 
     def get_comments_to_order(self, order_id):
         """SQL query for fetching comments included in order (for example specified delivery time)."""
 
-        comments_to_order_query = """
-            SELECT 
-                post_excerpt 
-            FROM 
-                blueluna_polishlody.wp_posts 
-            WHERE 
-                ID = %s
-        """
-        self.cur.execute(comments_to_order_query, (order_id,))
-        result = self.cur.fetchone()
+        comments_to_order_query = self.storage.COMMENTS_SQL.format(placeholders='%s')
+        result = self._execute_prepared(comments_to_order_query, (order_id,))
         if result:
-            return result[0]
+            return result[0][1]
         else:
             return None
 
     def get_first_and_last_name(self, order_id):
-        """SQL query for fetching full name of client."""
-
-        first_and_last_name_query = """
-            SELECT 
-                MAX(CASE WHEN meta_key = '_billing_first_name' THEN meta_value END) AS billing_first_name, 
-                MAX(CASE WHEN meta_key = '_billing_last_name' THEN meta_value END) AS billing_last_name,
-                MAX(CASE WHEN meta_key = '_billing_company' THEN meta_value END) AS billing_company  
-            FROM 
-                blueluna_polishlody.wp_postmeta 
-            WHERE 
-                post_id = %s
-        """
-        self.cur.execute(first_and_last_name_query, (order_id,))
-        result = self.cur.fetchall()
-
-        if result[0][2] is not None:
-            name_data = " ".join(f'{first_name} {last_name}\n{company_name}' for
-                                 first_name, last_name, company_name in result)
+        """Fetch full name of client from order meta."""
+        return self._format_name(self._get_order_meta(order_id))
+
+    @staticmethod
+    def _format_name(meta):
+        """Format billing first name, last name and company into full name of client."""
+
+        first_name = meta.get('_billing_first_name')
+        last_name = meta.get('_billing_last_name')
+        company_name = meta.get('_billing_company')
+        if company_name is not None:
+            name_data = f'{first_name} {last_name}\n{company_name}'
         else:
-            name_data = " ".join(f'{first_name} {last_name}' for
-                                 first_name, last_name, company_name in result)
+            name_data = f'{first_name} {last_name}'
         # if result[first name] + result[last_name] is equal to PIXEL.lower() == pixelxl then
         #   return 'Pixel XL'
         return name_data
 
     def get_product_price(self, order_id):
-        """SQL query for fetching only product price"""
+        """Fetch only product price from order meta."""
+        cake_price = self._format_product_price(self._get_order_meta(order_id), self.get_termobox_price(order_id))
+        if cake_price is None:
+            metrics.count('orders_without_order_total')
+        return cake_price
+
+    @staticmethod
+    def _format_product_price(meta, termobox_price):
+        """Format product price, which is order total without shipping and termobox fee."""
+
+        # Same arithmetic as MySQL does on meta_value strings
+        order_total = _meta_number(meta.get('_order_total'))
+        order_shipping = _meta_number(meta.get('_order_shipping'))
+        order_shipping_tax = _meta_number(meta.get('_order_shipping_tax'))
+        if None in (order_total, order_shipping, order_shipping_tax):
+            return None
+
+        if termobox_price is None:
+            termobox_price = 0
+        only_product_price = order_total - order_shipping - order_shipping_tax - termobox_price
+        cake_price = f'{only_product_price} zł'
+        return cake_price
+
+    def get_shipping_price(self, order_id):
+        """Fetch shipping price from order meta, only if order is shipped"""
+        return self._format_shipping_price(self._get_order_meta(order_id), self.get_termobox_price(order_id))
+
+    @staticmethod
+    def _format_shipping_price(meta, termobox_price):
+        """Format shipping price together with termobox fee if it was added to order."""
 
-        product_price_query = """
+        shipping_values = [
+            _meta_number(meta[meta_key]) for meta_key in ('_order_shipping', '_order_shipping_tax') if meta_key in meta
+        ]
+        total_shipping = sum(shipping_values) if shipping_values else None
+
+        if termobox_price is not None and termobox_price > 0:
+            shipping_price = f'Dostawa: {total_shipping}\nStyropian: {termobox_price}'
+            return shipping_price
+        else:
+            shipping_price = f'Dostawa: {total_shipping}'
+            return shipping_price
+
+    def get_payment_method(self, order_id):
+        """Fetch payment method from order meta."""
+        return self._get_order_meta(order_id).get('_payment_method_title')
+
+    def get_order_attributes(self, order_id):
+        """SQL query for fetching order attributes (f.e. topper, candles)."""
+
+        order_attributes_query = """
             SELECT 
-                post_id AS order_id, 
-                MAX(CASE WHEN meta_key = '_order_total' THEN meta_value END) - 
-                MAX(CASE WHEN meta_key = '_order_shipping' THEN meta_value END) - 
-                MAX(CASE WHEN meta_key = '_order_shipping_tax' THEN meta_value END) AS cake_price
+                woi.order_item_id, 
+                MAX(CASE WHEN wim.meta_key = 'pa_topper' THEN wim.meta_value END) AS pa_topper, 
+                MAX(CASE WHEN wim.meta_key = 'pa_swieczka-nr-1' THEN wim.meta_value END) AS pa_swieczka_nr_1, 
+                MAX(CASE WHEN wim.meta_key = 'pa_swieczka-nr-2' THEN wim.meta_value END) AS pa_swieczka_nr_2, 
+                MAX(CASE WHEN wim.meta_key = 'warstwa-1-najnizsza-warstwa' THEN wim.meta_value END) AS warstwa_1, 
+                MAX(CASE WHEN wim.meta_key = 'warstwa-2-srodkowa' THEN wim.meta_value END) AS warstwa_2, 
+                MAX(CASE WHEN wim.meta_key = 'warstwa-3-srodkowa' THEN wim.meta_value END) AS warstwa_3, 
+                MAX(CASE WHEN wim.meta_key = 'warstwa-4-zewnetrzna-warstwa' THEN wim.meta_value END) AS warstwa_4, 
+                MAX(CASE WHEN wim.meta_key = 'dekoracja' THEN wim.meta_value END) AS dekoracja, 
+                MAX(CASE WHEN wim.meta_key = 'smak' THEN wim.meta_value END) AS smak,
+                woi.order_item_name AS item_name
             FROM 
-                blueluna_polishlody.wp_postmeta 
+                wp_woocommerce_order_items woi 
+                JOIN wp_woocommerce_order_itemmeta wim ON woi.order_item_id = wim.order_item_id 
             WHERE 
-                post_id = %s AND meta_key IN ('_order_total', '_order_shipping', '_order_shipping_tax') 
+                woi.order_id = %s 
+                AND woi.order_item_type = 'line_item'
+                AND wim.meta_key IN ('item_name', 'pa_topper', 'pa_swieczka-nr-1', 'pa_swieczka-nr-2', 'warstwa-1-najnizsza-warstwa', 
+                'warstwa-2-srodkowa', 'warstwa-3-srodkowa', 'warstwa-4-zewnetrzna-warstwa', 'dekoracja', 'smak')
             GROUP BY 
-                post_id
+                woi.order_item_id
         """
-        self.cur.execute(product_price_query, (order_id,))
-        result = self.cur.fetchall()
-        if result:
-            order_total = result[0][1]
-            termobox_price = self.get_termobox_price(order_id)
-            if termobox_price is None:
-                termobox_price = 0
-            only_product_price = order_total - termobox_price
-            cake_price = f'{only_product_price} zł'
-            return cake_price
-        else:
-            print('Nie ma order_total')
 
-    def get_shipping_price(self, order_id):
-        """SQL query for fetching shipping price, only if order is shipped"""
+        result = self._execute_prepared(order_attributes_query, (order_id,))
+        return self._format_order_attributes(result)
 
-        shipping_price_query = """
+    @staticmethod
+    def _format_order_attributes(result):
+        """Format order item attribute rows into decorations string."""
+
+        order_details = []
+
+        for order_item_id, *values, item_name in result:
+            # Attributes shown for the item come from the rule table, remembered per item name
+            order_attributes = rendering_rules.render_item(item_name, values)
+            if order_attributes:
+                order_details.append(order_attributes)
+
+        return "\n\n".join(order_details) if order_details else "Brak dekoracji."
+
+    def fetch_orders(self, order_ids, batch_size=ORDER_BATCH_SIZE):
+        """Fetch every spreadsheet column for a list of orders with a fixed number of queries.
+
+        Orders are fetched in chunks of batch_size with one set-based query per table, instead of
+        calling every get_* method per order. Returns OrderRecord per order, in order_ids order.
+        """
+        order_ids = list(dict.fromkeys(int(order_id) for order_id in order_ids))
+        records = []
+
+        for start in range(0, len(order_ids), batch_size):
+            chunk = order_ids[start:start + batch_size]
+            self.ensure_connection()
+            products = self._fetch_products(chunk)
+            shipping_items = self._fetch_shipping_items(chunk)
+            termobox_prices = self._fetch_termobox_prices(chunk)
+            comments = self._fetch_comments(chunk)
+            order_meta = self.load_order_meta(chunk)
+            attributes = self._fetch_order_attributes(chunk)
+
+            for order_id in chunk:
+                records.append(self._build_order_record(
+                    order_id,
+                    products.get(order_id, []),
+                    shipping_items.get(order_id, []),
+                    termobox_prices.get(order_id, 0),
+                    comments.get(order_id),
+                    order_meta.get(order_id, {}),
+                    attributes.get(order_id, []),
+                ))
+
+        return records
+
+    def fetch_orders_parallel(self, order_ids, workers=FETCH_WORKERS, batch_size=ORDER_BATCH_SIZE):
+        """Fetch orders with fetch_orders spread across a pool of threads.
+
+        Every thread has its own connection from the pool, so the number of workers is limited by the connections
+        free in the pool - the pool is shared with this fetcher, open order id streams and other fetchers.
+        Returns OrderRecord per order in order_id order.
+        """
+        order_ids = sorted(set(map(int, order_ids)))
+        workers = min(workers, self._connection_args['pool_size'] - 1)
+        if workers <= 1 or len(order_ids) <= 1:
+            return self.fetch_orders(order_ids, batch_size)
+
+        # Connections are borrowed before the threads start, pool which has fewer free gives fewer workers
+        worker_fetchers = Queue()
+        try:
+            for _ in range(workers):
+                try:
+                    worker_fetchers.put(MySQLDataFetcher(**self._connection_args, storage=self.storage))
+                except errors.PoolError:
+                    metrics.count('fetch_workers_without_connection')
+                    break
+            workers = worker_fetchers.qsize()
+            if workers <= 1:
+                return self.fetch_orders(order_ids, batch_size)
+
+            # Chunks are small enough to give every worker some orders, but never bigger than batch_size
+            chunk_size = max(1, min(batch_size, -(-len(order_ids) // workers)))
+            chunks = [order_ids[start:start + chunk_size] for start in range(0, len(order_ids), chunk_size)]
+
+            def fetch_chunk(chunk):
+                fetcher = worker_fetchers.get()
+                try:
+                    return fetcher.fetch_orders(chunk, batch_size)
+                finally:
+                    worker_fetchers.put(fetcher)
+
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='order-fetcher') as executor:
+                # map returns results in the order of chunks, so records stay sorted by order_id
+                chunk_records = list(executor.map(fetch_chunk, chunks))
+        finally:
+            while not worker_fetchers.empty():
+                worker_fetchers.get().close_connection()
+
+        return [record for records in chunk_records for record in records]
+
+    def _build_order_record(self, order_id, products, shipping_items, termobox_price, comments, meta, attributes):
+        """Build OrderRecord from data fetched for single order by fetch_orders."""
+
+        # First shipping item of the order carries the delivery date
+        delivery_date = shipping_items[0][2] if shipping_items else None
+
+        shipping_rows = self._shipping_rows([item[:2] for item in shipping_items], meta)
+
+        product_price = self._format_product_price(meta, termobox_price)
+        if product_price is None:
+            metrics.count('orders_without_order_total')
+
+        return OrderRecord(
+            order_id=order_id,
+            delivery_date=delivery_date,
+            products=self._format_products(products),
+            attributes=self._format_order_attributes(attributes),
+            shipping_address=self._format_shipping_address(shipping_rows, meta.get('NIP')),
+            product_price=product_price,
+            shipping_price=self._format_shipping_price(meta, termobox_price),
+            payment_method=meta.get('_payment_method_title'),
+            name=self._format_name(meta),
+            comments=comments,
+        )
+
+    def _fetch_products(self, order_ids):
+        """SQL query for fetching product names and quantities of many orders."""
+
+        products_query = """
             SELECT 
-                post_id AS order_id, 
-                SUM(meta_value) AS total_shipping 
+                woi.order_id, 
+                woi.order_item_name, 
+                wim.meta_value AS quantity 
             FROM 
-                blueluna_polishlody.wp_postmeta 
+                wp_woocommerce_order_items woi 
+            JOIN 
+                wp_woocommerce_order_itemmeta wim ON woi.order_item_id = wim.order_item_id 
             WHERE 
-                post_id = %s AND meta_key IN ('_order_shipping', '_order_shipping_tax')
+                woi.order_id IN ({placeholders}) 
+                AND woi.order_item_type = 'line_item' 
+                AND wim.meta_key = '_qty'
+            ORDER BY 
+                woi.order_id, woi.order_item_id
         """
-        self.cur.execute(shipping_price_query, (order_id,))
-        result = self.cur.fetchall()
-        if result:
-            termobox_price = self.get_termobox_price(order_id)
-            if termobox_price is not None and termobox_price > 0:
-                shipping_price = f'Dostawa: {result[0][1]}\nStyropian: {termobox_price}'
-                return shipping_price
-            else:
-                shipping_price = f'Dostawa: {result[0][1]}'
-                return shipping_price
-        else:
-            return None
+        self.cur.execute(products_query.format(placeholders=_placeholders(order_ids)), order_ids)
 
-    def get_payment_method(self, order_id):
-        """SQL query for fetching payment method."""
+        products = {}
+        for order_id, product_name, quantity in self.cur.fetchall():
+            products.setdefault(order_id, []).append((product_name, quantity))
+        return products
+
+    def _fetch_shipping_items(self, order_ids):
+        """SQL query for fetching shipping items together with their delivery date for many orders."""
 
-        payment_method_query = """
+        shipping_items_query = """
             SELECT 
-                post_id AS order_id, 
-                MAX(CASE WHEN meta_key = '_payment_method_title' THEN meta_value END) AS payment_method_title 
+                woi.order_id, 
+                woi.order_item_id, 
+                woi.order_item_name, 
+                wim.meta_value AS delivery_date 
             FROM 
-                blueluna_polishlody.wp_postmeta 
+                wp_woocommerce_order_items woi 
+            LEFT JOIN 
+                wp_woocommerce_order_itemmeta wim 
+                ON wim.order_item_id = woi.order_item_id AND wim.meta_key = '_delivery_date' 
             WHERE 
-                post_id = %s AND meta_key = '_payment_method_title'
+                woi.order_item_type = 'shipping' AND woi.order_id IN ({placeholders})
+            ORDER BY 
+                woi.order_id, woi.order_item_id
         """
-        self.cur.execute(payment_method_query, (order_id,))
-        return self.cur.fetchall()[0][1]
+        self.cur.execute(shipping_items_query.format(placeholders=_placeholders(order_ids)), order_ids)
 
-    def get_order_attributes(self, order_id):
-        """SQL query for fetching order attributes (f.e. topper, candles)."""
+        shipping_items = {}
+        seen_item_ids = set()
+        for order_id, order_item_id, item_name, delivery_date in self.cur.fetchall():
+            if order_item_id in seen_item_ids:
+                continue
+            seen_item_ids.add(order_item_id)
+            shipping_items.setdefault(order_id, []).append((order_item_id, item_name, delivery_date))
+        return shipping_items
+
+    def _fetch_termobox_prices(self, order_ids):
+        """SQL query for fetching termobox fee of many orders."""
+
+        termobox_prices_query = """
+            SELECT 
+                oi.order_id, 
+                SUM(oim.meta_value) AS total_fee
+            FROM wp_woocommerce_order_items oi
+            JOIN wp_woocommerce_order_itemmeta oim 
+                ON oi.order_item_id = oim.order_item_id 
+                AND oim.meta_key IN ('_fee_amount', '_line_tax')
+            WHERE oi.order_id IN ({placeholders})
+            AND oi.order_item_type = 'fee'
+            GROUP BY oi.order_id
+        """
+        self.cur.execute(termobox_prices_query.format(placeholders=_placeholders(order_ids)), order_ids)
+        return {
+            order_id: int(total_fee)
+            for order_id, total_fee in self.cur.fetchall()
+            if total_fee is not None
+        }
+
+    def _fetch_comments(self, order_ids):
+        """SQL query for fetching comments included in many orders."""
+
+        comments_query = self.storage.COMMENTS_SQL
+        self.cur.execute(comments_query.format(placeholders=_placeholders(order_ids)), order_ids)
+        return dict(self.cur.fetchall())
+
+    def load_order_meta(self, order_ids):
+        """SQL query reading ORDER_META_KEYS of many orders into {order_id: {meta_key: meta_value}}.
+
+        Every meta value needed for a spreadsheet row is read in a single pass, from wp_postmeta or from typed
+        columns of HPOS tables, all formatters read from the returned dictionary.
+        """
+
+        self.cur.execute(
+            self.storage.ORDER_META_SQL.format(
+                placeholders=_placeholders(order_ids),
+                meta_key_placeholders=_placeholders(self.storage.META_KEYS),
+            ),
+            self.storage.get_order_meta_params(order_ids),
+        )
+        return self.storage.parse_order_meta(self.cur.fetchall())
+
+    def _get_order_meta(self, order_id):
+        """Meta of single order for get_* methods, loaded once for all of them."""
+        order_id = int(order_id)
+        if self._order_meta_cache is None or self._order_meta_cache[0] != order_id:
+            self._order_meta_cache = (order_id, self.load_order_meta([order_id]).get(order_id, {}))
+        return self._order_meta_cache[1]
+
+    def _fetch_order_attributes(self, order_ids):
+        """SQL query for fetching order item attributes of many orders."""
 
         order_attributes_query = """
             SELECT 
+                woi.order_id, 
                 woi.order_item_id, 
                 MAX(CASE WHEN wim.meta_key = 'pa_topper' THEN wim.meta_value END) AS pa_topper, 
                 MAX(CASE WHEN wim.meta_key = 'pa_swieczka-nr-1' THEN wim.meta_value END) AS pa_swieczka_nr_1, 
@@ -377,109 +667,183 @@ class MySQLDataFetcher:
                 MAX(CASE WHEN wim.meta_key = 'smak' THEN wim.meta_value END) AS smak,
                 woi.order_item_name AS item_name
             FROM 
-                blueluna_polishlody.wp_woocommerce_order_items woi 
-                JOIN blueluna_polishlody.wp_woocommerce_order_itemmeta wim ON woi.order_item_id = wim.order_item_id 
+                wp_woocommerce_order_items woi 
+                JOIN wp_woocommerce_order_itemmeta wim ON woi.order_item_id = wim.order_item_id 
             WHERE 
-                woi.order_id = %s 
+                woi.order_id IN ({placeholders}) 
                 AND woi.order_item_type = 'line_item'
                 AND wim.meta_key IN ('item_name', 'pa_topper', 'pa_swieczka-nr-1', 'pa_swieczka-nr-2', 'warstwa-1-najnizsza-warstwa', 
                 'warstwa-2-srodkowa', 'warstwa-3-srodkowa', 'warstwa-4-zewnetrzna-warstwa', 'dekoracja', 'smak')
             GROUP BY 
-                woi.order_item_id
+                woi.order_id, woi.order_item_id
+            ORDER BY 
+                woi.order_id, woi.order_item_id
         """
+        self.cur.execute(order_attributes_query.format(placeholders=_placeholders(order_ids)), order_ids)
 
-        self.cur.execute(order_attributes_query, (order_id,))
-        result = self.cur.fetchall()
-
-        order_details = []
+        attributes = {}
+        for row in self.cur.fetchall():
+            attributes.setdefault(row[0], []).append(row[1:])
+        return attributes
 
-        IGLOO_TYPES = {"Iglo", "Tort miesiąca", "pistacLOVE", "Jagodziany", "Chmurka", "Słodziak"}
-        DIY_STRING = "DIY"
-        DZIECIAKI_STRING = "Dzieciaki"
-
-        for row in result:
-            order_item_id, topper, swieczka_nr_1, swieczka_nr_2, warstwa_1, warstwa_2, warstwa_3, warstwa_4, dekoracja, smak, item_name = row
-
-            order_attributes = f"{item_name}:\n"
-
-            if DIY_STRING in item_name:
-                if topper:
-                    order_attributes += f"  Topper: {topper}\n"
-                if swieczka_nr_1:
-                    order_attributes += f"  Świeczka nr 1: {swieczka_nr_1}\n"
-                if swieczka_nr_2:
-                    order_attributes += f"  Świeczka nr 2: {swieczka_nr_2}\n"
-                if warstwa_1:
-                    order_attributes += f"  Warstwa 1: {warstwa_1}\n"
-                if warstwa_2:
-                    order_attributes += f"  Warstwa 2: {warstwa_2}\n"
-                if warstwa_3:
-                    order_attributes += f"  Warstwa 3: {warstwa_3}\n"
-                if warstwa_4:
-                    order_attributes += f"  Warstwa 4: {warstwa_4}\n"
-                if dekoracja:
-                    order_attributes += f"  Dekoracja: {dekoracja}\n"
-
-            elif any(tort in item_name for tort in IGLOO_TYPES):
-                if topper:
-                    order_attributes += f"  Topper: {topper}\n"
-                if swieczka_nr_1:
-                    order_attributes += f"  Świeczka nr 1: {swieczka_nr_1}\n"
-                if swieczka_nr_2:
-                    order_attributes += f"  Świeczka nr 2: {swieczka_nr_2}\n"
-
-            elif DZIECIAKI_STRING in item_name:
-                if topper:
-                    order_attributes += f"  Topper: {topper}\n"
-                if swieczka_nr_1:
-                    order_attributes += f"  Świeczka nr 1: {swieczka_nr_1}\n"
-                if swieczka_nr_2:
-                    order_attributes += f"  Świeczka nr 2: {swieczka_nr_2}\n"
-                if smak:
-                    order_attributes += f"  Dzieciaki rządzą smak: {smak}\n"
-                if dekoracja:
-                    order_attributes += f"  Dekoracja: {dekoracja}\n"
-
-            if order_attributes.strip():
-                order_details.append(order_attributes.strip())
+    def get_production_summary(self, delivery_dates):
+        """SQL query for fetching number of every product to make on each of delivery_dates.
 
-        return "\n\n".join(order_details) if order_details else "Brak dekoracji."
+        Quantities are summed in db with a single GROUP BY over line items of sent orders which are not cancelled,
+        refunded or failed, products are split by
+        variant - layers of DIY cakes and flavour of Dzieciaki cakes, other products have empty variant.
+        Returns (delivery_date, product, variant, quantity, orders) rows.
+        """
+        if not delivery_dates:
+            return []
+
+        production_summary_query = """
+            SELECT
+                delivery.delivery_date,
+                woi.order_item_name,
+                CONCAT_WS(' / ', warstwa_1.meta_value, warstwa_2.meta_value, warstwa_3.meta_value,
+                          warstwa_4.meta_value, smak.meta_value) AS variant,
+                SUM(CAST(qty.meta_value AS UNSIGNED)) AS quantity,
+                COUNT(DISTINCT woi.order_id) AS orders
+            FROM
+                (
+                    SELECT
+                        shipping.order_id,
+                        MIN(wim.meta_value) AS delivery_date
+                    FROM
+                        wp_woocommerce_order_items shipping
+                        JOIN wp_woocommerce_order_itemmeta wim
+                            ON wim.order_item_id = shipping.order_item_id AND wim.meta_key = '_delivery_date'
+                    WHERE
+                        shipping.order_item_type = 'shipping'
+                        AND wim.meta_value IN ({date_placeholders})
+                    GROUP BY
+                        shipping.order_id
+                ) delivery
+                JOIN wp_woocommerce_order_items woi
+                    ON woi.order_id = delivery.order_id AND woi.order_item_type = 'line_item'
+                JOIN wp_woocommerce_order_itemmeta qty
+                    ON qty.order_item_id = woi.order_item_id AND qty.meta_key = '_qty'
+                LEFT JOIN wp_woocommerce_order_itemmeta warstwa_1
+                    ON warstwa_1.order_item_id = woi.order_item_id
+                    AND warstwa_1.meta_key = 'warstwa-1-najnizsza-warstwa'
+                LEFT JOIN wp_woocommerce_order_itemmeta warstwa_2
+                    ON warstwa_2.order_item_id = woi.order_item_id AND warstwa_2.meta_key = 'warstwa-2-srodkowa'
+                LEFT JOIN wp_woocommerce_order_itemmeta warstwa_3
+                    ON warstwa_3.order_item_id = woi.order_item_id AND warstwa_3.meta_key = 'warstwa-3-srodkowa'
+                LEFT JOIN wp_woocommerce_order_itemmeta warstwa_4
+                    ON warstwa_4.order_item_id = woi.order_item_id
+                    AND warstwa_4.meta_key = 'warstwa-4-zewnetrzna-warstwa'
+                LEFT JOIN wp_woocommerce_order_itemmeta smak
+                    ON smak.order_item_id = woi.order_item_id AND smak.meta_key = 'smak'
+            WHERE
+                delivery.order_id IN ({produced_orders_query})
+            GROUP BY
+                delivery.delivery_date, woi.order_item_name, variant
+            ORDER BY
+                delivery.delivery_date, woi.order_item_name, variant
+        """
+        delivery_dates = list(delivery_dates)
+        self.cur.execute(
+            production_summary_query.format(
+                date_placeholders=_placeholders(delivery_dates),
+                produced_orders_query=self.storage.PRODUCED_ORDERS_SQL,
+            ),
+            delivery_dates,
+        )
+        return [
+            (delivery_date, product, variant or '', int(quantity), orders)
+            for delivery_date, product, variant, quantity, orders in self.cur.fetchall()
+        ]
 
-    def get_missing_order_ids(self, existing_order_ids):
+    def get_missing_order_ids(self, existing_order_ids, min_order_id=FIRST_ORDER_ID):
         """Check if every order in the database is also in the spreadsheet."""
-        # Pobierz najnowsze order_id z bazy danych
-        latest_order_id = self.get_latest_order_id()
-        if latest_order_id is None:
-            return []  # Brak danych w bazie
-
         existing_order_ids = set(map(int, existing_order_ids))
 
-        # Jeśli arkusz jest pusty, zwróć wszystkie zamówienia
-        if not existing_order_ids:
-            print('W arkuszu nie ma zadnych zamowien')
-            return list(range(16750, latest_order_id + 1))
+        # Orders with sent new order email are real orders, so only them have to be in the spreadsheet
+        sent_order_ids = self.get_sent_order_ids(min_order_id)
+        return sorted(sent_order_ids - existing_order_ids)
+
+    def get_sent_order_ids(self, min_order_id=None):
+        """SQL query for fetching ids of all orders with _new_order_email_sent set to true."""
+
+        sent_order_ids_query = self.storage.SENT_ORDERS_SQL
+        params = ()
+        if min_order_id is not None:
+            sent_order_ids_query += f" AND {self.storage.SENT_ORDER_ID_COLUMN} >= %s"
+            params = (min_order_id,)
+
+        self.cur.execute(sent_order_ids_query, params)
+        return {order_id for order_id, in self.cur.fetchall()}
+
+    def filter_sent_order_ids(self, order_ids):
+        """Return those of order_ids which have new order email sent, other orders are not complete yet."""
+        if not order_ids:
+            return set()
+        sent_order_ids_query = (
+            f"{self.storage.SENT_ORDERS_SQL} AND {self.storage.SENT_ORDER_ID_COLUMN} IN ({_placeholders(order_ids)})"
+        )
+        self.cur.execute(sent_order_ids_query, tuple(order_ids))
+        return {order_id for order_id, in self.cur.fetchall()}
+
+    def get_modified_order_ids(self, modified_since, min_order_id=FIRST_ORDER_ID):
+        """Fetch ids of orders modified at modified_since (post_modified_gmt) or later.
+
+        Returns sorted order ids and the newest modification time, which is modified_since of the next run.
+        Orders modified in the same second as the previous run are returned again, their rows do not change.
+        """
+        self.cur.execute(self.storage.MODIFIED_ORDERS_SQL, (modified_since, min_order_id))
+        rows = self.cur.fetchall()
+        if not rows:
+            return [], modified_since
+        return sorted(order_id for order_id, _ in rows), str(max(modified for _, modified in rows))
+
+    def get_last_modified(self):
+        """SQL query for fetching modification time of the most recently modified order."""
 
-        missing_order_ids = []
+        self.cur.execute(self.storage.LAST_MODIFIED_SQL)
+        last_modified, = self.cur.fetchone()
+        return str(last_modified) if last_modified is not None else None
 
-        # Sprawdzaj każdy order_id i loguj wynik is_new_order_email_sent_true
-        for order_id in range(16750, latest_order_id + 1):
-            is_sent = self.is_new_order_email_sent_true(order_id)
-            print(f"Order ID: {order_id}, is_new_order_email_sent: {is_sent}")
-            if order_id not in existing_order_ids and is_sent:
-                missing_order_ids.append(order_id)
+    def iter_sent_order_id_chunks(self, min_order_id=None, chunk_size=BACKFILL_CHUNK_SIZE):
+        """Stream ids of orders with _new_order_email_sent set to true in ascending chunks of chunk_size.
 
-        return missing_order_ids
+        Ids are read from unbuffered cursor on separate connection from the pool, so only one chunk is held
+        in memory and this fetcher can fetch order data while the stream is open.
+        """
+        order_id_column = self.storage.SENT_ORDER_ID_COLUMN
+        sent_order_ids_query = (
+            f"{self.storage.SENT_ORDERS_SQL} AND {order_id_column} >= %s ORDER BY {order_id_column}"
+        )
+        stream_connection = get_connection_pool(
+            self._connection_args['username'],
+            self._connection_args['password'],
+            self._connection_args['host'],
+            self._connection_args['database'],
+            self._connection_args['pool_size'],
+        ).get_connection()
+        cursor = metrics.instrument_cursor(stream_connection.cursor(buffered=False))
+        try:
+            # Server waits for the next chunk while it is written to the spreadsheet
+            cursor.execute("SET SESSION net_write_timeout = 3600")
+            cursor.execute(sent_order_ids_query, (min_order_id or 0,))
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield [order_id for order_id, in rows]
+        finally:
+            # Rows left after interrupted stream have to be read before the connection goes back to the pool
+            if stream_connection.unread_result:
+                stream_connection.consume_results()
+            cursor.close()
+            stream_connection.close()
 
     def is_new_order_email_sent_true(self, order_id):
         """Check if _new_order_email_sent is true for the given order ID."""
-        email_sent_query = """
-            SELECT COUNT(*) 
-            FROM wp_postmeta 
-            WHERE post_id = %s AND meta_key = '_new_order_email_sent' AND meta_value = 'true'
-        """
-        self.cur.execute(email_sent_query, (order_id,))
-        result = self.cur.fetchone()
-        if result[0] > 0:
+        email_sent_query = f"{self.storage.SENT_ORDERS_SQL} AND {self.storage.SENT_ORDER_ID_COLUMN} = %s"
+        result = self._execute_prepared(email_sent_query, (order_id,))
+        if result:
             return True
         else:
             return False
@@ -496,29 +860,21 @@ class MySQLDataFetcher:
             AND oi.order_item_type = 'fee';
         """
         ## SPRAWDZIC CZY _FEE_AMOUNT CZY _LINE_TOTAL poniewaz nie wiem czy dostawa zalicza się do _line_total
-        self.cur.execute(termobox_price_query, (order_id,))
-        result = self.cur.fetchall()
+        result = self._execute_prepared(termobox_price_query, (order_id,))
         if len(result) > 0 and result[0][0] is not None:
             termobox_price = result[0][0]
-            print(termobox_price)
             return int(termobox_price)
         else:
             return 0
 
     def get_nip_number(self, order_id):
-        nip_number_query = """
-        SELECT meta_value
-        FROM blueluna_polishlody.wp_postmeta pm
-        WHERE pm.post_id = %s AND meta_key = 'NIP'
-        """
-        self.cur.execute(nip_number_query, (order_id,))
-        result = self.cur.fetchone()
-
-        if result is not None:
-            nip_number = result[0]
-            return nip_number
+        return self._get_order_meta(order_id).get('NIP')
 
     def close_connection(self):
+        """Close cursors and give the connection back to the pool."""
+        for cursor in self._prepared_cursors.values():
+            cursor.close()
+        self._prepared_cursors = {}
         self.cur.close()
         self.conn.close()
 
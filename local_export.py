@@ -0,0 +1,138 @@
+"""Script for exporting orders to local CSV or XLSX file, without Sheets API quota.
+
+Rows are the same as written to google spreadsheets and the file is sorted by delivery_date and shipping address
+like the worksheet. Rows are sorted in runs of EXPORT_RUN_ROWS spilled to temporary files and merged at the end,
+so memory does not grow with the number of exported orders.
+"""
+import csv
+import heapq
+import json
+import os
+import tempfile
+from push_to_excel import order_sort_key
+
+# Number of rows sorted in memory before they are spilled to a temporary file
+EXPORT_RUN_ROWS = int(os.getenv('EXPORT_RUN_ROWS', '50000'))
+
+
+class CsvSink:
+    """Writes rows to CSV file as they come."""
+
+    def __init__(self, path, header=None):
+        """Init arguments passed to the class - path of the file and optional header row."""
+
+        self.path = path
+        self._file = open(path, 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        if header:
+            self._writer.writerow(header)
+
+    def write_rows(self, rows):
+        self._writer.writerows(['' if value is None else value for value in row] for row in rows)
+
+    def close(self):
+        self._file.close()
+
+
+class XlsxSink:
+    """Writes rows to XLSX file with openpyxl write-only workbook, which keeps only the current row in memory."""
+
+    def __init__(self, path, header=None, title='Zamówienia'):
+        """Init arguments passed to the class - path of the file, optional header row and worksheet title."""
+        try:
+            from openpyxl import Workbook
+        except ImportError as error:
+            raise ImportError('Export to XLSX needs openpyxl, install it or export to CSV') from error
+
+        self.path = path
+        self._workbook = Workbook(write_only=True)
+        self._worksheet = self._workbook.create_sheet(title)
+        if header:
+            self._worksheet.append(list(header))
+
+    def write_rows(self, rows):
+        for row in rows:
+            self._worksheet.append(list(row))
+
+    def close(self):
+        self._workbook.save(self.path)
+
+
+SINKS = {'.csv': CsvSink, '.xlsx': XlsxSink}
+
+
+def create_sink(path, header=None):
+    """Return sink writing to path, the format is chosen by the file extension."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in SINKS:
+        raise ValueError(f'Unsupported export format {extension!r}, use one of {", ".join(SINKS)}')
+    return SINKS[extension](path, header)
+
+
+class SortedOrderExport:
+    """Collects order rows and writes them to the sink sorted by delivery_date and shipping address.
+
+    append_orders works like the one of GoogleSheetsUpdater, so it can be passed as write_batch of run_pipeline.
+    Rows are written to the sink only by close, after every batch was appended.
+    """
+
+    def __init__(self, sink, run_rows=EXPORT_RUN_ROWS, temp_dir=None):
+        """Init arguments passed to the class - sink, number of rows sorted in memory and directory for runs."""
+
+        self.sink = sink
+        self.run_rows = run_rows
+        self.temp_dir = temp_dir
+        self.rows = []
+        # Temporary files with sorted runs, one JSON encoded row per line
+        self.runs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._remove_runs()
+            self.sink.close()
+
+    def append_orders(self, rows):
+        """Add orders to the export, returns rows which will be written - orders without delivery_date are skipped."""
+        rows = [list(row) for row in rows if row[1] is not None]
+        self.rows.extend(rows)
+        if len(self.rows) >= self.run_rows:
+            self._spill_run()
+        return rows
+
+    def _spill_run(self):
+        self.rows.sort(key=order_sort_key)
+        run = tempfile.TemporaryFile('w+', encoding='utf-8', dir=self.temp_dir)
+        for row in self.rows:
+            run.write(json.dumps(row, ensure_ascii=False, default=str))
+            run.write('\n')
+        run.seek(0)
+        self.runs.append(run)
+        self.rows = []
+
+    @staticmethod
+    def _read_run(run):
+        for line in run:
+            yield json.loads(line)
+
+    def close(self):
+        """Merge sorted runs into the sink and close it."""
+        try:
+            self.rows.sort(key=order_sort_key)
+            # Merge is stable, so rows with equal keys keep the order in which they were appended
+            self.sink.write_rows(
+                heapq.merge(*(self._read_run(run) for run in self.runs), self.rows, key=order_sort_key)
+            )
+        finally:
+            self._remove_runs()
+            self.rows = []
+            self.sink.close()
+
+    def _remove_runs(self):
+        for run in self.runs:
+            run.close()
+        self.runs = []
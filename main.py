@@ -1,7 +1,20 @@
 """Main script for launching fetching data from db and pushing it to google spreadsheets."""
+from startup import mark_startup, report_startup, startup_step
+import argparse
+import base64
+import json
 import os
-from fetch_from_db import MySQLDataFetcher
-from push_to_excel import updater
+from datetime import date, timedelta
+from event_sync import get_event_order_ids, sync_orders
+from fetch_from_db import BACKFILL_CHUNK_SIZE, FIRST_ORDER_ID, MySQLDataFetcher, OrderRecord
+from local_export import SortedOrderExport, create_sink
+from metrics import metrics
+from pipeline import run_pipeline
+from production_summary import PRODUCTION_SUMMARY_ENABLED, ProductionSummary
+from push_to_excel import ARCHIVE_AFTER_DAYS, get_updater, parse_delivery_date
+from sync_state import SyncState
+
+mark_startup('import modules')
 
 # Fetch credentials and connection details from environment variables
 username = os.getenv('DB_USERNAME')
@@ -10,55 +23,256 @@ host = os.getenv('DB_HOST')
 database = os.getenv('DB_NAME')
 
 
-def main():
-
+def create_data_fetcher():
     # Initialize the data fetcher with environment variables
-    data_fetcher = MySQLDataFetcher(
+    return MySQLDataFetcher(
         username=username,
         password=password,
         host=host,
         database=database
     )
-    print("Start fetching orders from database...")
-    existing_order_ids = updater.get_existing_order_ids()
-
-    missing_order_ids = data_fetcher.get_missing_order_ids(existing_order_ids)
-    print(f'Missing orders in google spreadsheet: {len(missing_order_ids)}', missing_order_ids)
-    missing_order_ids = [17535, 17530]
-    for missing_order_id in missing_order_ids:
-        product_names_and_quantities = data_fetcher.get_product_names_and_quantities(missing_order_id)
-        delivery_date = data_fetcher.get_delivery_date(missing_order_id)
-        shipping_address = data_fetcher.get_shipping_address(missing_order_id)
-        comments_to_order = data_fetcher.get_comments_to_order(missing_order_id)
-        first_and_last_name = data_fetcher.get_first_and_last_name(missing_order_id)
-        product_price = data_fetcher.get_product_price(missing_order_id)
-        shipping_price = data_fetcher.get_shipping_price(missing_order_id)
-        payment_method = data_fetcher.get_payment_method(missing_order_id)
-        order_attributes = data_fetcher.get_order_attributes(missing_order_id)
-
-        new_data = [
-            missing_order_id,
-            delivery_date,
-            product_names_and_quantities,
-            order_attributes,
-            shipping_address,
-            product_price,
-            shipping_price,
-            payment_method,
-            first_and_last_name,
-            comments_to_order,
-        ]
-        print(new_data)
-        updater.update_data(new_data)
-    data_fetcher.close_connection()
-    print("Fetching completed. Closing connection.")
-    updater.sort_spreadsheet()
-    print("Spreadsheet sorted.")
+
+
+def update_modified_orders(data_fetcher, updater, sync_state, resort=True, delivery_dates=None,
+                           added_order_ids=()):
+    """Rewrite orders edited in WooCommerce since the last run, returns rows which changed in the spreadsheet.
+
+    Delivery dates of changed orders, from before and after the change, are added to delivery_dates set.
+    Orders in added_order_ids were just written by this run, so they are not fetched again.
+    """
+    if sync_state.modified_since is None:
+        # Without watermark there is no way to tell what was edited, changes are tracked from now on
+        sync_state.modified_since = data_fetcher.get_last_modified()
+        return []
+
+    modified_order_ids, modified_since = data_fetcher.get_modified_order_ids(sync_state.modified_since)
+    mirror = updater.get_mirror()
+    # Orders missing in the spreadsheet are added by the regular run
+    added_order_ids = set(map(int, added_order_ids))
+    order_ids = [
+        order_id for order_id in modified_order_ids
+        if mirror.has_order(order_id) and int(order_id) not in added_order_ids
+    ]
+    metrics.count('modified_orders', len(order_ids))
+
+    rows = [list(order_record) for order_record in data_fetcher.fetch_orders_parallel(order_ids)]
+    previous_dates = {int(row[0]): mirror.rows[mirror.order_rows[int(row[0])] - 2][1] for row in rows}
+    updated_rows = updater.update_orders_in_place(rows, resort=resort)
+    metrics.count('orders_updated', len(updated_rows))
+    if delivery_dates is not None:
+        for row in updated_rows:
+            delivery_dates.update((previous_dates[int(row[0])], row[1]))
+    sync_state.modified_since = modified_since
+    return updated_rows
+
+
+def archive_delivered_orders(updater, sync_state, archive_after_days=ARCHIVE_AFTER_DAYS):
+    """Move orders delivered long ago to archive worksheets, so the worksheet read and sorted every run stays small."""
+    if not archive_after_days:
+        return []
+    archived_rows = updater.archive_orders(date.today() - timedelta(days=archive_after_days))
+    sync_state.record_archived(row[0] for row in archived_rows if row[0].isdigit())
+    metrics.count('orders_archived', len(archived_rows))
+    return archived_rows
+
+
+def refresh_production_summary(data_fetcher, updater, delivery_dates):
+    """Compute kitchen production summary again for delivery dates touched by this run."""
+    if not PRODUCTION_SUMMARY_ENABLED:
+        return []
+    return ProductionSummary(updater).refresh(data_fetcher, delivery_dates)
+
+
+def scan_orders(data_fetcher, updater, sync_state, full_rescan=False, archive_after_days=ARCHIVE_AFTER_DAYS):
+    """Add orders missing in the spreadsheet and rewrite modified ones, returns rows which were added.
+
+    Incremental run checks the checkpoint window, full rescan (also done when there is no checkpoint yet)
+    every order in the database. Orders delivered more than archive_after_days ago are archived at the end.
+    """
+    full_rescan = full_rescan or sync_state.is_empty()
+    if full_rescan:
+        # Full rescan compares every order in the database with freshly downloaded spreadsheet
+        updater.refresh_mirror()
+        existing_order_ids = updater.get_existing_order_ids()
+        sync_state.reset(existing_order_ids)
+        # Archive index is rebuilt from archive worksheets, the checkpoint may be lost or made on other machine
+        sync_state.record_archived(updater.get_archived_order_ids())
+        missing_order_ids = data_fetcher.get_missing_order_ids(existing_order_ids)
+        # Full rescan computes summary of every upcoming delivery date again
+        delivery_dates = {
+            row[1] for row in updater.mirror.rows
+            if len(row) > 1 and (parse_delivery_date(row[1]) or date.min) >= date.today()
+        }
+    else:
+        updater.start_run()
+        # Incremental run checks only orders above the watermark and a window of late orders below it.
+        # Orders in the mirror are not missing either, even when the run which wrote them failed before
+        # the checkpoint was saved
+        missing_order_ids = data_fetcher.get_missing_order_ids(
+            sync_state.synced_order_ids.union(map(int, updater.get_existing_order_ids())),
+            min_order_id=sync_state.get_window_start(FIRST_ORDER_ID)
+        )
+        delivery_dates = set()
+    # Orders moved to archive worksheets are not in the worksheet anymore, but they are not missing
+    missing_order_ids = sync_state.remove_archived(missing_order_ids)
+    metrics.count('missing_orders', len(missing_order_ids))
+
+    def fetch_rows(order_ids):
+        return [list(order_record) for order_record in data_fetcher.fetch_orders_parallel(order_ids)]
+
+    # Orders without delivery date are skipped by the updater, so they are retried next run.
+    # Spreadsheet was sorted by previous run, so in incremental run new orders are put straight into their place
+    write_rows = updater.append_orders if full_rescan else updater.insert_orders_sorted
+
+    # Next batch of orders is fetched from db while the previous one is written to the spreadsheet
+    added_rows = run_pipeline(fetch_rows, write_rows, missing_order_ids)
+    # Full rescan sorts the spreadsheet anyway, so rows with changed delivery_date are not sorted twice
+    update_modified_orders(data_fetcher, updater, sync_state, resort=not full_rescan,
+                           delivery_dates=delivery_dates, added_order_ids=[row[0] for row in added_rows])
+    # Writes merged while waiting for quota are sent before the checkpoint is moved past them
+    updater.flush()
+    metrics.count('orders_written', len(added_rows))
+
+    if full_rescan:
+        updater.sort_spreadsheet_server_side()
+
+    sync_state.record_synced(row[0] for row in added_rows)
+    sync_state.save()
+
+    # Archive and summary are refreshed after the checkpoint is saved, so when they fail written orders
+    # are not added again
+    archive_delivered_orders(updater, sync_state, archive_after_days)
+    sync_state.save()
+    delivery_dates.update(row[1] for row in added_rows)
+    refresh_production_summary(data_fetcher, updater, delivery_dates)
+    return added_rows
+
+
+def main(full_rescan=False):
+
+    with startup_step('connect to db'):
+        data_fetcher = create_data_fetcher()
+    try:
+        scan_orders(data_fetcher, get_updater(), SyncState(), full_rescan)
+    finally:
+        data_fetcher.close_connection()
+    report_startup()
+    metrics.emit()
+
+
+def targeted_sync(order_ids):
+    """Sync only orders named in Pub/Sub message, without scanning the database for missing orders."""
+    sync_state = SyncState()
+    if sync_state.is_empty():
+        # Orders are inserted into already sorted spreadsheet, which only a full rescan guarantees
+        main(full_rescan=True)
+        return
+
+    with startup_step('connect to db'):
+        data_fetcher = create_data_fetcher()
+    try:
+        updater = get_updater()
+        added_rows = sync_orders(order_ids, data_fetcher, updater, sync_state)
+        refresh_production_summary(data_fetcher, updater, {row[1] for row in added_rows})
+    finally:
+        data_fetcher.close_connection()
+    report_startup()
+    metrics.emit()
+
+
+def backfill(restart=False, chunk_size=BACKFILL_CHUNK_SIZE):
+    """Replay every historical order into empty or reset spreadsheet, chunk by chunk.
+
+    Order ids are streamed from db, every chunk is fetched and appended in bulk and checkpointed,
+    so a crashed backfill resumes after the last written chunk and memory does not grow with number of orders.
+    """
+    metrics.reset()
+    data_fetcher = create_data_fetcher()
+    try:
+        updater = get_updater()
+        sync_state = SyncState()
+
+        if restart or sync_state.backfill_order_id is None:
+            start_order_id = FIRST_ORDER_ID
+            already_added_order_ids = set()
+        else:
+            start_order_id = sync_state.backfill_order_id + 1
+            # Chunk written just before the crash may be missing in the checkpoint
+            already_added_order_ids = {
+                int(order_id) for order_id in updater.get_column_values(1)[1:]
+                if order_id.isdigit() and int(order_id) >= start_order_id
+            }
+            metrics.count('backfill_resumed')
+
+        for order_ids in data_fetcher.iter_sent_order_id_chunks(start_order_id, chunk_size):
+            new_order_ids = [order_id for order_id in order_ids if order_id not in already_added_order_ids]
+            rows = [list(order_record) for order_record in data_fetcher.fetch_orders_parallel(new_order_ids)]
+            added_rows = updater.append_orders(rows)
+            updater.flush()
+            metrics.count('orders_written', len(added_rows))
+
+            sync_state.record_synced(row[0] for row in added_rows)
+            sync_state.backfill_order_id = order_ids[-1]
+            sync_state.save()
+            metrics.count('backfill_chunks')
+    finally:
+        data_fetcher.close_connection()
+
+    updater.sort_spreadsheet_server_side()
+    sync_state.backfill_order_id = None
+    sync_state.save()
+    metrics.emit()
+
+
+def export_orders(path, min_order_id=FIRST_ORDER_ID, chunk_size=BACKFILL_CHUNK_SIZE):
+    """Export every order from min_order_id to local CSV or XLSX file, sorted like the spreadsheet."""
+    metrics.reset()
+    data_fetcher = create_data_fetcher()
+    exported_orders = 0
+    try:
+        with SortedOrderExport(create_sink(path, header=OrderRecord._fields)) as export:
+            for order_ids in data_fetcher.iter_sent_order_id_chunks(min_order_id, chunk_size):
+                rows = [list(order_record) for order_record in data_fetcher.fetch_orders_parallel(order_ids)]
+                exported_orders += len(export.append_orders(rows))
+                metrics.count('export_chunks')
+    finally:
+        data_fetcher.close_connection()
+    metrics.count('orders_exported', exported_orders)
+    metrics.emit()
+
+
+def is_full_rescan_requested(event):
+    """Full rescan is done only when Pub/Sub message has attribute mode=full."""
+    if not isinstance(event, dict):
+        return False
+    attributes = event.get('attributes') or {}
+    return attributes.get('mode') == 'full'
 
 
 def hello_pubsub(event, context):
-    main()
+    # Run starts with the message, so messages which cannot be parsed are counted in its metrics
+    metrics.reset()
+    order_ids = [] if is_full_rescan_requested(event) else get_event_order_ids(event)
+    if order_ids:
+        targeted_sync(order_ids)
+    else:
+        main(full_rescan=is_full_rescan_requested(event))
 
 
 if __name__ == '__main__':
-    hello_pubsub('data', 'context')
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--full', action='store_true', help='compare every order with the spreadsheet')
+    parser.add_argument('--backfill', action='store_true', help='replay every order into empty spreadsheet')
+    parser.add_argument('--restart', action='store_true', help='start backfill from the beginning')
+    parser.add_argument('--export', metavar='PATH', help='export every order to local .csv or .xlsx file')
+    parser.add_argument('--order', type=int, action='append', help='sync only this order, like Pub/Sub message would')
+    args = parser.parse_args()
+    if args.backfill:
+        backfill(restart=args.restart)
+    elif args.export:
+        export_orders(args.export)
+    elif args.order:
+        data = base64.b64encode(json.dumps({'order_ids': args.order}).encode()).decode()
+        hello_pubsub({'data': data}, 'context')
+    else:
+        hello_pubsub({'attributes': {'mode': 'full'}} if args.full else {}, 'context')
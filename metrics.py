@@ -0,0 +1,230 @@
+"""Script for collecting metrics of a synchronisation run - db queries, Sheets API calls and orders."""
+import json
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# Metrics are collected and summary is printed at the end of a run, SYNC_METRICS=0 turns it off
+METRICS_ENABLED = os.getenv('SYNC_METRICS', '1').lower() not in ('0', 'false', 'off', '')
+
+# Optional file for node_exporter textfile collector, written at the end of a run
+METRICS_TEXTFILE = os.getenv('SYNC_METRICS_TEXTFILE')
+
+# Helper methods executing queries for other methods, the query is named after the method which called them
+_QUERY_HELPERS = frozenset({'_execute_prepared'})
+
+# Spreadsheet methods returning worksheets, which record their calls too
+_WORKSHEET_METHODS = frozenset({'worksheet', 'worksheets', 'add_worksheet', 'get_worksheet', 'get_worksheet_by_id'})
+
+
+def _percentile(values, percent):
+    """Nearest-rank percentile of values."""
+    values = sorted(values)
+    return values[max(0, math.ceil(len(values) * percent / 100) - 1)]
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class InstrumentedCursor:
+    """Cursor recording latency and rows of every query, named after the method which executed it.
+
+    Time of fetching rows is added to the query, the query is recorded when the next one is executed
+    or the cursor is closed.
+    """
+
+    def __init__(self, cursor, run_metrics):
+        self._cursor = cursor
+        self._metrics = run_metrics
+        # [name, seconds, rows] of the last executed query
+        self._query = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def execute(self, *args, **kwargs):
+        self._record_query()
+        frame = sys._getframe(1)
+        while frame.f_back is not None and frame.f_code.co_name in _QUERY_HELPERS:
+            frame = frame.f_back
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(*args, **kwargs)
+        finally:
+            self._query = [frame.f_code.co_name, time.perf_counter() - started, 0]
+
+    def fetchall(self):
+        return self._fetch(self._cursor.fetchall)
+
+    def fetchmany(self, *args, **kwargs):
+        return self._fetch(self._cursor.fetchmany, *args, **kwargs)
+
+    def fetchone(self):
+        row = self._fetch(self._cursor.fetchone)
+        if row is not None and self._query is not None:
+            self._query[2] += 1
+        return row
+
+    def _fetch(self, fetch, *args, **kwargs):
+        started = time.perf_counter()
+        rows = fetch(*args, **kwargs)
+        if self._query is not None:
+            self._query[1] += time.perf_counter() - started
+            if isinstance(rows, list):
+                self._query[2] += len(rows)
+        return rows
+
+    def close(self):
+        self._record_query()
+        return self._cursor.close()
+
+    def _record_query(self):
+        if self._query is not None:
+            self._metrics.observe('db', *self._query)
+            self._query = None
+
+
+class InstrumentedApi:
+    """Proxy of gspread Worksheet or Spreadsheet recording latency of every API method call."""
+
+    def __init__(self, api_object, run_metrics):
+        self._api_object = api_object
+        self._metrics = run_metrics
+
+    def __getattr__(self, name):
+        attribute = getattr(self._api_object, name)
+        if name == 'spreadsheet':
+            return InstrumentedApi(attribute, self._metrics)
+        if name.startswith('_') or not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            started = time.perf_counter()
+            result = None
+            try:
+                result = attribute(*args, **kwargs)
+            finally:
+                rows = len(result) if isinstance(result, list) else 0
+                self._metrics.observe('sheets', name, time.perf_counter() - started, rows)
+            if name in _WORKSHEET_METHODS:
+                if isinstance(result, list):
+                    return [InstrumentedApi(worksheet, self._metrics) for worksheet in result]
+                return InstrumentedApi(result, self._metrics)
+            return result
+        return call
+
+
+class RunMetrics:
+    def __init__(self, enabled=METRICS_ENABLED, textfile=METRICS_TEXTFILE):
+        """Init arguments passed to the class - whether metrics are collected and optional Prometheus textfile."""
+
+        self.enabled = enabled
+        self.textfile = textfile
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Start a new run, warm Cloud Function invocations reuse this object."""
+        with self._lock:
+            self.started = time.perf_counter()
+            # (kind, name) -> {'latencies': [seconds, ...], 'rows': rows}
+            self.calls = {}
+            self.counters = {}
+
+    def observe(self, kind, name, seconds, rows=0):
+        """Record single db query or API call."""
+        if not self.enabled:
+            return
+        with self._lock:
+            call = self.calls.get((kind, name))
+            if call is None:
+                call = self.calls[(kind, name)] = {'latencies': [], 'rows': 0}
+            call['latencies'].append(seconds)
+            call['rows'] += rows
+
+    def count(self, name, value=1):
+        """Increase counter, for example number of written orders."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def instrument_cursor(self, cursor):
+        """Return cursor recording its queries, or the cursor itself when metrics are disabled."""
+        return InstrumentedCursor(cursor, self) if self.enabled else cursor
+
+    def instrument_sheets(self, worksheet):
+        """Return worksheet recording its API calls, or the worksheet itself when metrics are disabled."""
+        if not self.enabled or worksheet is None or isinstance(worksheet, InstrumentedApi):
+            return worksheet
+        return InstrumentedApi(worksheet, self)
+
+    def get_summary(self):
+        """Summary of the run - counters, time per order and count, total and p95 latency of every query."""
+        with self._lock:
+            wall_seconds = time.perf_counter() - self.started
+            orders = self.counters.get('orders_written', 0)
+            summary = {
+                'wall_seconds': round(wall_seconds, 3),
+                'seconds_per_order': round(wall_seconds / orders, 4) if orders else None,
+                'counters': dict(self.counters),
+                'db': {},
+                'sheets': {},
+            }
+            for (kind, name), call in sorted(self.calls.items()):
+                summary[kind][name] = {
+                    'count': len(call['latencies']),
+                    'total_seconds': round(sum(call['latencies']), 4),
+                    'p95_seconds': round(_percentile(call['latencies'], 95), 4),
+                    'rows': call['rows'],
+                }
+        return summary
+
+    def emit(self):
+        """Print JSON summary of the run and write Prometheus textfile if it is configured."""
+        if not self.enabled:
+            return None
+        summary = self.get_summary()
+        print(f'Sync metrics - {json.dumps(summary, ensure_ascii=False)}')
+        if self.textfile:
+            self.write_textfile(summary)
+        return summary
+
+    def write_textfile(self, summary):
+        """Write summary in Prometheus text format, atomically so the collector never reads half written file."""
+        lines = [
+            '# TYPE order_sync_run_seconds gauge',
+            f'order_sync_run_seconds {summary["wall_seconds"]}',
+            '# TYPE order_sync_seconds_per_order gauge',
+            f'order_sync_seconds_per_order {summary["seconds_per_order"] or 0}',
+            '# TYPE order_sync_events gauge',
+        ]
+        lines.extend(
+            f'order_sync_events{{name="{_label(name)}"}} {value}' for name, value in sorted(summary['counters'].items())
+        )
+        for metric, field in (('calls', 'count'), ('call_seconds', 'total_seconds'),
+                              ('call_p95_seconds', 'p95_seconds'), ('call_rows', 'rows')):
+            lines.append(f'# TYPE order_sync_{metric} gauge')
+            for kind in ('db', 'sheets'):
+                lines.extend(
+                    f'order_sync_{metric}{{kind="{kind}",name="{_label(name)}"}} {call[field]}'
+                    for name, call in summary[kind].items()
+                )
+
+        directory = os.path.dirname(os.path.abspath(self.textfile))
+        file_descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix='.order_sync_metrics_')
+        try:
+            with os.fdopen(file_descriptor, 'w', encoding='utf-8') as temp_file:
+                temp_file.write('\n'.join(lines) + '\n')
+            os.replace(temp_path, self.textfile)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+
+# Metrics of the current run, shared by fetcher, updater and main
+metrics = RunMetrics()
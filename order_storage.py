@@ -0,0 +1,272 @@
+"""Script with SQL of the two ways WooCommerce keeps orders - legacy posts and HPOS order tables.
+
+Order items (wp_woocommerce_order_items and wp_woocommerce_order_itemmeta) are the same in both, only order
+header, addresses, totals and meta are kept in different tables. Both storages return order meta in the legacy
+shape {order_id: {meta_key: meta_value}}, so formatting of spreadsheet rows does not depend on the storage.
+"""
+import os
+
+# legacy, hpos or auto - detected from WooCommerce settings
+ORDER_STORAGE = os.getenv('ORDER_STORAGE', 'auto')
+
+# Meta keys from wp_postmeta needed to build a spreadsheet row
+ORDER_META_KEYS = (
+    '_billing_first_name', '_billing_last_name', '_billing_company', '_billing_phone',
+    '_shipping_address_1', '_shipping_address_2', '_shipping_city', '_shipping_company',
+    '_order_total', '_order_shipping', '_order_shipping_tax', '_payment_method_title',
+    'Czas dostawy', 'NIP',
+)
+
+# Statuses of orders which are not made, as an SQL list - the same values in wp_posts and HPOS wp_wc_orders
+CANCELLED_ORDER_STATUSES = "'wc-cancelled', 'wc-refunded', 'wc-failed'"
+
+# WooCommerce setting which is 'yes' when HPOS tables are the authoritative order storage
+HPOS_ENABLED_QUERY = """
+    SELECT
+        option_value
+    FROM
+        wp_options
+    WHERE
+        option_name = 'woocommerce_custom_orders_table_enabled'
+"""
+
+
+class LegacyPostStorage:
+    """Orders kept as shop_order posts with every field in wp_postmeta."""
+
+    name = 'legacy'
+
+    # Ids of orders with sent new order email, usable as `IN (...)` subquery, more conditions can be added with AND
+    SENT_ORDERS_SQL = """
+            SELECT
+                post_id
+            FROM
+                wp_postmeta
+            WHERE
+                meta_key = '_new_order_email_sent'
+                AND meta_value = 'true'
+    """
+    SENT_ORDER_ID_COLUMN = 'post_id'
+
+    # Ids of sent orders which are not cancelled, refunded or failed, products of these are made
+    PRODUCED_ORDERS_SQL = f"""
+            SELECT
+                post_id
+            FROM
+                wp_postmeta
+                JOIN wp_posts ON wp_posts.ID = wp_postmeta.post_id
+            WHERE
+                meta_key = '_new_order_email_sent'
+                AND meta_value = 'true'
+                AND wp_posts.post_status NOT IN ({CANCELLED_ORDER_STATUSES})
+    """
+
+    LATEST_ORDER_ID_SQL = """
+            SELECT
+                post_id
+            FROM
+                wp_postmeta
+            ORDER BY
+                post_id DESC
+            LIMIT 1
+    """
+
+    COMMENTS_SQL = """
+            SELECT
+                ID,
+                post_excerpt
+            FROM
+                wp_posts
+            WHERE
+                ID IN ({placeholders})
+    """
+
+    MODIFIED_ORDERS_SQL = """
+            SELECT
+                ID, post_modified_gmt
+            FROM
+                wp_posts
+            WHERE
+                post_type = 'shop_order'
+                AND post_modified_gmt >= %s
+                AND ID >= %s
+    """
+
+    LAST_MODIFIED_SQL = """
+            SELECT
+                MAX(post_modified_gmt)
+            FROM
+                wp_posts
+            WHERE
+                post_type = 'shop_order'
+    """
+
+    ORDER_META_SQL = """
+            SELECT
+                post_id,
+                meta_key,
+                meta_value
+            FROM
+                wp_postmeta
+            WHERE
+                post_id IN ({placeholders})
+                AND meta_key IN ({meta_key_placeholders})
+    """
+
+    # Meta keys read by ORDER_META_SQL
+    META_KEYS = ORDER_META_KEYS
+
+    def get_order_meta_params(self, order_ids):
+        """Params of ORDER_META_SQL, in the order of its placeholders."""
+        return (*order_ids, *self.META_KEYS)
+
+    @staticmethod
+    def parse_order_meta(rows):
+        """Pivot (post_id, meta_key, meta_value) rows into {order_id: {meta_key: meta_value}}."""
+        order_meta = {}
+        for post_id, meta_key, meta_value in rows:
+            order_meta.setdefault(post_id, {}).setdefault(meta_key, meta_value)
+        return order_meta
+
+
+class HposStorage:
+    """Orders kept in High-Performance Order Storage tables, header, addresses and totals in typed columns."""
+
+    name = 'hpos'
+
+    SENT_ORDERS_SQL = """
+            SELECT
+                order_id
+            FROM
+                wp_wc_order_operational_data
+            WHERE
+                new_order_email_sent = 1
+    """
+    SENT_ORDER_ID_COLUMN = 'order_id'
+
+    PRODUCED_ORDERS_SQL = f"""
+            SELECT
+                order_id
+            FROM
+                wp_wc_order_operational_data
+                JOIN wp_wc_orders ON wp_wc_orders.id = wp_wc_order_operational_data.order_id
+            WHERE
+                new_order_email_sent = 1
+                AND wp_wc_orders.status NOT IN ({CANCELLED_ORDER_STATUSES})
+    """
+
+    LATEST_ORDER_ID_SQL = """
+            SELECT
+                id
+            FROM
+                wp_wc_orders
+            ORDER BY
+                id DESC
+            LIMIT 1
+    """
+
+    COMMENTS_SQL = """
+            SELECT
+                id,
+                customer_note
+            FROM
+                wp_wc_orders
+            WHERE
+                id IN ({placeholders})
+    """
+
+    MODIFIED_ORDERS_SQL = """
+            SELECT
+                id, date_updated_gmt
+            FROM
+                wp_wc_orders
+            WHERE
+                type = 'shop_order'
+                AND date_updated_gmt >= %s
+                AND id >= %s
+    """
+
+    LAST_MODIFIED_SQL = """
+            SELECT
+                MAX(date_updated_gmt)
+            FROM
+                wp_wc_orders
+            WHERE
+                type = 'shop_order'
+    """
+
+    ORDER_META_SQL = """
+            SELECT
+                o.id,
+                o.total_amount,
+                o.payment_method_title,
+                op.shipping_total_amount,
+                op.shipping_tax_amount,
+                billing.first_name,
+                billing.last_name,
+                billing.company,
+                billing.phone,
+                shipping.address_1,
+                shipping.address_2,
+                shipping.city,
+                shipping.company,
+                om.meta_key,
+                om.meta_value
+            FROM
+                wp_wc_orders o
+                LEFT JOIN wp_wc_order_operational_data op ON op.order_id = o.id
+                LEFT JOIN wp_wc_order_addresses billing
+                    ON billing.order_id = o.id AND billing.address_type = 'billing'
+                LEFT JOIN wp_wc_order_addresses shipping
+                    ON shipping.order_id = o.id AND shipping.address_type = 'shipping'
+                LEFT JOIN wp_wc_orders_meta om
+                    ON om.order_id = o.id AND om.meta_key IN ({meta_key_placeholders})
+            WHERE
+                o.id IN ({placeholders})
+    """
+
+    # Legacy meta keys of the typed columns of ORDER_META_SQL, in the same order
+    META_COLUMNS = (
+        '_order_total', '_payment_method_title', '_order_shipping', '_order_shipping_tax',
+        '_billing_first_name', '_billing_last_name', '_billing_company', '_billing_phone',
+        '_shipping_address_1', '_shipping_address_2', '_shipping_city', '_shipping_company',
+    )
+
+    # Custom fields added by the shop plugins, still kept as meta in wp_wc_orders_meta
+    META_KEYS = ('Czas dostawy', 'NIP')
+
+    def get_order_meta_params(self, order_ids):
+        """Params of ORDER_META_SQL, in the order of its placeholders."""
+        return (*self.META_KEYS, *order_ids)
+
+    @classmethod
+    def parse_order_meta(cls, rows):
+        """Convert rows of ORDER_META_SQL into legacy {order_id: {meta_key: meta_value}}.
+
+        Missing values (NULL) are left out like missing wp_postmeta rows and values are strings like meta_value,
+        so the formatters give the same results for both storages.
+        """
+        order_meta = {}
+        for order_id, *values, meta_key, meta_value in rows:
+            meta = order_meta.get(order_id)
+            if meta is None:
+                meta = order_meta[order_id] = {
+                    column: str(value) for column, value in zip(cls.META_COLUMNS, values) if value is not None
+                }
+            if meta_key is not None:
+                meta.setdefault(meta_key, meta_value)
+        return order_meta
+
+
+STORAGES = {storage.name: storage for storage in (LegacyPostStorage, HposStorage)}
+
+
+def detect_storage(cursor, storage_name=ORDER_STORAGE):
+    """Return storage of the shop, auto checks if WooCommerce uses HPOS tables as authoritative storage."""
+    if storage_name != 'auto':
+        return STORAGES[storage_name]()
+    cursor.execute(HPOS_ENABLED_QUERY)
+    rows = cursor.fetchall()
+    if rows and rows[0][0] == 'yes':
+        return HposStorage()
+    return LegacyPostStorage()
@@ -0,0 +1,72 @@
+"""Script for overlapping fetching orders from db with writing them to google spreadsheets."""
+import queue
+import threading
+
+# Number of orders fetched from db by single batch
+PIPELINE_BATCH_SIZE = 100
+
+# Number of fetched batches waiting for writing, fetching stops when the queue is full
+PIPELINE_QUEUE_SIZE = 4
+
+# Marker put into the queue after the last batch
+_DONE = object()
+
+
+def run_pipeline(fetch_batch, write_batch, order_ids, batch_size=PIPELINE_BATCH_SIZE, queue_size=PIPELINE_QUEUE_SIZE):
+    """Fetch orders in background thread and write them in the calling thread at the same time.
+
+    fetch_batch(order_ids) returns rows of given orders, write_batch(rows) writes them and returns rows
+    which were written. Batches waiting in the queue are written together, so slow writer makes fewer
+    and bigger requests. Returns all written rows, error raised by any stage is raised again here.
+    """
+    order_ids = list(order_ids)
+    batches = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def put(item):
+        # Waiting with timeout lets producer finish when writer failed and nobody reads the queue
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def produce():
+        try:
+            for start in range(0, len(order_ids), batch_size):
+                if stop.is_set():
+                    return
+                put(fetch_batch(order_ids[start:start + batch_size]))
+        except BaseException as error:
+            put(error)
+        else:
+            put(_DONE)
+
+    producer = threading.Thread(target=produce, name='order-fetcher', daemon=True)
+    producer.start()
+
+    written_rows = []
+    try:
+        done = False
+        while not done:
+            rows = []
+            item = batches.get()
+            while True:
+                if item is _DONE:
+                    done = True
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                rows.extend(item)
+                try:
+                    item = batches.get_nowait()
+                except queue.Empty:
+                    break
+            if rows:
+                written_rows.extend(write_batch(rows))
+    finally:
+        stop.set()
+        producer.join()
+
+    return written_rows
@@ -0,0 +1,74 @@
+"""Script for keeping kitchen production summary - number of every product to make per delivery date.
+
+Totals are summed by the database and written to a separate worksheet of the orders spreadsheet. Only delivery dates
+touched by new or edited orders are computed again, rows of other dates are kept as they are.
+"""
+import os
+from metrics import metrics
+
+# Production summary is refreshed at the end of every run, PRODUCTION_SUMMARY=0 turns it off
+PRODUCTION_SUMMARY_ENABLED = os.getenv('PRODUCTION_SUMMARY', '1').lower() not in ('0', 'false', 'off', '')
+
+# Title of worksheet with production summary, created when missing
+SUMMARY_TITLE = os.getenv('SUMMARY_WORKSHEET', 'Podsumowanie')
+
+SUMMARY_HEADER = ['delivery_date', 'product', 'variant', 'quantity', 'orders']
+
+
+def merge_summary(values, summary_rows, delivery_dates):
+    """Replace rows of delivery_dates in worksheet values with summary_rows, returns values sorted with header.
+
+    Dates without any product left are removed, so when the last order of a date is cancelled, refunded or failed
+    the date disappears from the summary too.
+    """
+    delivery_dates = set(delivery_dates)
+    kept_rows = [row for row in values[1:] if any(row) and row[0] not in delivery_dates]
+    new_rows = [[str(value) for value in row] for row in summary_rows]
+    return [SUMMARY_HEADER] + sorted(kept_rows + new_rows, key=lambda row: row[:3])
+
+
+class ProductionSummary:
+    """Production summary worksheet, written through the scheduler of the orders updater to share its quota."""
+
+    def __init__(self, updater, title=SUMMARY_TITLE):
+        """Init arguments passed to the class - updater of the orders worksheet and title of summary worksheet."""
+
+        self.updater = updater
+        self.title = title
+        self._worksheet = None
+
+    @property
+    def worksheet(self):
+        """Summary worksheet, added to the spreadsheet on first use when it does not exist."""
+        if self._worksheet is None:
+            spreadsheet = self.updater.sheet.spreadsheet
+            worksheets = self.updater.scheduler.call(spreadsheet.worksheets)
+            worksheet = next((worksheet for worksheet in worksheets if worksheet.title == self.title), None)
+            if worksheet is None:
+                worksheet = self.updater.scheduler.call(
+                    spreadsheet.add_worksheet, self.title, 100, len(SUMMARY_HEADER))
+            self._worksheet = metrics.instrument_sheets(worksheet)
+        return self._worksheet
+
+    def refresh(self, data_fetcher, delivery_dates):
+        """Compute summary of delivery_dates again and write the whole worksheet with one request.
+
+        Returns rows of the refreshed dates.
+        """
+        delivery_dates = sorted({delivery_date for delivery_date in delivery_dates if delivery_date})
+        if not delivery_dates:
+            return []
+
+        summary_rows = data_fetcher.get_production_summary(delivery_dates)
+        scheduler = self.updater.scheduler
+        current_values = scheduler.call(self.worksheet.get_all_values)
+        values = merge_summary(current_values, summary_rows, delivery_dates)
+
+        # Rows left below a shorter summary are cleared by the same write
+        values += [[''] * len(SUMMARY_HEADER)] * (len(current_values) - len(values))
+        if len(values) > self.worksheet.row_count:
+            scheduler.call(self.worksheet.resize, len(values))
+        scheduler.update_values(1, 1, values, title=self.worksheet.title)
+        self.updater.flush()
+        metrics.count('production_summary_dates', len(delivery_dates))
+        return summary_rows
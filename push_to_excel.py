@@ -1,21 +1,251 @@
 """Script for updating data in google spreadsheets."""
-import gspread
-from google.oauth2 import service_account
-from itertools import groupby
+import hashlib
+import os
+from bisect import bisect_right
+from datetime import datetime
+from metrics import metrics
+from sheets_scheduler import SHEETS_REQUESTS_PER_MINUTE, SheetsRequestScheduler, cell_data, column_letter, text_sort_key
+from startup import startup_step
 
 SPREADSHEET_ID = "1LQLM0RjuHQ85YNRI85TH5bXD5N9QxTrF1kUmzrBwcVc"
 RANGE_NAME = "Arkusz9"
 
+# Number of rows written by single request in update_spreadsheet
+UPDATE_CHUNK_ROWS = 500
+
+# Orders delivered more than this many days ago are moved to monthly archive worksheets, 0 turns archiving off
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '0'))
+
+# Title of archive worksheet with orders delivered in given month
+ARCHIVE_TITLE = 'Archiwum {month}'
+
+# Formats of delivery_date saved by the delivery date plugin and typed by hand in the spreadsheet
+DELIVERY_DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y', '%d-%m-%Y', '%d/%m/%Y', '%Y/%m/%d')
+
+
+def order_sort_key(row):
+    """Key used to sort orders - delivery_date (column B) and shipping address (column E).
+
+    Values are compared the same way as by sortRange of the spreadsheet, so rows inserted by binary search
+    land where the server sort puts them - text ignoring case and empty cells at the end.
+    """
+    delivery_date = row[1] if len(row) > 1 and row[1] is not None else ''
+    shipping_address = row[4] if len(row) > 4 and row[4] is not None else ''
+    return (str(delivery_date) == '', text_sort_key(delivery_date),
+            str(shipping_address) == '', text_sort_key(shipping_address))
+
+
+def sort_order_rows(data):
+    """Remove empty rows and sort the rest by delivery_date and then by shipping address."""
+    # Remove empty rows
+    data = [row for row in data if any(row)]
+
+    # Sort the data by delivery_date and then by shipping address, the same way as the server sort does
+    return sorted(data, key=order_sort_key)
+
+
+def parse_delivery_date(value):
+    """Convert delivery_date cell into date, None when it is empty or in unknown format."""
+    value = str(value or '').strip()
+    for date_format in DELIVERY_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            continue
+    return None
+
+
+def row_hash(row):
+    """Content hash of row values as shown by the spreadsheet, trailing empty cells do not change it."""
+    values = ['' if value is None else str(value) for value in row]
+    while values and not values[-1]:
+        values.pop()
+    return hashlib.blake2b('\x1f'.join(values).encode('utf-8'), digest_size=16).digest()
+
+
+def changed_cell_runs(old_row, new_row):
+    """Yield (first column, values) of every run of adjacent cells which differ, columns are 1-based."""
+    old_row = list(old_row) + [''] * (len(new_row) - len(old_row))
+    run_start = None
+    for col, (old_value, new_value) in enumerate(zip(old_row, new_row), start=1):
+        if old_value != new_value:
+            if run_start is None:
+                run_start = col
+        elif run_start is not None:
+            yield run_start, list(new_row[run_start - 1:col - 1])
+            run_start = None
+    if run_start is not None:
+        yield run_start, list(new_row[run_start - 1:])
+
+
+class SheetMirror:
+    """Local copy of worksheet values with order_id and delivery_date indexes.
+
+    Rows are kept as strings, the same way gspread returns them, and are updated from our own writes,
+    so the worksheet has to be downloaded only once per run.
+    """
+
+    def __init__(self, values):
+        self.header = list(values[0]) if values else []
+        self.rows = [list(row) for row in values[1:]]
+        self.sort_keys = [order_sort_key(row) for row in self.rows]
+        self._order_rows = None
+        self._delivery_date_rows = None
+
+    @staticmethod
+    def _sheet_value(value):
+        """Convert value to string shown by the spreadsheet."""
+        return '' if value is None else str(value)
+
+    def _invalidate_indexes(self):
+        self._order_rows = None
+        self._delivery_date_rows = None
+
+    def _build_indexes(self):
+        self._order_rows = {}
+        self._delivery_date_rows = {}
+        for row_index, row in enumerate(self.rows):
+            row_number = row_index + 2  # Header is in the first row
+            order_id = row[0].strip() if row else ''
+            if order_id.isdigit():
+                self._order_rows[int(order_id)] = row_number
+            delivery_date = row[1] if len(row) > 1 else ''
+            self._delivery_date_rows.setdefault(delivery_date, []).append(row_number)
+
+    @property
+    def order_rows(self):
+        """Dictionary order_id -> row number in the worksheet."""
+        if self._order_rows is None:
+            self._build_indexes()
+        return self._order_rows
+
+    @property
+    def delivery_date_rows(self):
+        """Dictionary delivery_date -> row numbers in the worksheet."""
+        if self._delivery_date_rows is None:
+            self._build_indexes()
+        return self._delivery_date_rows
+
+    def get_order_ids(self):
+        """Order ids from column A, in the same format as get_existing_order_ids returned them."""
+        return [str(order_id) for order_id in self.order_rows]
+
+    def has_order(self, order_id):
+        return int(order_id) in self.order_rows
+
+    def get_row_count(self):
+        """Number of rows in the worksheet including the header."""
+        return len(self.rows) + 1
+
+    def get_column_a(self):
+        """Column A values as returned by col_values(1), without trailing empty cells."""
+        column = [self.header[0] if self.header else '']
+        column.extend(row[0] if row else '' for row in self.rows)
+        while column and not column[-1]:
+            column.pop()
+        return column
+
+    def append(self, rows):
+        """Apply rows appended to the end of the worksheet."""
+        for row in rows:
+            row = [self._sheet_value(value) for value in row]
+            self.rows.append(row)
+            self.sort_keys.append(order_sort_key(row))
+        self._invalidate_indexes()
+
+    def insert(self, position, row):
+        """Apply row inserted before data row at position (0-based, header excluded)."""
+        row = [self._sheet_value(value) for value in row]
+        self.rows.insert(position, row)
+        self.sort_keys.insert(position, order_sort_key(row))
+        self._invalidate_indexes()
+
+    def update(self, position, row):
+        """Apply row rewritten in place at data row position (0-based, header excluded), order_id stays the same."""
+        row = [self._sheet_value(value) for value in row]
+        self.rows[position] = row
+        self.sort_keys[position] = order_sort_key(row)
+        # Row numbers of orders do not change, only delivery_date index has to be built again
+        self._delivery_date_rows = None
+
+    def delete(self, positions):
+        """Apply data rows deleted at positions (0-based, header excluded)."""
+        positions = set(positions)
+        self.rows = [row for position, row in enumerate(self.rows) if position not in positions]
+        self.sort_keys = [key for position, key in enumerate(self.sort_keys) if position not in positions]
+        self._invalidate_indexes()
+
+    def replace(self, rows):
+        """Apply rows written over the worksheet starting from the second row."""
+        rows = [[self._sheet_value(value) for value in row] for row in rows]
+        self.rows = rows + self.rows[len(rows):]
+        self.sort_keys = [order_sort_key(row) for row in self.rows]
+        self._invalidate_indexes()
+
+    def get_values(self):
+        """All values of the worksheet, header included."""
+        return [list(self.header)] + [list(row) for row in self.rows]
+
 
 class GoogleSheetsUpdater:
-    def __init__(self, spreadsheet_id, range_name):
+    def __init__(self, spreadsheet_id, range_name, worksheet=None, requests_per_minute=SHEETS_REQUESTS_PER_MINUTE):
+        """worksheet replaces the gspread worksheet, e.g. FakeWorksheet from fake_sheets in tests and benchmarks."""
         self.spreadsheet_id = spreadsheet_id
         self.range_name = range_name
-        self.creds = self.get_credentials()
-        self.client = gspread.authorize(self.creds)
-        self.sheet = self.client.open_by_key(spreadsheet_id).worksheet(range_name)
+        self.requests_per_minute = requests_per_minute
+        self.creds = None
+        self.client = None
+        self._sheet = metrics.instrument_sheets(worksheet)
+        self._scheduler = None
+        self.mirror = None
+
+    @property
+    def sheet(self):
+        """Worksheet, the client is authorized and the worksheet opened on first use."""
+        if self._sheet is None:
+            with startup_step('import gspread'):
+                import gspread
+            with startup_step('authorize sheets client'):
+                self.creds = self.get_credentials()
+                self.client = gspread.authorize(self.creds)
+            with startup_step('open worksheet'):
+                worksheet = self.client.open_by_key(self.spreadsheet_id).worksheet(self.range_name)
+            # Every gspread call of the updater goes through the worksheet, so it is recorded in run metrics
+            self._sheet = metrics.instrument_sheets(worksheet)
+        return self._sheet
+
+    @property
+    def scheduler(self):
+        """Scheduler every request of the updater goes through, so the run stays within Sheets API quota."""
+        if self._scheduler is None:
+            self._scheduler = SheetsRequestScheduler(self.sheet, self.requests_per_minute)
+        return self._scheduler
+
+    def flush(self):
+        """Send queued writes, the mirror is dropped when they fail, so it never shows rows missing in the sheet."""
+        self._send_queued(self.scheduler.flush)
+
+    def _flush_if_ready(self):
+        """Send queued writes when quota allows it, failed writes are dropped like in flush."""
+        self._send_queued(self.scheduler.flush_if_ready)
+
+    def _reload_sheet(self):
+        """Open the worksheet again after rows were deleted, so its grid size is read from the spreadsheet."""
+        worksheet = self.scheduler.call(self.sheet.spreadsheet.worksheet, self.sheet.title)
+        self._sheet = self.scheduler.worksheet = metrics.instrument_sheets(worksheet)
+
+    def _send_queued(self, send):
+        # Writes left in the queue would be sent again by the next request and add the same orders twice
+        try:
+            send()
+        except Exception:
+            self.mirror = None
+            self.scheduler.pending = []
+            raise
 
     def get_credentials(self):
+        from google.oauth2 import service_account
+
         # Path to your service account JSON key file
         key_file_path = 'credentials_test.json'
 
@@ -26,69 +256,304 @@ class GoogleSheetsUpdater:
         )
         return credentials
 
+    def refresh_mirror(self):
+        """Download the worksheet into local mirror."""
+        self.flush()
+        self.mirror = SheetMirror(self.scheduler.call(self.sheet.get_all_values))
+        return self.mirror
+
+    def get_mirror(self):
+        """Return local mirror of the worksheet, downloading it on first use."""
+        if self.mirror is None:
+            return self.refresh_mirror()
+        return self.mirror
+
+    def start_run(self):
+        """Check at the beginning of a run if the mirror kept from previous run is still valid.
+
+        Only column A is downloaded to compare row count and order ids, the whole worksheet is downloaded
+        again only when somebody edited the spreadsheet by hand.
+        """
+        if self.mirror is None or self.get_column_values(1) != self.mirror.get_column_a():
+            self.refresh_mirror()
+
+    def get_column_values(self, col):
+        """Download values of single column, after queued writes are sent."""
+        self.flush()
+        return self.scheduler.call(self.sheet.col_values, col)
+
     def get_existing_order_ids(self):
         """Fetch existing order_id from GoogleSpreadsheet."""
-        existing_orders = self.sheet.col_values(1)[1:]  # Assuming the order IDs are in column A, starting from row 2
-        return [str(order).strip() for order in existing_orders if order.isdigit()]
+        return self.get_mirror().get_order_ids()
 
     def sort_spreadsheet(self):
         """Sort orders in GoogleSpreadsheet according to delivery_date and remove rows with empty date strings."""
-        data = self.sheet.get_all_values()
-
-        # Save the header row
-        header_row = data[0]
+        data = self.get_mirror().get_values()
 
-        # Remove the header row from data
-        data = data[1:]
+        # Sort rows without the header row
+        sorted_data = sort_order_rows(data[1:])
 
-        # Remove empty rows
-        data = [row for row in data if any(row)]
+        # Update the Google Spreadsheet with the sorted data, starting from the second row
+        if sorted_data:
+            self.update_spreadsheet(sorted_data)
+            self.mirror.replace(sorted_data)
 
-        # Sort the data by delivery_date
-        sorted_data = sorted(data, key=lambda x: x[1])  # Assuming delivery_date is at index 1
+    def sort_spreadsheet_server_side(self):
+        """Sort orders in GoogleSpreadsheet with sortRange request, without downloading the worksheet.
 
-        # Group the sorted data by delivery_date
-        grouped_data = []
-        for date, group in groupby(sorted_data, key=lambda x: x[1]):
-            group_list = list(group)
-            group_list.sort(key=lambda x: x[4])  # Assuming column E is the shipping address
-            grouped_data.extend(group_list)
+        Rows are sorted by delivery_date and shipping address, order_id keeps rows without those values
+        above completely empty rows, which Sheets puts at the end. The sort is sent in one batchUpdate together
+        with queued writes. Empty rows are then removed with deleteDimension request, only when rows below
+        the orders of the mirror are still empty after the sort, so rows added by hand are never removed.
+        """
+        self.scheduler.batch_update([
+            {
+                'sortRange': {
+                    # Range without end index covers every row below the header
+                    'range': {'sheetId': self.sheet.id, 'startRowIndex': 1},
+                    'sortSpecs': [
+                        {'dimensionIndex': 1, 'sortOrder': 'ASCENDING'},  # delivery_date
+                        {'dimensionIndex': 4, 'sortOrder': 'ASCENDING'},  # shipping address
+                        {'dimensionIndex': 0, 'sortOrder': 'ASCENDING'},  # order_id
+                    ],
+                }
+            }
+        ])
+        self.flush()
 
-        # Insert the header row back into the grouped data
-        grouped_data.insert(0, header_row)
+        # Number of rows with data is known only from the mirror, without it empty rows are kept
+        if self.mirror is not None:
+            num_rows = 1 + sum(1 for row in self.mirror.rows if any(row))
+            if num_rows < self.sheet.row_count:
+                # Rows below are checked after the sort, rows added since the mirror was read would be there
+                trailing_rows = self.scheduler.call(
+                    self.sheet.batch_get, [f'A{num_rows + 1}:{column_letter(self.sheet.col_count)}'])[0]
+                if not any(any(row) for row in trailing_rows):
+                    self.scheduler.batch_update([{
+                        'deleteDimension': {
+                            'range': {'sheetId': self.sheet.id, 'dimension': 'ROWS', 'startIndex': num_rows}
+                        }
+                    }])
+                    self.flush()
+                    self._reload_sheet()
 
-        # Update the Google Spreadsheet with the sorted data, starting from the second row
-        self.update_spreadsheet(grouped_data[1:])  # Exclude the header row
+        # Sheets compares text differently than Python, so row numbers in the mirror are not valid anymore
+        self.mirror = None
 
     def update_spreadsheet(self, sorted_data):
-        """Update Google Spreadsheet with sorted data."""
+        """Update Google Spreadsheet with sorted data.
+
+        Values are queued in chunks of UPDATE_CHUNK_ROWS rows and sent by the scheduler in as few batchUpdate
+        requests as the request size limit allows.
+        """
         num_rows = len(sorted_data)
         num_cols = len(sorted_data[0])
 
         # Get current dimensions of the sheet
         current_rows, current_cols = self.sheet.row_count, self.sheet.col_count
 
-        # Resize the sheet only if the new size is larger
-        if num_rows > current_rows or num_cols > current_cols:
-            self.sheet.resize(max(num_rows, current_rows), max(num_cols, current_cols))
+        # Resize the sheet only if the new size is larger, data starts from the second row
+        if num_rows + 1 > current_rows or num_cols > current_cols:
+            self.scheduler.call(self.sheet.resize, max(num_rows + 1, current_rows), max(num_cols, current_cols))
 
         # Update the sheet with sorted data, starting from the second row
-        cell_list = self.sheet.range(2, 1, num_rows + 1, num_cols)  # Adjusted to start from the second row
-        for row_index, row_data in enumerate(sorted_data):
-            for col_index, value in enumerate(row_data):
-                cell_list[row_index * num_cols + col_index].value = value  # Adjusted index calculation
-        self.sheet.update_cells(cell_list)
+        for start in range(0, num_rows, UPDATE_CHUNK_ROWS):
+            self.scheduler.update_values(start + 2, 1, sorted_data[start:start + UPDATE_CHUNK_ROWS])
+        self.flush()
 
     def update_data(self, new_data):
         """Update orders in GoogleSpreadsheet."""
-        # Check if the true stands that the second column of new_data is not empty
-        if new_data[1] is not None:
-            num_rows = len(self.sheet.get_all_values())
-            new_range = f'A{num_rows + 1}'
-            self.sheet.append_rows([new_data], value_input_option='RAW', table_range=new_range)
+        self.append_orders([new_data])
+
+    def append_orders(self, rows):
+        """Append orders to GoogleSpreadsheet, returns rows which were appended.
+
+        Rows are sent right away when quota allows it, otherwise they are merged with the next writes,
+        flush sends them at the end of a run.
+        """
+        # Check if the true stands that the second column of row is not empty
+        rows = [row for row in rows if row[1] is not None]
+        if not rows:
+            return rows
+
+        # Sheets API appends after the last row with data, no need to count rows
+        self.scheduler.append_rows(rows)
+        if self.mirror is not None:
+            self.mirror.append(rows)
+        self._flush_if_ready()
+        return rows
+
+    def insert_orders_sorted(self, rows):
+        """Insert orders at their sorted position, without re-sorting the whole GoogleSpreadsheet.
+
+        Spreadsheet has to be already sorted by sort_spreadsheet. Position of every new row is found by binary
+        search on (delivery_date, shipping_address) keys of the mirror, so only new rows are written.
+        Requests are sent like in append_orders. Returns inserted rows.
+        """
+        # Check if the true stands that the second column of row is not empty
+        rows = [row for row in rows if row[1] is not None]
+        if not rows:
+            return rows
+
+        mirror = self.get_mirror()
+
+        # New rows are inserted in ascending order, so every insert lands below the previous ones
+        # and the positions found by binary search are already the final row numbers
+        for row in sorted(rows, key=order_sort_key):
+            position = bisect_right(mirror.sort_keys, order_sort_key(row))
+            mirror.insert(position, row)
+            self.scheduler.batch_update(self._insert_row_requests(position + 1, row))  # Header is in the first row
+        self._flush_if_ready()
+        return rows
+
+    def update_orders_in_place(self, rows, resort=True):
+        """Rewrite orders already in GoogleSpreadsheet in place, returns rows which changed.
+
+        Content hash of every row is compared with the mirror and only cells which differ are written.
+        When delivery_date or shipping address changed, the spreadsheet is sorted again if resort is set.
+        """
+        mirror = self.get_mirror()
+        changed_rows = []
+        sort_keys_changed = False
+        for row in rows:
+            row_number = mirror.order_rows.get(int(row[0]))
+            # Orders not in the spreadsheet yet are added by append_orders, orders without delivery_date are kept
+            if row_number is None or row[1] is None:
+                continue
+            position = row_number - 2  # Header is in the first row
+            new_values = [mirror._sheet_value(value) for value in row]
+            if row_hash(new_values) == row_hash(mirror.rows[position]):
+                continue
+
+            for first_col, values in changed_cell_runs(mirror.rows[position], new_values):
+                self.scheduler.update_values(row_number, first_col, [values])
+            sort_keys_changed = sort_keys_changed or order_sort_key(new_values) != mirror.sort_keys[position]
+            mirror.update(position, new_values)
+            changed_rows.append(row)
+
+        if sort_keys_changed and resort:
+            self.sort_spreadsheet_server_side()
+        else:
+            self._flush_if_ready()
+        return changed_rows
+
+    def get_archived_order_ids(self):
+        """Read ids of orders in archive worksheets, one column A request per archive worksheet."""
+        archive_prefix = ARCHIVE_TITLE.format(month='')
+        worksheets = self.scheduler.call(self.sheet.spreadsheet.worksheets)
+        return [
+            int(order_id)
+            for worksheet in worksheets if worksheet.title.startswith(archive_prefix)
+            for order_id in self.scheduler.call(worksheet.col_values, 1) if order_id.isdigit()
+        ]
+
+    def archive_orders(self, cutoff_date):
+        """Move orders delivered before cutoff_date to monthly archive worksheets, returns rows which were moved.
+
+        Rows are appended to 'Archiwum YYYY-MM' worksheets, created when missing, and deleted from this worksheet
+        in the same batchUpdate (unless it exceeds the request size limit), so an order is never in both or in
+        neither. Rows with delivery_date in unknown format are kept.
+        """
+        # Rows are deleted at their positions in the mirror, so it is checked against the worksheet first
+        self.start_run()
+        mirror = self.mirror
+        archived = {}
+        for position, row in enumerate(mirror.rows):
+            delivery_date = parse_delivery_date(row[1] if len(row) > 1 else '')
+            if delivery_date is not None and delivery_date < cutoff_date:
+                archived[position] = delivery_date.strftime('%Y-%m')
+        if not archived:
+            return []
+
+        worksheets = self.scheduler.call(self.sheet.spreadsheet.worksheets)
+        sheet_ids = {worksheet.title: worksheet.id for worksheet in worksheets}
+        next_sheet_id = max(sheet_ids.values()) + 1
+        for month in sorted(set(archived.values())):
+            title = ARCHIVE_TITLE.format(month=month)
+            rows = [mirror.rows[position] for position, row_month in archived.items() if row_month == month]
+            if title not in sheet_ids:
+                sheet_ids[title] = next_sheet_id
+                next_sheet_id += 1
+                self.scheduler.batch_update([{
+                    'addSheet': {
+                        'properties': {
+                            'sheetId': sheet_ids[title],
+                            'title': title,
+                            'gridProperties': {'rowCount': 1, 'columnCount': len(mirror.header) or 1},
+                        }
+                    }
+                }])
+                rows = [mirror.header] + rows
+            self.scheduler.append_rows(rows, sheet_id=sheet_ids[title])
+
+        # Runs of adjacent rows are deleted from the bottom, so row indexes above them stay valid
+        positions = sorted(archived)
+        runs = []
+        for position in positions:
+            if runs and runs[-1][-1] == position - 1:
+                runs[-1].append(position)
+            else:
+                runs.append([position])
+        self.scheduler.batch_update([
+            {
+                'deleteDimension': {
+                    'range': {
+                        'sheetId': self.sheet.id,
+                        'dimension': 'ROWS',
+                        'startIndex': run[0] + 1,  # Header is in the first row
+                        'endIndex': run[-1] + 2,
+                    }
+                }
+            }
+            for run in reversed(runs)
+        ])
+        archived_rows = [mirror.rows[position] for position in positions]
+        self.flush()
+        self._reload_sheet()
+        mirror.delete(positions)
+        return archived_rows
+
+    def _insert_row_requests(self, row_index, row):
+        """Requests inserting empty row at row_index (0-based) and filling it with row values."""
+        return [
+            {
+                'insertDimension': {
+                    'range': {
+                        'sheetId': self.sheet.id,
+                        'dimension': 'ROWS',
+                        'startIndex': row_index,
+                        'endIndex': row_index + 1,
+                    },
+                    # Row right below the header takes formatting from the data row after it
+                    'inheritFromBefore': row_index > 1,
+                }
+            },
+            {
+                'updateCells': {
+                    'rows': [{'values': [cell_data(value) for value in row]}],
+                    'fields': 'userEnteredValue',
+                    'start': {'sheetId': self.sheet.id, 'rowIndex': row_index, 'columnIndex': 0},
+                }
+            },
+        ]
+
+
+_updater = None
+
+
+def get_updater():
+    """Return updater of the orders worksheet, created on first use and kept for warm invocations."""
+    global _updater
+    if _updater is None:
+        _updater = GoogleSheetsUpdater(SPREADSHEET_ID, RANGE_NAME)
+    return _updater
 
 
-updater = GoogleSheetsUpdater(SPREADSHEET_ID, RANGE_NAME)
+def __getattr__(name):
+    # Keep `from push_to_excel import updater` working without connecting to Google on import
+    if name == 'updater':
+        return get_updater()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 # Check if order with specified order_id had been already added to spreadsheet.                                    DONE
 # Check the latest order_id in spreadsheet and add every other which has not been added.                           DONE
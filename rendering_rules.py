@@ -0,0 +1,77 @@
+"""Script for rendering order attributes and pickup points according to the rule table in rendering_rules.json.
+
+New products and pickup points are added to the rule table, the code does not change. Product rules are listed
+in priority order - item name matching patterns of several rules is rendered by the first of them.
+"""
+import json
+import os
+import re
+from functools import lru_cache
+
+# Rule table with labels of pickup points and attributes shown for every kind of product
+RENDERING_RULES_PATH = os.getenv(
+    'RENDERING_RULES_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rendering_rules.json'))
+
+# Columns of order attribute rows between order_item_id and item_name, in the order of the attributes query
+ATTRIBUTE_COLUMNS = (
+    'topper', 'swieczka_nr_1', 'swieczka_nr_2', 'warstwa_1', 'warstwa_2', 'warstwa_3', 'warstwa_4', 'dekoracja', 'smak',
+)
+
+# Number of distinct item names whose attribute set is remembered
+ITEM_CACHE_SIZE = 1024
+
+
+class RenderingRules:
+    """Rule table compiled into pickup point lookup and a single matcher of product names."""
+
+    def __init__(self, rules):
+        """Init arguments passed to the class - rule table as loaded from rendering_rules.json."""
+
+        self.pickup_points = dict(rules['pickup_points'])
+        labels = rules['attribute_labels']
+        # (column index, label) of attributes shown for every product rule
+        self.rule_attributes = [
+            tuple((ATTRIBUTE_COLUMNS.index(column), labels[column]) for column in rule['attributes'])
+            for rule in rules['product_rules']
+        ]
+        # Lookahead matches at every position of the name, so a rule of higher priority is found
+        # even when a pattern of lower priority starts earlier in the name
+        self._matcher = re.compile('(?=' + '|'.join(
+            f'(?P<rule_{rule_index}>' + '|'.join(map(re.escape, rule['patterns'])) + ')'
+            for rule_index, rule in enumerate(rules['product_rules'])
+        ) + ')')
+        self.get_item_template = lru_cache(maxsize=ITEM_CACHE_SIZE)(self._get_item_template)
+
+    def get_item_attributes(self, item_name):
+        """(column index, label) of attributes shown for item_name, empty for products without rule."""
+        rule_indexes = [int(match.lastgroup[len('rule_'):]) for match in self._matcher.finditer(item_name)]
+        if not rule_indexes:
+            return ()
+        return self.rule_attributes[min(rule_indexes)]
+
+    def _get_item_template(self, item_name):
+        """First line of rendered item and (column index, line prefix) of its attributes."""
+        return f'{item_name}:\n', tuple(
+            (column, f'  {label}: ') for column, label in self.get_item_attributes(item_name)
+        )
+
+    def render_item(self, item_name, values):
+        """Render item name with its attributes, values are attribute columns in ATTRIBUTE_COLUMNS order."""
+        first_line, attributes = self.get_item_template(item_name)
+        return (first_line + ''.join([
+            f'{prefix}{values[column]}\n' for column, prefix in attributes if values[column]
+        ])).strip()
+
+    def get_pickup_label(self, shipping_name):
+        """Label of pickup point shown in the spreadsheet, None when shipping_name is not a pickup point."""
+        return self.pickup_points.get(shipping_name)
+
+
+def load_rules(path=RENDERING_RULES_PATH):
+    """Load and compile the rule table."""
+    with open(path, encoding='utf-8') as rules_file:
+        return RenderingRules(json.load(rules_file))
+
+
+# Rule table is loaded once per function instance
+rendering_rules = load_rules()
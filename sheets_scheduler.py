@@ -0,0 +1,219 @@
+"""Script for sending google spreadsheets requests within Sheets API quota."""
+import json
+import os
+import random
+import time
+from metrics import metrics
+
+# Sheets API allows 60 requests per minute per user
+SHEETS_REQUESTS_PER_MINUTE = int(os.getenv('SHEETS_REQUESTS_PER_MINUTE', '60'))
+
+# Number of requests which can be sent at once after a quiet period
+SHEETS_BURST = 5
+
+# Google recommends keeping request payload below 2 MB
+MAX_REQUEST_BYTES = 2_000_000
+
+# Retrying stops after this many failed attempts, the error is raised then
+MAX_RETRIES = 6
+
+# Backoff starts at BACKOFF_BASE seconds and doubles after every failed attempt, up to BACKOFF_MAX
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 64.0
+
+# Spreadsheet sorts text in pl_PL locale: Polish letters with diacritics come right after their base letter
+_POLISH_COLLATION = str.maketrans({
+    'ą': 'a\U0010ffff', 'ć': 'c\U0010ffff', 'ę': 'e\U0010ffff', 'ł': 'l\U0010ffff', 'ń': 'n\U0010ffff',
+    'ó': 'o\U0010ffff', 'ś': 's\U0010ffff', 'ź': 'z\U0010fffe', 'ż': 'z\U0010ffff',
+})
+
+# Quota exceeded and server errors, which Google recommends to retry with exponential backoff
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+# Server error does not tell if these requests were applied, so batches with them are retried only after 429
+NON_IDEMPOTENT_REQUESTS = frozenset({'appendCells', 'insertDimension', 'deleteDimension', 'addSheet'})
+
+
+def cell_data(value):
+    """Convert value to CellData the same way as RAW value input option does."""
+    if value is None:
+        return {}
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {'userEnteredValue': {'numberValue': value}}
+    return {'userEnteredValue': {'stringValue': str(value)}}
+
+
+def text_sort_key(value):
+    """Key ordering text like sortRange does - ignoring case, with Polish letters in alphabet order."""
+    return str(value).casefold().translate(_POLISH_COLLATION)
+
+
+def column_letter(col):
+    """Convert 1-based column number to A1 notation letters."""
+    letters = ''
+    while col:
+        col, remainder = divmod(col - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def get_status_code(error):
+    """HTTP status of gspread APIError, None for errors without response."""
+    code = getattr(error, 'code', None)
+    if isinstance(code, int):
+        return code
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None)
+
+
+class TokenBucket:
+    def __init__(self, requests_per_minute, burst=SHEETS_BURST, clock=time.monotonic, sleep=time.sleep):
+        """Init arguments passed to the class - quota per minute, bucket size and clock used for waiting."""
+
+        # Burst and tokens refilled during a minute together never exceed the quota of any minute
+        self.rate = max(requests_per_minute - burst, 1) / 60
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = burst
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        """Take a token if one is available, without waiting."""
+        self._refill()
+        # Tolerance for float rounding, otherwise waiting for the last fraction of a token could never end
+        if self.tokens >= 1 - 1e-9:
+            self.tokens = max(self.tokens - 1, 0.0)
+            return True
+        return False
+
+    def acquire(self):
+        """Take a token, waiting for it if the bucket is empty."""
+        while not self.try_acquire():
+            self.sleep((1 - self.tokens) / self.rate)
+
+
+class SheetsRequestScheduler:
+    """Sends worksheet requests at the pace allowed by Sheets API quota.
+
+    Appends and batchUpdate requests are queued and sent together as one batchUpdate, value updates as one
+    values batchUpdate, so when the quota is used up, writes waiting for a token are merged instead of each
+    waiting for its own. Requests failed with 429 or 5xx are retried with jittered exponential backoff,
+    batches which would be applied twice by a retry only after 429.
+    """
+
+    def __init__(self, worksheet, requests_per_minute=SHEETS_REQUESTS_PER_MINUTE, max_request_bytes=MAX_REQUEST_BYTES,
+                 max_retries=MAX_RETRIES, clock=time.monotonic, sleep=time.sleep, rng=None):
+        self.worksheet = worksheet
+        # None turns the rate limit off, for example for in-memory spreadsheet in benchmarks
+        self.bucket = TokenBucket(requests_per_minute, clock=clock, sleep=sleep) if requests_per_minute else None
+        self.max_request_bytes = max_request_bytes
+        self.max_retries = max_retries
+        self.sleep = sleep
+        self.rng = rng or random.Random()
+        # Queued (kind, request, estimated size in bytes), kind is 'requests' for batchUpdate requests
+        # and 'values' for values batchUpdate data, consecutive writes of the same kind are sent together
+        self.pending = []
+
+    def call(self, function, *args, **kwargs):
+        """Call worksheet method after queued writes are sent, so it sees the worksheet up to date."""
+        self.flush()
+        return self._execute(function, *args, **kwargs)
+
+    def append_rows(self, rows, sheet_id=None):
+        """Queue rows appended after the last row with data, like append_rows of gspread.
+
+        sheet_id appends to other worksheet of the same spreadsheet, by default rows go to the scheduled worksheet.
+        Rows are split into several appendCells requests, so none of them is bigger than max_request_bytes.
+        """
+        sheet_id = self.worksheet.id if sheet_id is None else sheet_id
+        chunk, chunk_bytes = [], 0
+        for row in rows:
+            row_data = {'values': [cell_data(value) for value in row]}
+            row_bytes = len(json.dumps(row_data, default=str)) + 2
+            if chunk and chunk_bytes + row_bytes > self.max_request_bytes:
+                self._queue_append(sheet_id, chunk)
+                chunk, chunk_bytes = [], 0
+            chunk.append(row_data)
+            chunk_bytes += row_bytes
+        if chunk:
+            self._queue_append(sheet_id, chunk)
+
+    def _queue_append(self, sheet_id, rows):
+        self._queue('requests', {'appendCells': {'sheetId': sheet_id, 'rows': rows, 'fields': 'userEnteredValue'}})
+
+    def update_values(self, row, col, values, title=None):
+        """Queue values written with RAW input option to the block starting at row and col (1-based).
+
+        title writes to other worksheet of the same spreadsheet, by default values go to the scheduled worksheet.
+        """
+        title = (self.worksheet.title if title is None else title).replace("'", "''")
+        self._queue('values', {'range': f"'{title}'!{column_letter(col)}{row}", 'values': values})
+
+    def batch_update(self, requests):
+        """Queue batchUpdate requests."""
+        for request in requests:
+            self._queue('requests', request)
+
+    def _queue(self, kind, request):
+        self.pending.append((kind, request, len(json.dumps(request, default=str))))
+
+    def flush_if_ready(self):
+        """Send queued requests only when it does not have to wait for quota."""
+        self._send(wait=False)
+
+    def flush(self):
+        """Send every queued request, waiting for quota when needed."""
+        self._send(wait=True)
+
+    def _send(self, wait):
+        while self.pending:
+            if not wait and self.bucket is not None and not self.bucket.try_acquire():
+                return
+            # Token for the first attempt is already taken when not waiting
+            count = self._next_batch_size()
+            kind = self.pending[0][0]
+            requests = [request for _, request, _ in self.pending[:count]]
+            if kind == 'values':
+                self._execute(self.worksheet.spreadsheet.values_batch_update,
+                              {'valueInputOption': 'RAW', 'data': requests}, acquired=not wait)
+            else:
+                idempotent = not any(key in NON_IDEMPOTENT_REQUESTS for request in requests for key in request)
+                self._execute(self.worksheet.spreadsheet.batch_update, {'requests': requests}, acquired=not wait,
+                              idempotent=idempotent)
+            del self.pending[:count]
+            if count > 1:
+                metrics.count('sheets_coalesced_requests', count - 1)
+
+    def _next_batch_size(self):
+        """Number of queued requests of the same kind fitting in a single request, at least one."""
+        total_bytes = 0
+        for count, (kind, _, request_bytes) in enumerate(self.pending):
+            total_bytes += request_bytes
+            if count and (kind != self.pending[0][0] or total_bytes > self.max_request_bytes):
+                return count
+        return len(self.pending)
+
+    def _execute(self, function, *args, acquired=False, idempotent=True, **kwargs):
+        """Call function within the quota, retrying 429 and 5xx errors with jittered exponential backoff.
+
+        Function which is not idempotent is retried only after 429, as the request was not applied then.
+        """
+        retryable_status_codes = RETRYABLE_STATUS_CODES if idempotent else {429}
+        for attempt in range(self.max_retries + 1):
+            if self.bucket is not None and not (acquired and attempt == 0):
+                self.bucket.acquire()
+            try:
+                return function(*args, **kwargs)
+            except Exception as error:
+                if get_status_code(error) not in retryable_status_codes or attempt == self.max_retries:
+                    raise
+                metrics.count('sheets_retries')
+                # Half of the delay is fixed and half random, so parallel clients do not retry at the same time
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+                self.sleep(delay / 2 + self.rng.uniform(0, delay / 2))
@@ -0,0 +1,35 @@
+"""Script for measuring cold start of the Cloud Function."""
+import time
+from contextlib import contextmanager
+
+# Time when the function started importing its modules, main imports this module first
+IMPORT_STARTED = time.perf_counter()
+
+# Step name -> seconds spent in it
+startup_timings = {}
+_reported = False
+
+
+@contextmanager
+def startup_step(name):
+    """Measure time spent in a startup step, for example authorizing Sheets client."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = startup_timings.get(name, 0.0) + time.perf_counter() - started
+
+
+def mark_startup(name):
+    """Record time elapsed since the function started importing its modules."""
+    startup_timings[name] = time.perf_counter() - IMPORT_STARTED
+
+
+def report_startup():
+    """Print startup timings once per function instance, warm invocations have nothing to report."""
+    global _reported
+    if _reported:
+        return
+    _reported = True
+    report = ', '.join(f'{name}: {seconds * 1000:.0f} ms' for name, seconds in startup_timings.items())
+    print(f'Cold start timings - {report}')
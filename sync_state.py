@@ -0,0 +1,123 @@
+"""Script for keeping synchronisation checkpoint between runs."""
+import json
+import os
+import tempfile
+from bisect import bisect_right
+
+# Cloud Function can write only to /tmp, state survives there between warm invocations
+SYNC_STATE_PATH = os.getenv('SYNC_STATE_PATH', '/tmp/order_sync_state.json')
+
+# How many order ids below the watermark are checked again for late _new_order_email_sent flips
+LATE_ORDER_WINDOW = int(os.getenv('SYNC_LATE_ORDER_WINDOW', '200'))
+
+
+class SyncState:
+    def __init__(self, path=SYNC_STATE_PATH, late_order_window=LATE_ORDER_WINDOW):
+        """Init arguments passed to the class - path to checkpoint file and size of late orders window."""
+
+        self.path = path
+        self.late_order_window = late_order_window
+        self.last_order_id = None
+        self.synced_order_ids = set()
+        # Last order_id of the last chunk written by unfinished backfill
+        self.backfill_order_id = None
+        # post_modified_gmt of the most recently modified order checked for changes
+        self.modified_since = None
+        # Sorted [first, last] ranges of order ids moved to archive worksheets, consecutive ids share one range
+        self.archived_order_ranges = []
+        self.load()
+
+    def load(self):
+        """Load checkpoint from file, missing or broken file means that nothing was synced yet."""
+        try:
+            with open(self.path, encoding='utf-8') as state_file:
+                state = json.load(state_file)
+        except (OSError, ValueError):
+            return
+
+        self.last_order_id = state.get('last_order_id')
+        self.synced_order_ids = set(state.get('synced_order_ids', []))
+        self.backfill_order_id = state.get('backfill_order_id')
+        self.modified_since = state.get('modified_since')
+        self.archived_order_ranges = state.get('archived_order_ranges', [])
+
+    def save(self):
+        """Save checkpoint atomically, so interrupted run never leaves half written file."""
+        window_start = self.get_window_start()
+        if window_start is not None:
+            # Orders below the window are never queried again in incremental mode
+            self.synced_order_ids = {order_id for order_id in self.synced_order_ids if order_id >= window_start}
+
+        state = {
+            'last_order_id': self.last_order_id,
+            'synced_order_ids': sorted(self.synced_order_ids),
+            'backfill_order_id': self.backfill_order_id,
+            'modified_since': self.modified_since,
+            'archived_order_ranges': self.archived_order_ranges,
+        }
+        directory = os.path.dirname(os.path.abspath(self.path))
+        file_descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix='.sync_state_')
+        try:
+            with os.fdopen(file_descriptor, 'w', encoding='utf-8') as temp_file:
+                json.dump(state, temp_file)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def is_empty(self):
+        """Check if any order was synced yet - without watermark only full rescan is possible."""
+        return self.last_order_id is None
+
+    def get_window_start(self, first_order_id=None):
+        """Return lowest order_id checked in incremental mode."""
+        if self.last_order_id is None:
+            return first_order_id
+        window_start = self.last_order_id - self.late_order_window
+        if first_order_id is not None:
+            return max(window_start, first_order_id)
+        return window_start
+
+    def record_synced(self, order_ids, move_watermark=True):
+        """Mark orders as synced and move the watermark.
+
+        Orders synced by events are recorded without move_watermark, as orders below them may be still missing.
+        """
+        order_ids = set(map(int, order_ids))
+        if not order_ids:
+            return
+        self.synced_order_ids |= order_ids
+        if move_watermark:
+            self.last_order_id = max(max(order_ids), self.last_order_id or 0)
+
+    def reset(self, order_ids):
+        """Replace checkpoint with orders found in the spreadsheet during full rescan."""
+        self.last_order_id = None
+        self.synced_order_ids = set()
+        self.record_synced(order_ids)
+
+    def record_archived(self, order_ids):
+        """Add order ids to the archived orders index, merging them into ranges."""
+        order_ids = set(map(int, order_ids))
+        if not order_ids:
+            return
+        ranges = []
+        for first, last in sorted(self.archived_order_ranges + [[order_id, order_id] for order_id in order_ids]):
+            if ranges and first <= ranges[-1][1] + 1:
+                ranges[-1][1] = max(ranges[-1][1], last)
+            else:
+                ranges.append([first, last])
+        self.archived_order_ranges = ranges
+        # Archived orders are excluded by the index, they do not have to be kept one by one
+        self.synced_order_ids -= order_ids
+
+    def is_archived(self, order_id):
+        """Check if order was moved to an archive worksheet."""
+        position = bisect_right(self.archived_order_ranges, [int(order_id), float('inf')]) - 1
+        return position >= 0 and self.archived_order_ranges[position][1] >= int(order_id)
+
+    def remove_archived(self, order_ids):
+        """Return order ids which are not in archive worksheets, keeping their order."""
+        return [order_id for order_id in order_ids if not self.is_archived(order_id)]
@@ -0,0 +1,371 @@
+"""Script for generating synthetic WooCommerce orders in local MySQL database for benchmarks."""
+import random
+from datetime import datetime, timedelta
+
+SHIPPING_METHODS = (
+    'Dostawa na terenie Wrocławia',
+    'Odbiór osobisty - Bema (Bezpłatnie)',
+    'Odbiór osobisty - Olimpia Port (Bezpłatnie)',
+    'Odbiór osobisty - Wroclavia (Bezpłatnie)',
+    'Odbiór osobisty - Hubska (Bezpłatnie)',
+    'Odbiór osobisty - Oławska (Bezpłatnie)',
+)
+
+# Product name -> attribute meta keys saved with line item
+PRODUCTS = {
+    'Tort lodowy DIY': (
+        'pa_topper', 'pa_swieczka-nr-1', 'pa_swieczka-nr-2', 'warstwa-1-najnizsza-warstwa', 'warstwa-2-srodkowa',
+        'warstwa-3-srodkowa', 'warstwa-4-zewnetrzna-warstwa', 'dekoracja',
+    ),
+    'Tort Iglo malinowe': ('pa_topper', 'pa_swieczka-nr-1', 'pa_swieczka-nr-2'),
+    'Tort miesiąca': ('pa_topper', 'pa_swieczka-nr-1', 'pa_swieczka-nr-2'),
+    'Tort pistacLOVE': ('pa_topper', 'pa_swieczka-nr-1', 'pa_swieczka-nr-2'),
+    'Tort Jagodziany': ('pa_topper', 'pa_swieczka-nr-1', 'pa_swieczka-nr-2'),
+    'Tort Chmurka': ('pa_topper', 'pa_swieczka-nr-1', 'pa_swieczka-nr-2'),
+    'Tort Słodziak': ('pa_topper', 'pa_swieczka-nr-1', 'pa_swieczka-nr-2'),
+    'Tort Dzieciaki rządzą': ('pa_topper', 'pa_swieczka-nr-1', 'pa_swieczka-nr-2', 'smak', 'dekoracja'),
+    'Lody rzemieślnicze 1l': (),
+}
+
+ATTRIBUTE_VALUES = {
+    'pa_topper': ('Sto lat', 'Wszystkiego najlepszego', 'Brak'),
+    'pa_swieczka-nr-1': tuple(str(number) for number in range(10)),
+    'pa_swieczka-nr-2': tuple(str(number) for number in range(10)),
+    'warstwa-1-najnizsza-warstwa': ('Wanilia', 'Czekolada', 'Truskawka'),
+    'warstwa-2-srodkowa': ('Pistacja', 'Mango', 'Malina'),
+    'warstwa-3-srodkowa': ('Solony karmel', 'Kokos', 'Jagoda'),
+    'warstwa-4-zewnetrzna-warstwa': ('Śmietanka', 'Czekolada', 'Sorbet cytrynowy'),
+    'dekoracja': ('Owoce', 'Posypka', 'Kwiaty jadalne'),
+    'smak': ('Truskawka', 'Czekolada', 'Wanilia'),
+}
+
+# Meta keys which real orders also have, but which are never read by the sync
+NOISE_META_KEYS = (
+    '_order_key', '_customer_user', '_billing_email', '_billing_postcode', '_shipping_postcode', '_order_currency',
+    '_cart_hash', '_prices_include_tax', '_customer_ip_address', '_customer_user_agent', '_created_via',
+    '_order_stock_reduced', '_recorded_sales', '_date_paid', '_paid_date',
+)
+
+SCHEMA = (
+    """
+    CREATE TABLE wp_posts (
+        ID BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+        post_type VARCHAR(20) NOT NULL DEFAULT 'post',
+        post_status VARCHAR(20) NOT NULL DEFAULT 'publish',
+        post_excerpt TEXT NOT NULL,
+        post_date DATETIME NOT NULL,
+        post_modified DATETIME NOT NULL,
+        post_modified_gmt DATETIME NOT NULL,
+        PRIMARY KEY (ID),
+        KEY type_status_date (post_type, post_status, post_date, ID)
+    ) DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE wp_postmeta (
+        meta_id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+        post_id BIGINT UNSIGNED NOT NULL DEFAULT 0,
+        meta_key VARCHAR(255) DEFAULT NULL,
+        meta_value LONGTEXT,
+        PRIMARY KEY (meta_id),
+        KEY post_id (post_id),
+        KEY meta_key (meta_key(191))
+    ) DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE wp_woocommerce_order_items (
+        order_item_id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+        order_item_name TEXT NOT NULL,
+        order_item_type VARCHAR(200) NOT NULL DEFAULT '',
+        order_id BIGINT UNSIGNED NOT NULL,
+        PRIMARY KEY (order_item_id),
+        KEY order_id (order_id)
+    ) DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE wp_woocommerce_order_itemmeta (
+        meta_id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+        order_item_id BIGINT UNSIGNED NOT NULL,
+        meta_key VARCHAR(255) DEFAULT NULL,
+        meta_value LONGTEXT,
+        PRIMARY KEY (meta_id),
+        KEY order_item_id (order_item_id),
+        KEY meta_key (meta_key(32))
+    ) DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE wp_options (
+        option_id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+        option_name VARCHAR(191) NOT NULL DEFAULT '',
+        option_value LONGTEXT NOT NULL,
+        PRIMARY KEY (option_id),
+        UNIQUE KEY option_name (option_name)
+    ) DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE wp_wc_orders (
+        id BIGINT UNSIGNED NOT NULL,
+        status VARCHAR(20) DEFAULT NULL,
+        type VARCHAR(20) DEFAULT NULL,
+        total_amount DECIMAL(26, 8) DEFAULT NULL,
+        payment_method_title TEXT DEFAULT NULL,
+        customer_note TEXT DEFAULT NULL,
+        date_created_gmt DATETIME DEFAULT NULL,
+        date_updated_gmt DATETIME DEFAULT NULL,
+        PRIMARY KEY (id),
+        KEY status (status),
+        KEY date_created (date_created_gmt),
+        KEY type_status_date (type, status, date_created_gmt),
+        KEY date_updated (date_updated_gmt)
+    ) DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE wp_wc_order_addresses (
+        id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+        order_id BIGINT UNSIGNED NOT NULL,
+        address_type VARCHAR(20) DEFAULT NULL,
+        first_name TEXT DEFAULT NULL,
+        last_name TEXT DEFAULT NULL,
+        company TEXT DEFAULT NULL,
+        address_1 TEXT DEFAULT NULL,
+        address_2 TEXT DEFAULT NULL,
+        city TEXT DEFAULT NULL,
+        phone VARCHAR(100) DEFAULT NULL,
+        PRIMARY KEY (id),
+        UNIQUE KEY address_type_order_id (address_type, order_id),
+        KEY order_id (order_id)
+    ) DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE wp_wc_order_operational_data (
+        id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+        order_id BIGINT UNSIGNED DEFAULT NULL,
+        new_order_email_sent TINYINT(1) DEFAULT NULL,
+        shipping_tax_amount DECIMAL(26, 8) DEFAULT NULL,
+        shipping_total_amount DECIMAL(26, 8) DEFAULT NULL,
+        PRIMARY KEY (id),
+        UNIQUE KEY order_id (order_id)
+    ) DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE wp_wc_orders_meta (
+        id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+        order_id BIGINT UNSIGNED DEFAULT NULL,
+        meta_key VARCHAR(255) DEFAULT NULL,
+        meta_value TEXT DEFAULT NULL,
+        PRIMARY KEY (id),
+        KEY meta_key_value (meta_key(100), meta_value(82)),
+        KEY order_id_meta_key_meta_value (order_id, meta_key(100), meta_value(82))
+    ) DEFAULT CHARSET=utf8mb4
+    """,
+)
+
+TABLES = (
+    'wp_posts', 'wp_postmeta', 'wp_woocommerce_order_items', 'wp_woocommerce_order_itemmeta', 'wp_options',
+    'wp_wc_orders', 'wp_wc_order_addresses', 'wp_wc_order_operational_data', 'wp_wc_orders_meta',
+)
+
+# Orders are written to db in batches of this size
+INSERT_BATCH_SIZE = 1000
+
+
+def create_schema(cursor):
+    """Drop and create tables with the same shape as WooCommerce legacy and HPOS order storage."""
+    for table in TABLES:
+        cursor.execute(f'DROP TABLE IF EXISTS {table}')
+    for create_table_query in SCHEMA:
+        cursor.execute(create_table_query)
+
+
+def generate_orders(connection, num_orders, first_order_id, seed=0, start_date=datetime(2024, 1, 1), hpos=False):
+    """Generate num_orders synthetic orders, returns their ids.
+
+    Ids of orders are mixed with other posts (products, pages) like in real shop, a few orders never had
+    their new order email sent. Orders are written to both legacy and HPOS tables, like WooCommerce does
+    with compatibility mode on, hpos decides which of them is authoritative.
+    """
+    rng = random.Random(seed)
+    cursor = connection.cursor()
+    create_schema(cursor)
+    cursor.execute(
+        "INSERT INTO wp_options (option_name, option_value) VALUES (%s, %s)",
+        ('woocommerce_custom_orders_table_enabled', 'yes' if hpos else 'no'))
+
+    order_ids = []
+    post_id = first_order_id
+    batch = _empty_batch()
+    order_item_id = 1
+
+    while len(order_ids) < num_orders:
+        created = start_date + timedelta(minutes=20 * len(order_ids))
+        if rng.random() < 0.1:
+            batch['posts'].append((post_id, 'product', 'publish', '', created, created, created))
+            post_id += 1
+            continue
+
+        order_item_id = _add_order(batch, rng, post_id, created, order_item_id)
+        order_ids.append(post_id)
+        post_id += 1
+
+        if len(order_ids) % INSERT_BATCH_SIZE == 0:
+            _insert_batch(cursor, batch)
+            connection.commit()
+            batch = _empty_batch()
+
+    _insert_batch(cursor, batch)
+    connection.commit()
+    cursor.close()
+    return order_ids
+
+
+def _empty_batch():
+    return {
+        'posts': [], 'postmeta': [], 'order_items': [], 'order_itemmeta': [],
+        'hpos_orders': [], 'hpos_addresses': [], 'hpos_operational_data': [], 'hpos_meta': [],
+    }
+
+
+def _add_order(batch, rng, order_id, created, order_item_id):
+    """Add rows of single order to batch, returns next free order_item_id."""
+    excerpt = rng.choice(('', '', '', 'Proszę o dostawę przed 12', 'Bez orzechów'))
+    batch['posts'].append((order_id, 'shop_order', 'wc-processing', excerpt, created, created, created))
+
+    shipping_method = rng.choice(SHIPPING_METHODS)
+    shipping_cost = 30 if shipping_method == SHIPPING_METHODS[0] else 0
+    delivery_date = (created + timedelta(days=rng.randint(1, 14))).strftime('%Y-%m-%d')
+
+    # Shipping item with delivery date
+    batch['order_items'].append((order_item_id, shipping_method, 'shipping', order_id))
+    batch['order_itemmeta'].append((order_item_id, '_delivery_date', delivery_date))
+    batch['order_itemmeta'].append((order_item_id, 'cost', str(shipping_cost)))
+    order_item_id += 1
+
+    # Line items with attributes
+    products_total = 0
+    for product_name in rng.sample(list(PRODUCTS), rng.randint(1, 3)):
+        quantity = rng.randint(1, 2)
+        products_total += 150 * quantity
+        batch['order_items'].append((order_item_id, product_name, 'line_item', order_id))
+        batch['order_itemmeta'].append((order_item_id, '_qty', str(quantity)))
+        batch['order_itemmeta'].append((order_item_id, '_line_total', str(150 * quantity)))
+        for meta_key in PRODUCTS[product_name]:
+            batch['order_itemmeta'].append((order_item_id, meta_key, rng.choice(ATTRIBUTE_VALUES[meta_key])))
+        order_item_id += 1
+
+    # Termobox fee
+    fee = 0
+    if shipping_cost and rng.random() < 0.3:
+        fee = 15
+        batch['order_items'].append((order_item_id, 'Styropian', 'fee', order_id))
+        batch['order_itemmeta'].append((order_item_id, '_fee_amount', str(fee)))
+        batch['order_itemmeta'].append((order_item_id, '_line_tax', '0'))
+        order_item_id += 1
+
+    meta = {
+        '_billing_first_name': rng.choice(('Anna', 'Jan', 'Kasia', 'Piotr')),
+        '_billing_last_name': rng.choice(('Nowak', 'Kowalski', 'Wiśniewska')),
+        '_billing_phone': f'5{rng.randint(10000000, 99999999)}',
+        '_order_total': f'{products_total + shipping_cost + fee}.00',
+        '_order_shipping': str(shipping_cost),
+        '_order_shipping_tax': '0',
+        '_payment_method_title': rng.choice(('Przelewy24', 'Płatność przy odbiorze', 'BLIK')),
+    }
+    if shipping_method == SHIPPING_METHODS[0]:
+        meta['_shipping_address_1'] = f'ul. Legnicka {rng.randint(1, 200)}'
+        meta['_shipping_city'] = 'Wrocław'
+        meta['Czas dostawy'] = rng.choice(('10:00-12:00', '12:00-14:00', '14:00-16:00'))
+        if rng.random() < 0.3:
+            meta['_shipping_address_2'] = f'm. {rng.randint(1, 50)}'
+    if rng.random() < 0.1:
+        meta['_billing_company'] = 'Firma sp. z o.o.'
+        meta['_shipping_company'] = 'Firma sp. z o.o.'
+        meta['NIP'] = str(rng.randint(1000000000, 9999999999))
+    if rng.random() < 0.97:
+        meta['_new_order_email_sent'] = 'true'
+    for meta_key in NOISE_META_KEYS:
+        meta[meta_key] = 'x' * rng.randint(5, 40)
+
+    batch['postmeta'].extend((order_id, meta_key, meta_value) for meta_key, meta_value in meta.items())
+
+    # The same order in HPOS tables, with header, addresses and totals in columns
+    batch['hpos_orders'].append((
+        order_id, 'wc-processing', 'shop_order', meta['_order_total'], meta['_payment_method_title'], excerpt,
+        created, created,
+    ))
+    batch['hpos_operational_data'].append((
+        order_id, 1 if '_new_order_email_sent' in meta else 0, meta['_order_shipping_tax'], meta['_order_shipping'],
+    ))
+    batch['hpos_addresses'].append((
+        order_id, 'billing', meta['_billing_first_name'], meta['_billing_last_name'], meta.get('_billing_company'),
+        None, None, None, meta['_billing_phone'],
+    ))
+    if '_shipping_address_1' in meta or '_shipping_company' in meta:
+        batch['hpos_addresses'].append((
+            order_id, 'shipping', None, None, meta.get('_shipping_company'), meta.get('_shipping_address_1'),
+            meta.get('_shipping_address_2'), meta.get('_shipping_city'), None,
+        ))
+    batch['hpos_meta'].extend(
+        (order_id, meta_key, meta[meta_key]) for meta_key in ('Czas dostawy', 'NIP', '_cart_hash') if meta_key in meta
+    )
+    return order_item_id
+
+
+def _insert_batch(cursor, batch):
+    if batch['posts']:
+        cursor.executemany(
+            "INSERT INTO wp_posts (ID, post_type, post_status, post_excerpt, post_date, post_modified, "
+            "post_modified_gmt) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+            batch['posts'])
+    if batch['postmeta']:
+        cursor.executemany(
+            "INSERT INTO wp_postmeta (post_id, meta_key, meta_value) VALUES (%s, %s, %s)",
+            batch['postmeta'])
+    if batch['order_items']:
+        cursor.executemany(
+            "INSERT INTO wp_woocommerce_order_items (order_item_id, order_item_name, order_item_type, order_id) "
+            "VALUES (%s, %s, %s, %s)",
+            batch['order_items'])
+    if batch['order_itemmeta']:
+        cursor.executemany(
+            "INSERT INTO wp_woocommerce_order_itemmeta (order_item_id, meta_key, meta_value) VALUES (%s, %s, %s)",
+            batch['order_itemmeta'])
+    if batch['hpos_orders']:
+        cursor.executemany(
+            "INSERT INTO wp_wc_orders (id, status, type, total_amount, payment_method_title, customer_note, "
+            "date_created_gmt, date_updated_gmt) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+            batch['hpos_orders'])
+    if batch['hpos_operational_data']:
+        cursor.executemany(
+            "INSERT INTO wp_wc_order_operational_data (order_id, new_order_email_sent, shipping_tax_amount, "
+            "shipping_total_amount) VALUES (%s, %s, %s, %s)",
+            batch['hpos_operational_data'])
+    if batch['hpos_addresses']:
+        cursor.executemany(
+            "INSERT INTO wp_wc_order_addresses (order_id, address_type, first_name, last_name, company, address_1, "
+            "address_2, city, phone) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+            batch['hpos_addresses'])
+    if batch['hpos_meta']:
+        cursor.executemany(
+            "INSERT INTO wp_wc_orders_meta (order_id, meta_key, meta_value) VALUES (%s, %s, %s)",
+            batch['hpos_meta'])
+
+
+def generate_sheet_rows(num_rows, seed=0, start_date=datetime(2024, 1, 1)):
+    """Generate spreadsheet rows in the order orders are appended, so they have to be sorted."""
+    rng = random.Random(seed)
+    rows = []
+    for row_index in range(num_rows):
+        delivery_date = start_date + timedelta(days=row_index // 30 + rng.randint(0, 14))
+        shipping_method = rng.choice(SHIPPING_METHODS)
+        rows.append([
+            str(16750 + row_index),
+            delivery_date.strftime('%Y-%m-%d'),
+            f'{rng.choice(list(PRODUCTS))} (1 szt.)',
+            'Brak dekoracji.',
+            shipping_method if rng.random() < 0.5 else f'Adres dostawy:\nul. Legnicka {rng.randint(1, 200)}, Wrocław',
+            '150.0 zł',
+            'Dostawa: 30.0',
+            'Przelewy24',
+            'Anna Nowak',
+            '',
+        ])
+    return rows
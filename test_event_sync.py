@@ -0,0 +1,92 @@
+"""Tests for event_sync methods, run against in-memory spreadsheet from fake_sheets."""
+import base64
+import json
+import os
+import tempfile
+import unittest
+from event_sync import get_event_order_ids, sync_orders
+from fake_sheets import create_fake_worksheet
+from metrics import metrics
+from push_to_excel import GoogleSheetsUpdater
+from sync_state import SyncState
+from test_push_to_excel import HEADER, order_row
+
+
+def pubsub_event(payload, **attributes):
+    return {'data': base64.b64encode(json.dumps(payload).encode()).decode(), 'attributes': attributes}
+
+
+class FakeDataFetcher:
+    """Fetcher of orders kept in a dict, order 16755 has no new order email sent yet."""
+
+    def __init__(self):
+        self.orders = {
+            16752: order_row(16752, '2024-06-02', 'Wrocław B'),
+            16754: order_row(16754, '2024-06-04', 'Wrocław A'),
+            16755: order_row(16755, '2024-06-05', 'Wrocław A'),
+        }
+        self.fetched_order_ids = []
+
+    def filter_sent_order_ids(self, order_ids):
+        return {order_id for order_id in order_ids if order_id in self.orders and order_id != 16755}
+
+    def fetch_orders_parallel(self, order_ids):
+        self.fetched_order_ids.extend(order_ids)
+        return [self.orders[order_id] for order_id in order_ids]
+
+
+class TestGetEventOrderIds(unittest.TestCase):
+    def test_order_ids_are_read_from_data_and_attributes(self):
+        """Test that ids come from order_ids list, webhook payload id and order_ids attribute."""
+        self.assertEqual(get_event_order_ids(pubsub_event({'order_ids': [16753, '16752', 16753]})), [16752, 16753])
+        self.assertEqual(get_event_order_ids(pubsub_event({'id': 16751, 'status': 'processing'})), [16751])
+        self.assertEqual(get_event_order_ids({'attributes': {'order_ids': '16751, 16760'}}), [16751, 16760])
+
+    def test_scheduled_and_malformed_messages_have_no_ids(self):
+        """Test that messages without ids or with broken data fall back to the regular run and are counted."""
+        metrics.reset()
+        self.assertEqual(get_event_order_ids({}), [])
+        self.assertEqual(get_event_order_ids(pubsub_event({'mode': 'scheduled'})), [])
+        self.assertEqual(get_event_order_ids({'data': 'not base64 json'}), [])
+        self.assertEqual(get_event_order_ids(pubsub_event({'order_ids': ['16751', 'abc']})), [16751])
+
+        if metrics.enabled:
+            self.assertEqual(metrics.counters, {'event_invalid_messages': 1, 'event_invalid_order_ids': 1})
+
+
+class TestSyncOrders(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.sync_state = SyncState(path=os.path.join(temp_dir.name, 'sync_state.json'))
+        self.worksheet = create_fake_worksheet([
+            HEADER,
+            order_row('16751', '2024-06-01', 'Wrocław A'),
+            order_row('16753', '2024-06-03', 'Wrocław A'),
+        ], rows=10)
+        self.updater = GoogleSheetsUpdater('spreadsheet', 'Arkusz9', worksheet=self.worksheet)
+        self.data_fetcher = FakeDataFetcher()
+
+    def test_only_new_sent_orders_are_inserted(self):
+        """Test that orders are inserted at their sorted position and saved in the checkpoint below the watermark."""
+        self.sync_state.record_synced([16751, 16753])
+        added_rows = sync_orders([16751, 16752, 16754, 16755], self.data_fetcher, self.updater, self.sync_state)
+
+        self.assertEqual([row[0] for row in added_rows], [16752, 16754])
+        self.assertEqual(self.data_fetcher.fetched_order_ids, [16752, 16754])
+        self.assertEqual(self.worksheet.col_values(1), ['order_id', '16751', '16752', '16753', '16754'])
+        saved_state = SyncState(path=self.sync_state.path)
+        self.assertEqual(saved_state.synced_order_ids, {16751, 16752, 16753, 16754})
+        self.assertEqual(saved_state.last_order_id, 16753)
+
+    def test_redelivered_message_does_not_duplicate_rows(self):
+        """Test that the same message handled twice writes the order only once."""
+        sync_orders([16752], self.data_fetcher, self.updater, self.sync_state)
+        added_rows = sync_orders([16752], self.data_fetcher, self.updater, self.sync_state)
+
+        self.assertEqual(added_rows, [])
+        self.assertEqual(self.worksheet.col_values(1), ['order_id', '16751', '16752', '16753'])
+
+
+if __name__ == '__main__':
+    unittest.main()
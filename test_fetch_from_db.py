@@ -1,18 +1,21 @@
 """Tests for fetch_from_db methods."""
 import unittest
-import mysql.connector
-from fetch_from_db import MySQLDataFetcher
+from fetch_from_db import DB_POOL_SIZE, WROCLAW_DELIVERY, MySQLDataFetcher, get_connection_pool
+
+
+DB_DATA = {
+    'username': 'blueluna_polishlody_raport',
+    'password': '+7ubV3m*cnW_',
+    'host': 'mn09.webd.pl',
+    'database': 'blueluna_polishlody_test',
+}
 
 
 class TestFetchFromDB(unittest.TestCase):
     def setUp(self):
-        self.db_data = {
-            'username': 'blueluna_polishlody_raport',
-            'password': '+7ubV3m*cnW_',
-            'host': 'mn09.webd.pl',
-            'database': 'blueluna_polishlody_test',
-        }
-        self.conn = mysql.connector.connect(**self.db_data)
+        self.db_data = dict(DB_DATA)
+        # Connection is borrowed from the same pool as MySQLDataFetcher uses
+        self.conn = get_connection_pool(**self.db_data).get_connection()
         self.cur = self.conn.cursor()
 
     def tearDown(self):
@@ -35,10 +38,119 @@ class TestFetchFromDB(unittest.TestCase):
 
         data_fetcher = MySQLDataFetcher(**self.db_data)
         actual_latest_order_id = data_fetcher.get_latest_order_id()
+        data_fetcher.close_connection()
 
         self.assertEqual(actual_latest_order_id, expected_latest_order_id)
 
 
+class TestFetchOrdersParallel(unittest.TestCase):
+    """Tests which borrow connections of the pool themselves, so setUp does not hold any."""
+
+    def setUp(self):
+        self.data_fetcher = MySQLDataFetcher(**DB_DATA)
+        self.addCleanup(self.data_fetcher.close_connection)
+
+    def test_parallel_fetch_while_order_ids_are_streamed(self):
+        """Test that parallel fetch uses connections left free by the open order id stream."""
+        for order_ids in self.data_fetcher.iter_sent_order_id_chunks(chunk_size=20):
+            records = self.data_fetcher.fetch_orders_parallel(order_ids, workers=3, batch_size=1)
+            self.assertEqual([record.order_id for record in records], sorted(order_ids))
+            break
+
+    def test_parallel_fetch_with_exhausted_pool(self):
+        """Test that orders are fetched by fewer workers when other borrowers hold connections of the pool."""
+        pool = get_connection_pool(**DB_DATA)
+        order_ids = sorted(self.data_fetcher.get_sent_order_ids())[:20]
+        connections = [pool.get_connection() for _ in range(DB_POOL_SIZE - 2)]
+        try:
+            records = self.data_fetcher.fetch_orders_parallel(order_ids, workers=3, batch_size=1)
+        finally:
+            for connection in connections:
+                connection.close()
+
+        self.assertEqual([record.order_id for record in records], order_ids)
+
+
+class TestOrderFormatting(unittest.TestCase):
+    def setUp(self):
+        self.meta = {
+            '_order_total': '150.00',
+            '_order_shipping': '20.00',
+            '_order_shipping_tax': '4.60',
+            '_shipping_address_1': 'Legnicka 5',
+            '_shipping_address_2': None,
+            '_shipping_city': 'Wrocław',
+            '_shipping_company': 'Lody sp. z o.o.',
+            '_billing_phone': '500600700',
+            'Czas dostawy': '10:00-12:00',
+        }
+
+    def test_product_price_is_computed_from_meta_strings(self):
+        """Test that product price is order total without shipping, shipping tax and termobox fee."""
+        self.assertEqual(MySQLDataFetcher._format_product_price(self.meta, 15), '110.4 zł')
+        self.assertEqual(MySQLDataFetcher._format_product_price(self.meta, None), '125.4 zł')
+
+    def test_product_price_is_none_without_shipping_tax(self):
+        """Test that product price is not computed when order meta has no _order_shipping_tax."""
+        del self.meta['_order_shipping_tax']
+
+        self.assertIsNone(MySQLDataFetcher._format_product_price(self.meta, 15))
+
+    def test_non_numeric_meta_value_counts_as_zero(self):
+        """Test that non-numeric meta_value is treated as 0 like MySQL does."""
+        self.meta['_order_shipping'] = 'brak'
+
+        self.assertEqual(MySQLDataFetcher._format_product_price(self.meta, 0), '145.4 zł')
+        self.assertEqual(MySQLDataFetcher._format_shipping_price(self.meta, None), 'Dostawa: 4.6')
+
+    def test_shipping_price_includes_termobox_fee(self):
+        """Test that shipping price sums shipping with its tax and shows termobox fee only when it was added."""
+        self.assertEqual(MySQLDataFetcher._format_shipping_price(self.meta, 15), 'Dostawa: 24.6\nStyropian: 15')
+        self.assertEqual(MySQLDataFetcher._format_shipping_price(self.meta, 0), 'Dostawa: 24.6')
+
+        del self.meta['_order_shipping_tax']
+        self.assertEqual(MySQLDataFetcher._format_shipping_price(self.meta, None), 'Dostawa: 20.0')
+        self.assertEqual(MySQLDataFetcher._format_shipping_price({}, None), 'Dostawa: None')
+
+    def test_wroclaw_delivery_address_with_company(self):
+        """Test that delivery in Wroclaw shows address from meta with company and NIP when they are given."""
+        rows = MySQLDataFetcher._shipping_rows([(7, WROCLAW_DELIVERY)], self.meta)
+
+        self.assertEqual(rows, [(7, WROCLAW_DELIVERY, 'Legnicka 5', None, 'Wrocław', 'Lody sp. z o.o.', '500600700',
+                                 '10:00-12:00')])
+        self.assertEqual(MySQLDataFetcher._format_shipping_address(rows, '8971234567'),
+                         'Adres dostawy:\nLegnicka 5, Wrocław, \nGodziny dostawy: 10:00-12:00 '
+                         '\ntelefon kontaktowy: 500600700, \nfirma: Lody sp. z o.o., \nNIP:8971234567')
+        self.assertEqual(MySQLDataFetcher._format_shipping_address(rows, None),
+                         'Adres dostawy:\nLegnicka 5, Wrocław, \nGodziny dostawy: 10:00-12:00 '
+                         '\ntelefon kontaktowy: 500600700, \nfirma: Lody sp. z o.o.')
+
+    def test_wroclaw_delivery_address_without_company(self):
+        """Test that delivery in Wroclaw without company shows street number only when it is given."""
+        self.meta['_shipping_company'] = None
+        rows = MySQLDataFetcher._shipping_rows([(7, WROCLAW_DELIVERY)], self.meta)
+
+        self.assertEqual(MySQLDataFetcher._format_shipping_address(rows, None),
+                         'Adres dostawy:\nLegnicka 5, Wrocław, \nGodziny dostawy: 10:00-12:00 '
+                         '\ntelefon kontaktowy: 500600700')
+
+        self.meta['_shipping_address_2'] = '12/3'
+        rows = MySQLDataFetcher._shipping_rows([(7, WROCLAW_DELIVERY)], self.meta)
+        self.assertEqual(MySQLDataFetcher._format_shipping_address(rows, None),
+                         'Adres dostawy:\nLegnicka 5 12/3, Wrocław, \nGodziny dostawy: 10:00-12:00'
+                         '\ntelefon kontaktowy: 500600700')
+
+    def test_pickup_point_address_is_its_label(self):
+        """Test that pickup point ignores address from meta and is shown as its label, with NIP when given."""
+        rows = MySQLDataFetcher._shipping_rows([(8, 'Odbiór osobisty - Bema (Bezpłatnie)')], self.meta)
+
+        self.assertEqual(rows, [(8, None, 'Odbiór osobisty - Bema (Bezpłatnie)', None, None, None, None, None)])
+        self.assertEqual(MySQLDataFetcher._format_shipping_address(rows, None), 'Odbiór Bema')
+        self.assertEqual(MySQLDataFetcher._format_shipping_address(rows, '8971234567'),
+                         'Odbiór Bema\nNIP:8971234567')
+        self.assertIsNone(MySQLDataFetcher._format_shipping_address([], None))
+
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -0,0 +1,61 @@
+"""Tests for local_export methods."""
+import csv
+import os
+import tempfile
+import unittest
+from local_export import CsvSink, SortedOrderExport, create_sink
+from test_push_to_excel import HEADER, order_row
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+
+class TestSortedOrderExport(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = temp_dir.name
+        self.rows = [
+            order_row(16751, '2024-06-03', 'Wrocław B'),
+            order_row(16752, '2024-06-01', 'Wrocław A'),
+            order_row(16753, None, 'Wrocław A'),
+            order_row(16754, '2024-06-03', 'Wrocław A'),
+            order_row(16755, '2024-06-02', 'Wrocław C'),
+        ]
+
+    def test_rows_are_merged_sorted_from_spilled_runs(self):
+        """Test that rows sorted in separate runs end up sorted in the CSV file and without empty delivery_date."""
+        path = os.path.join(self.temp_dir, 'orders.csv')
+        with SortedOrderExport(CsvSink(path, header=HEADER), run_rows=2, temp_dir=self.temp_dir) as export:
+            for row in self.rows:
+                export.append_orders([row])
+            self.assertEqual(len(export.runs), 2)
+
+        with open(path, newline='', encoding='utf-8') as csv_file:
+            values = list(csv.reader(csv_file))
+        self.assertEqual(values[0], HEADER)
+        self.assertEqual([row[0] for row in values[1:]], ['16752', '16755', '16754', '16751'])
+        self.assertEqual(values[1], [str(value) for value in self.rows[1]])
+        self.assertEqual(os.listdir(self.temp_dir), ['orders.csv'])
+
+    @unittest.skipIf(openpyxl is None, 'openpyxl is not installed')
+    def test_xlsx_export(self):
+        """Test that XLSX sink writes header and sorted rows."""
+        path = os.path.join(self.temp_dir, 'orders.xlsx')
+        with SortedOrderExport(create_sink(path, header=HEADER)) as export:
+            export.append_orders(self.rows)
+
+        worksheet = openpyxl.load_workbook(path, read_only=True).active
+        self.assertEqual([row[0] for row in worksheet.iter_rows(values_only=True)],
+                         ['order_id', 16752, 16755, 16754, 16751])
+
+    def test_unknown_format_is_refused(self):
+        """Test that only CSV and XLSX files can be exported."""
+        with self.assertRaises(ValueError):
+            create_sink(os.path.join(self.temp_dir, 'orders.ods'))
+
+
+if __name__ == '__main__':
+    unittest.main()
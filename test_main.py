@@ -0,0 +1,104 @@
+"""Tests for main methods, run against in-memory spreadsheet from fake_sheets."""
+import os
+import tempfile
+import unittest
+from fake_sheets import create_fake_worksheet
+from main import scan_orders
+from push_to_excel import GoogleSheetsUpdater
+from sync_state import SyncState
+from test_push_to_excel import HEADER, order_row
+
+
+class FakeDataFetcher:
+    """Fetcher of orders kept in a dict, every order has new order email sent."""
+
+    def __init__(self, orders):
+        self.orders = orders
+        self.modified_order_ids = []
+        self.modified_error = None
+        self.fetched_order_ids = []
+
+    def get_missing_order_ids(self, existing_order_ids, min_order_id=None):
+        existing_order_ids = set(map(int, existing_order_ids))
+        return sorted(order_id for order_id in self.orders
+                      if order_id >= (min_order_id or 0) and order_id not in existing_order_ids)
+
+    def fetch_orders_parallel(self, order_ids):
+        self.fetched_order_ids.extend(order_ids)
+        return [self.orders[order_id] for order_id in order_ids]
+
+    def get_last_modified(self):
+        return '2024-06-01 00:00:00'
+
+    def get_modified_order_ids(self, modified_since):
+        if self.modified_error is not None:
+            raise self.modified_error
+        return self.modified_order_ids, '2024-06-02 00:00:00'
+
+    def get_production_summary(self, delivery_dates):
+        return []
+
+
+class TestScanOrders(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.sync_state_path = os.path.join(temp_dir.name, 'sync_state.json')
+        self.worksheet = create_fake_worksheet([HEADER], rows=10)
+        self.updater = GoogleSheetsUpdater('spreadsheet', 'Arkusz9', worksheet=self.worksheet, requests_per_minute=None)
+        self.data_fetcher = FakeDataFetcher({
+            16751: order_row(16751, '2024-06-01', 'Wrocław A'),
+            16752: order_row(16752, '2024-06-03', 'Wrocław A'),
+        })
+
+    def scan(self, full_rescan=False):
+        return scan_orders(self.data_fetcher, self.updater, SyncState(path=self.sync_state_path), full_rescan)
+
+    def test_failed_run_is_retried_without_duplicates(self):
+        """Test that orders written by a run which failed before saving the checkpoint are not added again."""
+        self.scan(full_rescan=True)
+        self.data_fetcher.orders[16753] = order_row(16753, '2024-06-02', 'Wrocław B')
+        self.data_fetcher.orders[16754] = order_row(16754, '2024-06-04', 'Wrocław A')
+        self.data_fetcher.modified_error = RuntimeError('Lost connection to MySQL server')
+        with self.assertRaises(RuntimeError):
+            self.scan()
+
+        self.data_fetcher.modified_error = None
+        self.assertEqual(self.scan(), [])
+        self.assertEqual(self.worksheet.col_values(1), ['order_id', '16751', '16753', '16752', '16754'])
+
+    def test_checkpoint_is_saved_before_archiving(self):
+        """Test that orders written by the run are in the checkpoint even when archiving them fails."""
+        self.scan(full_rescan=True)
+        self.data_fetcher.orders[16753] = order_row(16753, '2024-06-02', 'Wrocław B')
+        archive_orders = self.updater.archive_orders
+
+        def failing_archive_orders(cutoff_date):
+            raise RuntimeError('Archive failed')
+
+        self.updater.archive_orders = failing_archive_orders
+        with self.assertRaises(RuntimeError):
+            scan_orders(self.data_fetcher, self.updater, SyncState(path=self.sync_state_path), archive_after_days=30)
+        self.assertIn(16753, SyncState(path=self.sync_state_path).synced_order_ids)
+
+        self.updater.archive_orders = archive_orders
+        scan_orders(self.data_fetcher, self.updater, SyncState(path=self.sync_state_path), archive_after_days=30)
+        self.assertEqual(self.worksheet.col_values(1), ['order_id'])
+        self.assertEqual(self.worksheet.spreadsheet.worksheet('Archiwum 2024-06').col_values(1),
+                         ['order_id', '16751', '16753', '16752'])
+
+    def test_orders_added_by_the_run_are_not_fetched_again(self):
+        """Test that orders written by the run are not rewritten as modified, only orders from earlier runs are."""
+        self.scan(full_rescan=True)
+        self.data_fetcher.orders[16751] = order_row(16751, '2024-06-01', 'Wrocław C')
+        self.data_fetcher.orders[16753] = order_row(16753, '2024-06-02', 'Wrocław B')
+        self.data_fetcher.modified_order_ids = [16751, 16753]
+        self.data_fetcher.fetched_order_ids = []
+        self.scan()
+
+        self.assertEqual(self.data_fetcher.fetched_order_ids, [16753, 16751])
+        self.assertEqual(self.worksheet.col_values(5)[1:], ['Wrocław C', 'Wrocław B', 'Wrocław A'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+"""Tests for metrics methods."""
+import os
+import tempfile
+import unittest
+from fake_sheets import create_fake_worksheet
+from metrics import RunMetrics
+
+
+class FakeCursor:
+    def execute(self, query, params=()):
+        self.rows = [(order_id,) for order_id in params]
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class TestRunMetrics(unittest.TestCase):
+    def test_query_is_named_after_calling_method(self):
+        """Test that queries are recorded under the name of the method which executed them, with rows."""
+        run_metrics = RunMetrics(enabled=True)
+        cursor = run_metrics.instrument_cursor(FakeCursor())
+
+        def get_sent_order_ids():
+            cursor.execute('SELECT post_id FROM wp_postmeta', (16751, 16752))
+            return cursor.fetchall()
+
+        get_sent_order_ids()
+        get_sent_order_ids()
+        cursor.close()
+
+        query = run_metrics.get_summary()['db']['get_sent_order_ids']
+        self.assertEqual(query['count'], 2)
+        self.assertEqual(query['rows'], 4)
+
+    def test_sheets_calls_and_textfile(self):
+        """Test that worksheet calls are recorded and written in Prometheus text format."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            textfile = os.path.join(temp_dir, 'order_sync.prom')
+            run_metrics = RunMetrics(enabled=True, textfile=textfile)
+            worksheet = run_metrics.instrument_sheets(create_fake_worksheet([['order_id'], ['16751']]))
+            worksheet.col_values(1)
+            run_metrics.count('orders_written', 2)
+            summary = run_metrics.emit()
+
+            with open(textfile, encoding='utf-8') as prometheus_file:
+                prometheus_text = prometheus_file.read()
+
+        self.assertEqual(summary['sheets']['col_values']['rows'], 2)
+        self.assertIn('order_sync_calls{kind="sheets",name="col_values"} 1', prometheus_text)
+        self.assertIn('order_sync_events{name="orders_written"} 2', prometheus_text)
+
+    def test_worksheets_opened_from_spreadsheet_are_recorded(self):
+        """Test that calls of worksheets returned by the spreadsheet are recorded, each of them once."""
+        run_metrics = RunMetrics(enabled=True)
+        worksheet = run_metrics.instrument_sheets(create_fake_worksheet([['order_id'], ['16751']]))
+        for other_worksheet in worksheet.spreadsheet.worksheets():
+            run_metrics.instrument_sheets(other_worksheet).col_values(1)
+        worksheet.spreadsheet.worksheet('Arkusz9').col_values(1)
+
+        sheets = run_metrics.get_summary()['sheets']
+        self.assertEqual(sheets['worksheets']['count'], 1)
+        self.assertEqual(sheets['worksheet']['count'], 1)
+        self.assertEqual(sheets['col_values']['count'], 2)
+
+    def test_disabled_metrics_do_not_wrap(self):
+        """Test that disabled metrics return cursor untouched and emit nothing."""
+        run_metrics = RunMetrics(enabled=False)
+        cursor = FakeCursor()
+
+        self.assertIs(run_metrics.instrument_cursor(cursor), cursor)
+        self.assertIsNone(run_metrics.emit())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+"""Tests for order_storage methods."""
+import sqlite3
+import unittest
+from order_storage import HposStorage, LegacyPostStorage, detect_storage
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def execute(self, query, params=()):
+        self.queries.append(query)
+
+    def fetchall(self):
+        return self.rows
+
+
+class TestOrderStorage(unittest.TestCase):
+    def test_hpos_meta_has_legacy_shape(self):
+        """Test that HPOS columns and meta rows are parsed into the same dict as wp_postmeta rows."""
+        legacy_rows = [
+            (16751, '_order_total', '250.00'), (16751, '_payment_method_title', 'Przelew'),
+            (16751, '_order_shipping', '20'), (16751, '_billing_first_name', 'Jan'),
+            (16751, '_billing_last_name', 'Kowalski'), (16751, '_shipping_address_1', 'Legnicka 1'),
+            (16751, '_shipping_city', 'Wrocław'), (16751, 'Czas dostawy', '10-12'), (16751, 'NIP', '111'),
+        ]
+        hpos_columns = ('250.00', 'Przelew', '20', None, 'Jan', 'Kowalski', None, None, 'Legnicka 1', None,
+                        'Wrocław', None)
+        hpos_rows = [(16751, *hpos_columns, 'Czas dostawy', '10-12'), (16751, *hpos_columns, 'NIP', '111')]
+
+        self.assertEqual(HposStorage.parse_order_meta(hpos_rows), LegacyPostStorage.parse_order_meta(legacy_rows))
+
+    def test_storage_is_detected_from_woocommerce_setting(self):
+        """Test that auto storage checks HPOS setting and explicit storage skips the query."""
+        self.assertIsInstance(detect_storage(FakeCursor([('yes',)]), 'auto'), HposStorage)
+        self.assertIsInstance(detect_storage(FakeCursor([('no',)]), 'auto'), LegacyPostStorage)
+        self.assertIsInstance(detect_storage(FakeCursor([]), 'auto'), LegacyPostStorage)
+
+        cursor = FakeCursor([('yes',)])
+        self.assertIsInstance(detect_storage(cursor, 'legacy'), LegacyPostStorage)
+        self.assertEqual(cursor.queries, [])
+
+    def test_cancelled_orders_are_not_produced(self):
+        """Test that cancelled, refunded and failed orders are left out of produced orders in both storages."""
+        connection = sqlite3.connect(':memory:')
+        self.addCleanup(connection.close)
+        connection.executescript("""
+            CREATE TABLE wp_posts (ID INTEGER, post_status TEXT);
+            CREATE TABLE wp_postmeta (post_id INTEGER, meta_key TEXT, meta_value TEXT);
+            CREATE TABLE wp_wc_orders (id INTEGER, status TEXT);
+            CREATE TABLE wp_wc_order_operational_data (order_id INTEGER, new_order_email_sent INTEGER);
+        """)
+        statuses = {16751: 'wc-processing', 16752: 'wc-cancelled', 16753: 'wc-refunded', 16754: 'wc-failed',
+                    16755: 'wc-completed'}
+        for order_id, status in statuses.items():
+            connection.execute('INSERT INTO wp_posts VALUES (?, ?)', (order_id, status))
+            connection.execute("INSERT INTO wp_postmeta VALUES (?, '_new_order_email_sent', 'true')", (order_id,))
+            connection.execute('INSERT INTO wp_wc_orders VALUES (?, ?)', (order_id, status))
+            connection.execute('INSERT INTO wp_wc_order_operational_data VALUES (?, 1)', (order_id,))
+
+        for storage in (LegacyPostStorage, HposStorage):
+            rows = connection.execute(storage.PRODUCED_ORDERS_SQL).fetchall()
+            self.assertEqual(sorted(order_id for order_id, in rows), [16751, 16755])
+
+
+if __name__ == '__main__':
+    unittest.main()
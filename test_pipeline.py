@@ -0,0 +1,39 @@
+"""Tests for pipeline methods."""
+import unittest
+from pipeline import run_pipeline
+
+
+class TestPipeline(unittest.TestCase):
+    def test_every_order_is_written_in_order(self):
+        """Test that rows of every batch reach the writer in order_id order."""
+        written_batches = []
+
+        def write_batch(rows):
+            written_batches.append(rows)
+            return rows
+
+        written_rows = run_pipeline(lambda order_ids: [[order_id] for order_id in order_ids],
+                                    write_batch, range(250), batch_size=100)
+
+        self.assertEqual(written_rows, [[order_id] for order_id in range(250)])
+        self.assertEqual(sum(written_batches, []), written_rows)
+
+    def test_fetch_error_is_raised(self):
+        """Test that error in the fetching thread stops the run."""
+        def fetch_batch(order_ids):
+            raise ValueError('Lost connection')
+
+        with self.assertRaises(ValueError):
+            run_pipeline(fetch_batch, lambda rows: rows, range(10))
+
+    def test_write_error_stops_fetching(self):
+        """Test that error while writing does not leave fetching thread blocked on full queue."""
+        def write_batch(rows):
+            raise KeyError('Quota exceeded')
+
+        with self.assertRaises(KeyError):
+            run_pipeline(lambda order_ids: [order_ids], write_batch, range(100), batch_size=1, queue_size=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+"""Tests for production_summary methods, run against in-memory spreadsheet from fake_sheets."""
+import unittest
+from fake_sheets import create_fake_worksheet
+from production_summary import SUMMARY_HEADER, ProductionSummary, merge_summary
+from push_to_excel import GoogleSheetsUpdater
+from test_push_to_excel import HEADER
+
+
+class FakeDataFetcher:
+    def __init__(self, summary_rows):
+        self.summary_rows = summary_rows
+        self.delivery_dates = []
+
+    def get_production_summary(self, delivery_dates):
+        self.delivery_dates.append(delivery_dates)
+        return [row for row in self.summary_rows if row[0] in delivery_dates]
+
+
+class TestProductionSummary(unittest.TestCase):
+    def test_only_touched_dates_are_replaced(self):
+        """Test that rows of refreshed dates are replaced, rows of other dates are kept and all stay sorted."""
+        values = [
+            SUMMARY_HEADER,
+            ['2024-06-01', 'Tort Chmurka', '', '2', '2'],
+            ['2024-06-02', 'Tort Chmurka', '', '1', '1'],
+            ['2024-06-03', 'Tort Słodziak', '', '1', '1'],
+        ]
+        summary_rows = [('2024-06-02', 'Tort lodowy DIY', 'Wanilia / Mango', 3, 2)]
+
+        self.assertEqual(merge_summary(values, summary_rows, ['2024-06-02', '2024-06-03']), [
+            SUMMARY_HEADER,
+            ['2024-06-01', 'Tort Chmurka', '', '2', '2'],
+            ['2024-06-02', 'Tort lodowy DIY', 'Wanilia / Mango', '3', '2'],
+        ])
+
+    def test_refresh_creates_worksheet_and_writes_it_at_once(self):
+        """Test that summary worksheet is created when missing and each refresh writes it with one request."""
+        worksheet = create_fake_worksheet([HEADER], rows=10)
+        updater = GoogleSheetsUpdater('spreadsheet', 'Arkusz9', worksheet=worksheet, requests_per_minute=None)
+        data_fetcher = FakeDataFetcher([
+            ('2024-06-01', 'Tort Chmurka', '', 2, 2),
+            ('2024-06-02', 'Tort Dzieciaki rządzą', 'Truskawka', 1, 1),
+        ])
+        production_summary = ProductionSummary(updater)
+
+        production_summary.refresh(data_fetcher, ['2024-06-02', '2024-06-01', None])
+        data_fetcher.summary_rows = [('2024-06-01', 'Tort Chmurka', '', 3, 3)]
+        production_summary.refresh(data_fetcher, ['2024-06-01'])
+
+        spreadsheet = worksheet.spreadsheet
+        self.assertEqual(data_fetcher.delivery_dates, [['2024-06-01', '2024-06-02'], ['2024-06-01']])
+        self.assertEqual(spreadsheet.worksheet('Podsumowanie').get_all_values(), [
+            SUMMARY_HEADER,
+            ['2024-06-01', 'Tort Chmurka', '', '3', '3'],
+            ['2024-06-02', 'Tort Dzieciaki rządzą', 'Truskawka', '1', '1'],
+        ])
+        self.assertEqual(spreadsheet.api_calls['add_worksheet'], 1)
+        self.assertEqual(spreadsheet.api_calls['values_batch_update'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
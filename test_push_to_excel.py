@@ -0,0 +1,186 @@
+"""Tests for push_to_excel methods, run against in-memory spreadsheet from fake_sheets."""
+import os
+import tempfile
+import unittest
+from datetime import date
+from fake_sheets import FakeAPIError, create_fake_worksheet
+from push_to_excel import GoogleSheetsUpdater
+from sync_state import SyncState
+
+HEADER = ['order_id', 'delivery_date', 'products', 'attributes', 'shipping_address',
+          'product_price', 'shipping_price', 'payment_method', 'name', 'comments']
+
+
+def order_row(order_id, delivery_date, shipping_address):
+    return [order_id, delivery_date, 'Lody x 1', '', shipping_address, '100.0 zł', 'Dostawa: 20.0', 'Przelew',
+            'Jan Kowalski', '']
+
+
+class TestGoogleSheetsUpdater(unittest.TestCase):
+    def setUp(self):
+        self.worksheet = create_fake_worksheet([
+            HEADER,
+            order_row('16751', '2024-06-01', 'Wrocław A'),
+            order_row('16753', '2024-06-03', 'Wrocław A'),
+        ], rows=10)
+        self.updater = GoogleSheetsUpdater('spreadsheet', 'Arkusz9', worksheet=self.worksheet, requests_per_minute=None)
+
+    def test_append_orders_skips_orders_without_delivery_date(self):
+        """Test that orders are appended with one request and orders without delivery_date are skipped."""
+        self.updater.refresh_mirror()
+        appended_rows = self.updater.append_orders([order_row(16754, '2024-06-02', 'Wrocław B'),
+                                                    order_row(16755, None, 'Wrocław C')])
+
+        self.assertEqual([row[0] for row in appended_rows], [16754])
+        self.assertEqual(self.worksheet.spreadsheet.api_calls['batch_update'], 1)
+        self.assertEqual(self.worksheet.get_all_values()[3][:2], ['16754', '2024-06-02'])
+        self.assertEqual(self.updater.mirror.get_values(), self.worksheet.get_all_values())
+
+    def test_insert_orders_sorted_keeps_spreadsheet_sorted(self):
+        """Test that new orders land at their sorted position and the mirror matches the worksheet."""
+        self.updater.insert_orders_sorted([order_row(16756, '2024-06-04', 'Wrocław A'),
+                                           order_row(16754, '2024-06-02', 'Wrocław B')])
+
+        values = self.worksheet.get_all_values()
+        self.assertEqual([row[0] for row in values[1:]], ['16751', '16754', '16753', '16756'])
+        self.assertEqual(self.updater.mirror.get_values(), values)
+        self.assertEqual(self.worksheet.spreadsheet.api_calls['batch_update'], 1)
+
+    def test_insert_orders_sorted_matches_server_sort(self):
+        """Test that inserted orders land where server sort puts them, ignoring case and with Polish letters."""
+        self.updater.append_orders([order_row('16752', '2024-06-01', 'wrocław B'),
+                                    order_row('16754', '2024-06-01', 'Łódź'),
+                                    order_row('16755', '2024-06-01', '')])
+        self.updater.sort_spreadsheet_server_side()
+        self.updater.insert_orders_sorted([order_row(16756, '2024-06-01', 'Lubin'),
+                                           order_row(16757, '2024-06-01', 'wrocław C'),
+                                           order_row(16758, '2024-06-01', 'Wrocław Ą')])
+
+        values = self.worksheet.get_all_values()
+        self.assertEqual([row[0] for row in values[1:]],
+                         ['16756', '16754', '16751', '16758', '16752', '16757', '16755', '16753'])
+        self.updater.sort_spreadsheet_server_side()
+        self.assertEqual(self.worksheet.get_all_values(), values)
+
+    def test_failed_insert_is_not_sent_again(self):
+        """Test that writes of failed insert are dropped with the mirror, so the next request does not repeat them."""
+        spreadsheet = self.worksheet.spreadsheet
+        batch_update = spreadsheet.batch_update
+
+        def batch_update_lost_response(body):
+            spreadsheet.batch_update = batch_update
+            batch_update(body)
+            raise FakeAPIError(503, 'Unavailable')
+
+        spreadsheet.batch_update = batch_update_lost_response
+        with self.assertRaises(FakeAPIError):
+            self.updater.insert_orders_sorted([order_row(16754, '2024-06-02', 'Wrocław B')])
+
+        self.assertEqual(self.updater.scheduler.pending, [])
+        self.assertIsNone(self.updater.mirror)
+        self.updater.insert_orders_sorted([order_row(16755, '2024-06-04', 'Wrocław A')])
+        values = self.worksheet.get_all_values()
+        self.assertEqual([row[0] for row in values[1:]], ['16751', '16754', '16753', '16755'])
+        self.assertEqual(self.updater.mirror.get_values(), values)
+
+    def test_sort_spreadsheet_server_side_removes_empty_rows(self):
+        """Test that server side sort orders rows by delivery_date and trims the grid."""
+        self.updater.refresh_mirror()
+        self.updater.append_orders([order_row(16752, '2024-06-02', 'Wrocław B')])
+        self.updater.sort_spreadsheet_server_side()
+
+        values = self.worksheet.get_all_values()
+        self.assertEqual([row[0] for row in values[1:]], ['16751', '16752', '16753'])
+        self.assertEqual(self.worksheet.row_count, 4)
+        self.assertIsNone(self.updater.mirror)
+
+    def test_sort_spreadsheet_server_side_keeps_rows_added_by_hand(self):
+        """Test that rows added by hand after the mirror was read are sorted and not removed with empty rows."""
+        self.updater.refresh_mirror()
+        self.worksheet.append_rows([order_row('16752', '2024-06-02', 'Wrocław B')])
+        self.updater.sort_spreadsheet_server_side()
+
+        values = self.worksheet.get_all_values()
+        self.assertEqual([row[0] for row in values[1:]], ['16751', '16752', '16753'])
+        self.assertEqual(self.worksheet.row_count, 10)
+
+    def test_update_orders_in_place_writes_changed_cells(self):
+        """Test that only cells which changed are rewritten and unchanged orders make no request."""
+        self.updater.refresh_mirror()
+        changed_row = order_row('16753', '2024-06-03', 'Wrocław A')
+        changed_row[8] = 'Anna Nowak'
+        updated_rows = self.updater.update_orders_in_place([order_row('16751', '2024-06-01', 'Wrocław A'),
+                                                            changed_row])
+        self.updater.flush()
+
+        self.assertEqual(updated_rows, [changed_row])
+        self.assertEqual(self.worksheet.spreadsheet.api_calls['values_batch_update'], 1)
+        self.assertEqual(self.worksheet.get_all_values()[2][8], 'Anna Nowak')
+        self.assertEqual(self.updater.mirror.get_values(), self.worksheet.get_all_values())
+
+    def test_update_orders_in_place_sorts_changed_delivery_date(self):
+        """Test that order moved to another delivery_date is moved to its sorted position."""
+        self.updater.refresh_mirror()
+        self.updater.update_orders_in_place([order_row('16751', '2024-06-05', 'Wrocław A')])
+
+        values = self.worksheet.get_all_values()
+        self.assertEqual([row[:2] for row in values[1:]], [['16753', '2024-06-03'], ['16751', '2024-06-05']])
+
+    def test_archive_orders_moves_old_rows_to_monthly_worksheets(self):
+        """Test that rows delivered before the cutoff move to archive worksheets in one batchUpdate."""
+        self.worksheet.spreadsheet._add_worksheet('Archiwum 2024-05', 1, 10, [HEADER])
+        self.updater.insert_orders_sorted([order_row(16749, '2024-05-30', 'Wrocław B'),
+                                           order_row(16750, '02.06.2024', 'Wrocław C')])
+        self.updater.flush()
+        calls_before = self.worksheet.spreadsheet.api_calls['batch_update']
+        archived_rows = self.updater.archive_orders(date(2024, 6, 3))
+
+        spreadsheet = self.worksheet.spreadsheet
+        self.assertEqual([row[0] for row in archived_rows], ['16750', '16749', '16751'])
+        self.assertEqual(spreadsheet.api_calls['batch_update'], calls_before + 1)
+        self.assertEqual(spreadsheet.worksheet('Archiwum 2024-05').col_values(1), ['order_id', '16749'])
+        self.assertEqual(spreadsheet.worksheet('Archiwum 2024-06').col_values(1), ['order_id', '16750', '16751'])
+        self.assertEqual(self.worksheet.col_values(1), ['order_id', '16753'])
+        self.assertEqual(self.updater.mirror.get_values(), self.worksheet.get_all_values())
+
+    def test_archive_orders_checks_rows_deleted_by_hand(self):
+        """Test that rows are archived by their current position when rows were deleted by hand since last read."""
+        self.updater.refresh_mirror()
+        self.worksheet.spreadsheet.batch_update({'requests': [{'deleteDimension': {'range': {
+            'sheetId': self.worksheet.id, 'dimension': 'ROWS', 'startIndex': 1, 'endIndex': 2,
+        }}}]})
+        archived_rows = self.updater.archive_orders(date(2024, 6, 2))
+
+        self.assertEqual(archived_rows, [])
+        self.assertEqual(self.worksheet.col_values(1), ['order_id', '16753'])
+
+    def test_archived_orders_are_not_missing_after_full_rescan(self):
+        """Test that full rescan with empty checkpoint finds archived orders in archive worksheets."""
+        self.worksheet.spreadsheet._add_worksheet('Archiwum 2024-05', 3, 10, [
+            HEADER, order_row('16748', '2024-05-30', 'Wrocław B'), order_row('16749', '2024-05-31', 'Wrocław C'),
+        ])
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        sync_state = SyncState(path=os.path.join(temp_dir.name, 'sync_state.json'))
+
+        self.updater.refresh_mirror()
+        existing_order_ids = self.updater.get_existing_order_ids()
+        sync_state.reset(existing_order_ids)
+        sync_state.record_archived(self.updater.get_archived_order_ids())
+
+        missing_order_ids = [order_id for order_id in range(16748, 16755) if str(order_id) not in existing_order_ids]
+        self.assertEqual(sync_state.remove_archived(missing_order_ids), [16750, 16752, 16754])
+
+    def test_quota_exceeded_raises_429(self):
+        """Test that the fake spreadsheet refuses requests above the per-minute quota."""
+        worksheet = create_fake_worksheet([HEADER], requests_per_minute=2, clock=lambda: 0)
+        worksheet.col_values(1)
+        worksheet.col_values(1)
+
+        with self.assertRaises(FakeAPIError) as error:
+            worksheet.col_values(1)
+        self.assertEqual(error.exception.code, 429)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+"""Tests for rendering_rules methods."""
+import unittest
+from rendering_rules import ATTRIBUTE_COLUMNS, load_rules
+
+
+def attribute_values(**values):
+    return [values.get(column) for column in ATTRIBUTE_COLUMNS]
+
+
+class TestRenderingRules(unittest.TestCase):
+    def setUp(self):
+        self.rules = load_rules()
+
+    def test_item_is_rendered_with_attributes_of_its_rule(self):
+        """Test that only attributes of the matching rule are shown, empty values are skipped."""
+        values = attribute_values(topper='Sto lat', swieczka_nr_2='5', warstwa_1='Wanilia', smak='Truskawka')
+
+        self.assertEqual(self.rules.render_item('Tort lodowy DIY', values),
+                         'Tort lodowy DIY:\n  Topper: Sto lat\n  Świeczka nr 2: 5\n  Warstwa 1: Wanilia')
+        self.assertEqual(self.rules.render_item('Tort Dzieciaki rządzą', values),
+                         'Tort Dzieciaki rządzą:\n  Topper: Sto lat\n  Świeczka nr 2: 5\n'
+                         '  Dzieciaki rządzą smak: Truskawka')
+        self.assertEqual(self.rules.render_item('Lody rzemieślnicze 1l', values), 'Lody rzemieślnicze 1l:')
+
+    def test_rule_of_higher_priority_wins(self):
+        """Test that name matching several rules gets the first rule, wherever its pattern is in the name."""
+        values = attribute_values(topper='Sto lat', warstwa_1='Wanilia')
+
+        self.assertEqual(self.rules.render_item('Tort Chmurka DIY', values),
+                         'Tort Chmurka DIY:\n  Topper: Sto lat\n  Warstwa 1: Wanilia')
+        self.assertEqual(self.rules.render_item('Dzieciaki Iglo', values), 'Dzieciaki Iglo:\n  Topper: Sto lat')
+
+    def test_pickup_points_have_labels(self):
+        """Test that pickup points are mapped to their labels and other shipping methods are not."""
+        self.assertEqual(self.rules.get_pickup_label('Odbiór osobisty - Olimpia Port (Bezpłatnie)'), 'Odbiór Olimpia')
+        self.assertIsNone(self.rules.get_pickup_label('Dostawa na terenie Wrocławia'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+"""Tests for sheets_scheduler methods, run against in-memory spreadsheet from fake_sheets."""
+import unittest
+from fake_sheets import FakeAPIError, create_fake_worksheet
+from sheets_scheduler import SheetsRequestScheduler, TokenBucket
+
+
+class FakeClock:
+    """Clock moved forward only by sleep, so tests never wait."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestSheetsRequestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.worksheet = create_fake_worksheet([['order_id', 'delivery_date']], clock=self.clock)
+
+    def create_scheduler(self, **kwargs):
+        return SheetsRequestScheduler(self.worksheet, clock=self.clock, sleep=self.clock.sleep, **kwargs)
+
+    def test_writes_waiting_for_quota_are_merged(self):
+        """Test that appends queued while the bucket is empty are sent as one batchUpdate."""
+        scheduler = self.create_scheduler()
+        scheduler.bucket.tokens = 0
+        for order_id in range(16751, 16756):
+            scheduler.append_rows([[order_id, '2024-06-01']])
+            scheduler.flush_if_ready()
+        scheduler.flush()
+
+        self.assertEqual(self.worksheet.spreadsheet.api_calls['batch_update'], 1)
+        self.assertEqual(self.worksheet.col_values(1), ['order_id', '16751', '16752', '16753', '16754', '16755'])
+
+    def test_quota_error_is_retried_with_backoff(self):
+        """Test that 429 error is retried after growing delays and the request finally succeeds."""
+        scheduler = self.create_scheduler(requests_per_minute=None)
+        responses = [FakeAPIError(429, 'Quota exceeded'), FakeAPIError(503, 'Unavailable'), ['order_id']]
+
+        def col_values(col):
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        self.assertEqual(scheduler.call(col_values, 1), ['order_id'])
+        self.assertEqual(len(self.clock.sleeps), 2)
+        self.assertTrue(0.5 <= self.clock.sleeps[0] <= 1 < self.clock.sleeps[1] <= 2)
+
+    def test_requests_stay_within_quota(self):
+        """Test that requests above the quota wait for it instead of failing with 429."""
+        scheduler = self.create_scheduler()
+        for _ in range(150):
+            scheduler.call(self.worksheet.col_values, 1)
+
+        self.assertEqual(self.worksheet.spreadsheet.throttled_calls, 0)
+        self.assertEqual(self.worksheet.spreadsheet.api_calls['col_values'], 150)
+        # 5 requests of the burst, then 55 per minute
+        self.assertAlmostEqual(self.clock.now, 145 * 60 / 55)
+
+    def test_client_error_is_not_retried(self):
+        """Test that errors other than 429 and 5xx are raised right away."""
+        scheduler = self.create_scheduler(requests_per_minute=None)
+        scheduler.update_values(1, 1, [['x']])
+        scheduler.pending[0] = ('requests', {'unknownRequest': {}}, 20)
+
+        with self.assertRaises(FakeAPIError):
+            scheduler.flush()
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_big_append_is_split_below_request_size_limit(self):
+        """Test that appended rows are split into batchUpdates below max_request_bytes, keeping their order."""
+        scheduler = self.create_scheduler(requests_per_minute=None, max_request_bytes=2000)
+        rows = [[order_id, 'x' * 100] for order_id in range(16751, 16801)]
+        scheduler.append_rows(rows)
+
+        appends = len(scheduler.pending)
+        self.assertGreater(appends, 1)
+        self.assertTrue(all(request_bytes <= 2000 for _, _, request_bytes in scheduler.pending))
+        scheduler.flush()
+        self.assertEqual(self.worksheet.spreadsheet.api_calls['batch_update'], appends)
+        self.assertEqual(self.worksheet.col_values(1)[1:], [str(order_id) for order_id in range(16751, 16801)])
+
+    def test_append_is_not_retried_after_server_error(self):
+        """Test that batch with appendCells is retried after 429 but not after 5xx, which may have applied it."""
+        scheduler = self.create_scheduler(requests_per_minute=None)
+        spreadsheet = self.worksheet.spreadsheet
+        batch_update = spreadsheet.batch_update
+        errors = [FakeAPIError(429, 'Quota exceeded'), FakeAPIError(503, 'Unavailable')]
+
+        def failing_batch_update(body):
+            if errors:
+                raise errors.pop(0)
+            return batch_update(body)
+
+        spreadsheet.batch_update = failing_batch_update
+        scheduler.append_rows([[16751, '2024-06-01']])
+        with self.assertRaises(FakeAPIError) as context:
+            scheduler.flush()
+        self.assertEqual(context.exception.code, 503)
+        self.assertEqual(len(self.clock.sleeps), 1)
+
+        errors.append(FakeAPIError(503, 'Unavailable'))
+        scheduler.pending = []
+        scheduler.batch_update([{'sortRange': {
+            'range': {'sheetId': self.worksheet.id, 'startRowIndex': 1},
+            'sortSpecs': [{'dimensionIndex': 0, 'sortOrder': 'ASCENDING'}],
+        }}])
+        scheduler.flush()
+        self.assertEqual(len(self.clock.sleeps), 2)
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_requests_are_spaced_by_quota(self):
+        """Test that after the burst every request waits for a token refilled at the quota rate."""
+        clock = FakeClock()
+        bucket = TokenBucket(62, burst=2, clock=clock, sleep=clock.sleep)
+        for _ in range(5):
+            bucket.acquire()
+
+        self.assertAlmostEqual(clock.now, 3.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
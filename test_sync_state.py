@@ -0,0 +1,59 @@
+"""Tests for sync_state methods."""
+import os
+import tempfile
+import unittest
+from sync_state import SyncState
+
+
+class TestSyncState(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'state.json')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_missing_file_is_empty_state(self):
+        """Test that state without checkpoint file requires full rescan."""
+        sync_state = SyncState(self.path)
+
+        self.assertTrue(sync_state.is_empty())
+        self.assertEqual(sync_state.get_window_start(16750), 16750)
+
+    def test_saved_state_is_loaded(self):
+        """Test that watermark and synced orders survive between runs."""
+        sync_state = SyncState(self.path, late_order_window=10)
+        sync_state.record_synced([17000, 17005])
+        sync_state.modified_since = '2024-06-01 12:00:00'
+        sync_state.save()
+
+        loaded_state = SyncState(self.path, late_order_window=10)
+        self.assertEqual(loaded_state.last_order_id, 17005)
+        self.assertEqual(loaded_state.modified_since, '2024-06-01 12:00:00')
+        self.assertEqual(loaded_state.synced_order_ids, {17000, 17005})
+        self.assertEqual(os.listdir(self.temp_dir.name), ['state.json'])
+
+    def test_synced_orders_below_window_are_dropped(self):
+        """Test that saved state keeps only orders checked again in incremental mode."""
+        sync_state = SyncState(self.path, late_order_window=10)
+        sync_state.reset([16800, 16995, 17000])
+        sync_state.save()
+
+        self.assertEqual(sync_state.get_window_start(16750), 16990)
+        self.assertEqual(SyncState(self.path).synced_order_ids, {16995, 17000})
+
+    def test_archived_orders_are_kept_as_ranges(self):
+        """Test that archived order ids are merged into ranges and excluded from missing orders."""
+        sync_state = SyncState(self.path)
+        sync_state.record_synced([16751, 16752, 16760])
+        sync_state.record_archived([16752, 16751, 16753, 16760])
+        sync_state.save()
+
+        loaded_state = SyncState(self.path)
+        self.assertEqual(loaded_state.archived_order_ranges, [[16751, 16753], [16760, 16760]])
+        self.assertEqual(loaded_state.synced_order_ids, set())
+        self.assertEqual(loaded_state.remove_archived([16750, 16752, 16754, 16760]), [16750, 16754])
+
+
+if __name__ == '__main__':
+    unittest.main()